@@ -0,0 +1,365 @@
+"""Artefacto precompilado del syllabus: texto extraído e índice de búsqueda en un solo archivo.
+
+Se genera en el paso de build (o la primera vez que arranca el bot) y se abre con mmap, así
+que cargarlo no vuelve a parsear el PDF ni copia el texto a memoria hasta que se usa:
+
+    python artefacto_syllabus.py --pdf syllabus.pdf --salida syllabus.idx
+
+La búsqueda usa BM25 sobre pasajes de párrafos: los términos se pliegan (sin acentos ni
+mayúsculas), se descartan las palabras vacías del español y se reducen con un stemming
+ligero (plurales y vocal final), así que 'contratos' encuentra 'contrato'.
+
+El artefacto guarda la firma del PDF de origen (mtime, tamaño y SHA-256). Si el mtime o el
+tamaño cambian se recalcula el hash, y solo se considera obsoleto si el contenido cambió.
+
+Formato: MAGIA, longitud de la cabecera (uint32), cabecera JSON y secciones binarias
+alineadas a 8 bytes (texto UTF-8, pasajes, términos ordenados y postings en CSR).
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from clasificador_juridico import tokenizar
+
+logger = logging.getLogger(__name__)
+
+MAGIA = b'LEXSYL01'
+VERSION_ARTEFACTO = 3  # 2: términos sin palabras vacías y con stemming ligero; 3: stemming simétrico
+PASAJE_MAX_CARACTERES = int(os.getenv('PASAJE_MAX_CARACTERES', '800'))
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_PUNTUACION_MINIMA = 0.01
+
+# Palabras vacías del español, ya plegadas (sin acentos)
+PALABRAS_VACIAS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aquel aquella aquellas aquellos aqui asi aun
+bajo bien cada como con contra cual cuales cualquier cuando cuanto de del desde donde dos durante e el
+ella ellas ello ellos en entre era eran eres es esa esas ese eso esos esta estaba estado estan estar
+estas este esto estos fue fueron fui ha habia han has hasta hay he la las le les lo los mas me mi mis
+mucho muy nada ni no nos nosotros o os otra otras otro otros para pero poco por porque que quien
+quienes se sea sean segun ser si sido sin sobre solo son su sus tal tambien tan tanto te tiene tienen
+todo todos tu tus un una unas uno unos usted ustedes y ya yo
+""".split())
+
+def raiz_ligera(token: str) -> str:
+    """Stemming ligero: quita el plural y la vocal final (contratos/contrato, leyes/ley, jueces/juez).
+    La vocal se quita igual haya plural o no, para que singular y plural lleguen a la misma raíz
+    (bases/base -> 'bas')"""
+    if not token.isalpha():
+        return token
+    if len(token) >= 5 and token.endswith('ces'):
+        token = token[:-3] + 'z'
+    elif len(token) >= 5 and token.endswith('es') and token[-3] not in 'aeiou':
+        token = token[:-2]
+    elif len(token) >= 4 and token.endswith('s') and token[-2] in 'aeo':
+        token = token[:-1]
+    if len(token) >= 4 and token[-1] in 'aeo':
+        token = token[:-1]
+    return token
+
+def terminos_busqueda(texto: str) -> list:
+    """Tokens plegados, sin palabras vacías y reducidos a su raíz ligera"""
+    return [raiz_ligera(token) for token in tokenizar(texto) if token not in PALABRAS_VACIAS]
+
+PATRON_LINEA = re.compile(r'[^\n]+')
+
+def ruta_artefacto_por_defecto(ruta_pdf: str) -> str:
+    return os.path.splitext(ruta_pdf)[0] + '.idx'
+
+def firma_fuente(ruta_pdf: str, calcular_hash: bool = True) -> dict:
+    estado = os.stat(ruta_pdf)
+    firma = {'mtime_ns': estado.st_mtime_ns, 'tamano': estado.st_size}
+    if calcular_hash:
+        resumen = hashlib.sha256()
+        with open(ruta_pdf, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+                resumen.update(bloque)
+        firma['sha256'] = resumen.hexdigest()
+    return firma
+
+def segmentar_pasajes(texto: str, max_caracteres: int = PASAJE_MAX_CARACTERES) -> list:
+    """Pasajes contiguos (inicio, fin) que respetan párrafos y no superan max_caracteres"""
+    pasajes = []
+    inicio = fin = None
+    for linea in PATRON_LINEA.finditer(texto):
+        if not linea.group().strip():
+            continue
+        parrafo_nuevo = fin is not None and '\n\n' in texto[fin:linea.start()]
+        if inicio is not None and (parrafo_nuevo or linea.end() - inicio > max_caracteres):
+            pasajes.append((inicio, fin))
+            inicio = None
+        if inicio is None:
+            inicio = linea.start()
+        fin = linea.end()
+    if inicio is not None:
+        pasajes.append((inicio, fin))
+    return pasajes
+
+def _indice_invertido(textos_pasajes: list) -> tuple:
+    """Términos ordenados y postings (pasaje, frecuencia) en CSR por término"""
+    postings = {}
+    longitudes = []
+    for indice, pasaje in enumerate(textos_pasajes):
+        tokens = terminos_busqueda(pasaje)
+        longitudes.append(len(tokens))
+        conteo = {}
+        for token in tokens:
+            conteo[token] = conteo.get(token, 0) + 1
+        for token, frecuencia in conteo.items():
+            postings.setdefault(token, []).append((indice, frecuencia))
+    terminos = sorted(postings)
+    punteros = np.zeros(len(terminos) + 1, dtype=np.int64)
+    pasajes = []
+    frecuencias = []
+    for posicion, termino in enumerate(terminos):
+        lista = postings[termino]
+        punteros[posicion + 1] = punteros[posicion] + len(lista)
+        pasajes.extend(p for p, _ in lista)
+        frecuencias.extend(f for _, f in lista)
+    return (terminos, punteros, np.asarray(pasajes, dtype=np.int32),
+            np.asarray(frecuencias, dtype=np.int32), np.asarray(longitudes, dtype=np.int32))
+
+def construir_artefacto(ruta_pdf: str, ruta_salida: Optional[str] = None, texto: Optional[str] = None) -> str:
+    """Extrae (si no se pasa el texto), indexa y escribe el artefacto de forma atómica"""
+    ruta_salida = ruta_salida or ruta_artefacto_por_defecto(ruta_pdf)
+    firma = firma_fuente(ruta_pdf)
+    if texto is None:
+        from extraccion_pdf import extraer_texto
+        texto = extraer_texto(ruta_pdf)
+
+    pasajes_caracteres = segmentar_pasajes(texto)
+    textos_pasajes = [texto[inicio:fin] for inicio, fin in pasajes_caracteres]
+    terminos, punteros, postings_pasajes, postings_frecuencias, longitudes = _indice_invertido(textos_pasajes)
+
+    # Desplazamientos en bytes de cada pasaje dentro del texto UTF-8
+    pasajes_bytes = np.zeros((len(pasajes_caracteres), 2), dtype=np.int64)
+    posicion_caracter = posicion_byte = 0
+    for indice, (inicio, fin) in enumerate(pasajes_caracteres):
+        posicion_byte += len(texto[posicion_caracter:inicio].encode('utf-8'))
+        pasajes_bytes[indice, 0] = posicion_byte
+        posicion_byte += len(texto[inicio:fin].encode('utf-8'))
+        pasajes_bytes[indice, 1] = posicion_byte
+        posicion_caracter = fin
+
+    bloque_terminos = b''.join(termino.encode('utf-8') for termino in terminos)
+    desplazamientos_terminos = np.zeros(len(terminos) + 1, dtype=np.int64)
+    desplazamientos_terminos[1:] = np.cumsum([len(termino.encode('utf-8')) for termino in terminos])
+
+    secciones = [
+        ('texto', texto.encode('utf-8'), 'u1'),
+        ('pasajes', pasajes_bytes.tobytes(), '<i8'),
+        ('terminos', bloque_terminos, 'u1'),
+        ('desplazamientos_terminos', desplazamientos_terminos.astype('<i8').tobytes(), '<i8'),
+        ('punteros', punteros.astype('<i8').tobytes(), '<i8'),
+        ('postings_pasajes', postings_pasajes.astype('<i4').tobytes(), '<i4'),
+        ('postings_frecuencias', postings_frecuencias.astype('<i4').tobytes(), '<i4'),
+        ('longitudes', longitudes.astype('<i4').tobytes(), '<i4'),
+    ]
+    cabecera = {
+        'version': VERSION_ARTEFACTO,
+        'fuente': firma,
+        'pasajes': len(pasajes_caracteres),
+        'terminos': len(terminos),
+        'secciones': {}
+    }
+    # Desplazamientos relativos al inicio de los datos (primer múltiplo de 8 tras la cabecera)
+    desplazamiento = 0
+    for nombre, datos, tipo in secciones:
+        cabecera['secciones'][nombre] = [desplazamiento, len(datos), tipo]
+        desplazamiento += len(datos) + (-len(datos)) % 8
+    cabecera_json = json.dumps(cabecera).encode('utf-8')
+    prefijo = MAGIA + struct.pack('<I', len(cabecera_json)) + cabecera_json
+    prefijo += b'\0' * ((-len(prefijo)) % 8)
+
+    directorio = os.path.dirname(os.path.abspath(ruta_salida))
+    descriptor, temporal = tempfile.mkstemp(prefix='.syllabus-', dir=directorio)
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            archivo.write(prefijo)
+            for _, datos, _ in secciones:
+                archivo.write(datos + b'\0' * ((-len(datos)) % 8))
+        os.replace(temporal, ruta_salida)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+    logger.info(f"Artefacto {ruta_salida}: {len(pasajes_caracteres)} pasajes, {len(terminos)} términos")
+    return ruta_salida
+
+class _Terminos:
+    """Secuencia ordenada de términos leída del mmap (bisect trabaja sobre ella sin decodificarla entera)"""
+    def __init__(self, bloque: memoryview, desplazamientos: np.ndarray):
+        self.bloque = bloque
+        self.desplazamientos = desplazamientos
+
+    def __len__(self) -> int:
+        return len(self.desplazamientos) - 1
+
+    def __getitem__(self, indice: int) -> str:
+        return bytes(self.bloque[self.desplazamientos[indice]:self.desplazamientos[indice + 1]]).decode('utf-8')
+
+    def posicion(self, termino: str) -> int:
+        indice = bisect.bisect_left(self, termino)
+        return indice if indice < len(self) and self[indice] == termino else -1
+
+class ArtefactoSyllabus:
+    """Vista de solo lectura sobre el artefacto mapeado en memoria"""
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        with open(ruta, 'rb') as archivo:
+            self._mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self._mapa[:len(MAGIA)] != MAGIA:
+                raise ValueError("no es un artefacto de syllabus")
+            (longitud,) = struct.unpack_from('<I', self._mapa, len(MAGIA))
+            self.cabecera = json.loads(bytes(self._mapa[len(MAGIA) + 4:len(MAGIA) + 4 + longitud]))
+            inicio_datos = len(MAGIA) + 4 + longitud
+            inicio_datos += (-inicio_datos) % 8
+            if self.cabecera.get('version') != VERSION_ARTEFACTO:
+                raise ValueError(f"versión {self.cabecera.get('version')} no soportada")
+            self._vista = memoryview(self._mapa)
+            secciones = {}
+            for nombre, (desplazamiento, tamano, tipo) in self.cabecera['secciones'].items():
+                dtype = np.dtype(tipo)
+                secciones[nombre] = np.frombuffer(self._mapa, dtype=dtype, count=tamano // dtype.itemsize,
+                                                  offset=inicio_datos + desplazamiento)
+        except Exception:
+            self.cerrar()
+            raise
+        self._bloque_texto = self._seccion_bytes('texto', inicio_datos)
+        self.terminos = _Terminos(self._seccion_bytes('terminos', inicio_datos), secciones['desplazamientos_terminos'])
+        self.pasajes = secciones['pasajes'].reshape(-1, 2)
+        self.punteros = secciones['punteros']
+        self.postings_pasajes = secciones['postings_pasajes']
+        self.postings_frecuencias = secciones['postings_frecuencias']
+        self.longitudes = secciones['longitudes']
+        self._texto = None
+        # Parte de la normalización BM25 que depende solo de la longitud de cada pasaje
+        longitud_media = float(self.longitudes.mean()) if len(self.longitudes) else 1.0
+        self._norma_bm25 = BM25_K1 * (1 - BM25_B + BM25_B * self.longitudes / max(longitud_media, 1e-9))
+
+    def _seccion_bytes(self, nombre: str, inicio_datos: int) -> memoryview:
+        desplazamiento, tamano, _ = self.cabecera['secciones'][nombre]
+        return self._vista[inicio_datos + desplazamiento:inicio_datos + desplazamiento + tamano]
+
+    @property
+    def fuente(self) -> dict:
+        return self.cabecera['fuente']
+
+    @property
+    def texto(self) -> str:
+        """Texto completo del syllabus (se decodifica la primera vez que se pide)"""
+        if self._texto is None:
+            self._texto = bytes(self._bloque_texto).decode('utf-8')
+        return self._texto
+
+    def __len__(self) -> int:
+        return len(self.pasajes)
+
+    def pasaje(self, indice: int) -> str:
+        inicio, fin = self.pasajes[indice]
+        return bytes(self._bloque_texto[inicio:fin]).decode('utf-8')
+
+    def vigente(self, ruta_pdf: str) -> bool:
+        """El PDF no ha cambiado: mtime y tamaño iguales o, si no, el mismo SHA-256"""
+        try:
+            firma = firma_fuente(ruta_pdf, calcular_hash=False)
+            if firma['mtime_ns'] == self.fuente['mtime_ns'] and firma['tamano'] == self.fuente['tamano']:
+                return True
+            return firma['tamano'] == self.fuente['tamano'] and firma_fuente(ruta_pdf)['sha256'] == self.fuente['sha256']
+        except OSError:
+            return False
+
+    def buscar(self, consulta: str, k: int = 5) -> list:
+        """Los k pasajes con mayor puntuación BM25: [(indice, puntuacion, texto)]"""
+        n = len(self.pasajes)
+        if n == 0:
+            return []
+        puntuaciones = np.zeros(n, dtype=np.float64)
+        for termino in set(terminos_busqueda(consulta)):
+            posicion = self.terminos.posicion(termino)
+            if posicion < 0:
+                continue
+            inicio, fin = self.punteros[posicion], self.punteros[posicion + 1]
+            frecuencia_documental = fin - inicio
+            idf = math.log(1 + (n - frecuencia_documental + 0.5) / (frecuencia_documental + 0.5))
+            pasajes = self.postings_pasajes[inicio:fin]
+            frecuencias = self.postings_frecuencias[inicio:fin]
+            puntuaciones[pasajes] += idf * frecuencias * (BM25_K1 + 1) / (frecuencias + self._norma_bm25[pasajes])
+        # Términos presentes en casi todos los pasajes aportan un idf residual: no cuentan como coincidencia
+        candidatos = np.flatnonzero(puntuaciones > BM25_PUNTUACION_MINIMA)
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-puntuaciones[candidatos], k)[:k]]
+        orden = candidatos[np.argsort(-puntuaciones[candidatos], kind='stable')]
+        return [(int(indice), float(puntuaciones[indice]), self.pasaje(indice)) for indice in orden]
+
+    def cerrar(self):
+        # Soltar las vistas antes de cerrar el mmap (si no, mmap.close lanza BufferError)
+        for atributo in ('terminos', 'pasajes', 'punteros', 'postings_pasajes', 'postings_frecuencias',
+                         'longitudes', '_norma_bm25', '_bloque_texto', '_vista'):
+            self.__dict__.pop(atributo, None)
+        try:
+            self._mapa.close()
+        except BufferError:
+            pass
+
+def cargar_artefacto(ruta_pdf: str, ruta_artefacto: Optional[str] = None) -> Optional[ArtefactoSyllabus]:
+    """Abre el artefacto si existe, es de esta versión y corresponde al PDF actual; None si no"""
+    ruta_artefacto = ruta_artefacto or ruta_artefacto_por_defecto(ruta_pdf)
+    if not os.path.exists(ruta_artefacto):
+        return None
+    try:
+        artefacto = ArtefactoSyllabus(ruta_artefacto)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Artefacto del syllabus no válido ({ruta_artefacto}): {e}")
+        return None
+    if not artefacto.vigente(ruta_pdf):
+        logger.info(f"{ruta_pdf} ha cambiado; hay que regenerar {ruta_artefacto}")
+        artefacto.cerrar()
+        return None
+    return artefacto
+
+def obtener_artefacto(ruta_pdf: str, texto: Optional[str] = None,
+                     ruta_artefacto: Optional[str] = None) -> Optional[ArtefactoSyllabus]:
+    """Artefacto vigente del PDF; si no existe o está obsoleto lo construye (con el texto dado, si lo hay)"""
+    artefacto = cargar_artefacto(ruta_pdf, ruta_artefacto)
+    if artefacto is not None:
+        return artefacto
+    try:
+        construir_artefacto(ruta_pdf, ruta_artefacto, texto)
+    except Exception as e:
+        logger.error(f"No se pudo construir el artefacto del syllabus: {e}")
+        return None
+    return cargar_artefacto(ruta_pdf, ruta_artefacto)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera el artefacto precompilado del syllabus")
+    parser.add_argument("--pdf", default="syllabus.pdf")
+    parser.add_argument("--salida", default=None, help="Por defecto, el nombre del PDF con extensión .idx")
+    parser.add_argument("--forzar", action="store_true", help="Regenerar aunque el artefacto esté al día")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not os.path.exists(args.pdf):
+        logger.info(f"No se encontró {args.pdf}; no hay artefacto que generar")
+        return
+    if not args.forzar:
+        artefacto = cargar_artefacto(args.pdf, args.salida)
+        if artefacto is not None:
+            logger.info(f"{artefacto.ruta} ya está al día")
+            artefacto.cerrar()
+            return
+    construir_artefacto(args.pdf, args.salida)
+
+if __name__ == "__main__":
+    main()
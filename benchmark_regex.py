@@ -0,0 +1,92 @@
+"""Benchmark de peor caso para los patrones de REGISTRO_REGEX.
+
+Construye textos adversarios (prefijos que casi coinciden repetidos, números muy largos,
+palabras clave sin cierre) de tamaño creciente y mide cada patrón. Al duplicar el tamaño
+del texto el tiempo debe duplicarse aproximadamente; un cociente cercano a 4 indica un
+patrón cuadrático (retroceso catastrófico):
+
+    python benchmark_regex.py --tamano 20000 --duplicaciones 3
+
+Con --comparar se miden también los patrones anteriores; conviene un tamaño pequeño
+(--tamano 500), porque algunos eran cúbicos y tardan minutos con textos de 20 000 caracteres.
+"""
+import argparse
+import re
+import sys
+import time
+
+from patrones_juridicos import REGISTRO_REGEX
+
+# Versiones anteriores de los patrones, para comparar con --comparar
+PATRONES_ANTERIORES = {
+    'consulta_demandar': (r'(cómo|como)\s+(demandar|demandar|demanda|reclamar).*', 0),
+    'consulta_que_hacer': (r'(qué|que)\s+(debo|debería|deberia).*(hacer|hacerlo|proceder).*(legal|ley|derecho)', 0),
+    'consulta_redactar': (r'(necesito|quiero)\s+(hacer|redactar).*(contrato|testamento|poder)', 0),
+    'consulta_duracion': (r'(cuánto|cuanto)\s+(tiempo|dura|tarda).*(proceso|juicio|demanda)', 0),
+    'consulta_derechos': (r'(qué|que)\s+(derechos|obligaciones).*(tengo|tiene)', 0),
+    'consulta_legalidad': (r'(es|son)\s+(legal|legales|ilegal|ilegales).*', 0),
+    'plazos': (r'(\d+)\s*(día|días|mes|meses|año|años)', re.IGNORECASE),
+    'referencias': (r'(ley|artículo|art|Ley|Artículo|Art)\s*(\d+[/\-]\d+|\d+)', 0),
+}
+
+# Fragmentos que se repiten hasta el tamaño pedido; cada uno empieza una coincidencia
+# que no puede completarse
+FRAGMENTOS_ADVERSARIOS = [
+    "que debo ", "que debo hacer ", "necesito hacer ", "cuanto tiempo ",
+    "que derechos ", "como ", "es ", "1", "1 ", "art ", "ley 1", "a",
+]
+
+def textos_adversarios(tamano: int) -> dict:
+    textos = {fragmento: (fragmento * (tamano // len(fragmento) + 1))[:tamano] for fragmento in FRAGMENTOS_ADVERSARIOS}
+    textos['art + número largo'] = "art " + "1" * tamano
+    return textos
+
+def medir(patron: re.Pattern, texto: str, repeticiones: int) -> float:
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        patron.findall(texto)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+def evaluar(patrones: dict, tamano: int, duplicaciones: int, repeticiones: int, umbral: float) -> bool:
+    """Imprime el peor cociente de crecimiento por patrón; devuelve False si alguno es superlineal"""
+    tamanos = [tamano * 2 ** i for i in range(duplicaciones + 1)]
+    conjuntos = [textos_adversarios(t) for t in tamanos]
+    correcto = True
+    print(f"{'patrón':<22}{'peor entrada':<22}{'tiempo máx (ms)':>16}{'cociente':>10}")
+    for nombre, patron in patrones.items():
+        peor_cociente, peor_entrada, peor_tiempo = 0.0, "", 0.0
+        for clave in conjuntos[0]:
+            tiempos = [medir(patron, textos[clave], repeticiones) for textos in conjuntos]
+            # Cociente medio entre tamaños consecutivos (los tiempos mínimos son ruidosos)
+            cociente = (tiempos[-1] / max(tiempos[0], 1e-7)) ** (1 / duplicaciones)
+            if tiempos[-1] > 1e-4 and cociente > peor_cociente:
+                peor_cociente, peor_entrada = cociente, clave
+            peor_tiempo = max(peor_tiempo, tiempos[-1])
+        superlineal = peor_cociente > umbral
+        correcto &= not superlineal
+        marca = "  ⚠️ superlineal" if superlineal else ""
+        print(f"{nombre:<22}{repr(peor_entrada):<22}{peor_tiempo * 1000:>16.2f}{peor_cociente:>10.2f}{marca}")
+    return correcto
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de peor caso de los patrones regex")
+    parser.add_argument("--tamano", type=int, default=20000, help="Caracteres del texto más corto")
+    parser.add_argument("--duplicaciones", type=int, default=3)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--umbral", type=float, default=2.8,
+                        help="Cociente por duplicación a partir del cual se considera superlineal")
+    parser.add_argument("--comparar", action="store_true", help="Medir también los patrones anteriores")
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        print("== Patrones anteriores ==")
+        anteriores = {nombre: re.compile(patron, flags) for nombre, (patron, flags) in PATRONES_ANTERIORES.items()}
+        evaluar(anteriores, args.tamano, args.duplicaciones, 1, args.umbral)
+        print("\n== Registro actual ==")
+    correcto = evaluar(REGISTRO_REGEX.patrones, args.tamano, args.duplicaciones, args.repeticiones, args.umbral)
+    return 0 if correcto else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
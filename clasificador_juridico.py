@@ -0,0 +1,145 @@
+"""Clasificador estadístico local (solo NumPy) que decide si un mensaje trata de un tema jurídico.
+
+Características: TF-IDF sobre unigramas y bigramas con *hashing trick* (sin vocabulario).
+Modelo: regresión logística con regularización L2 entrenada por descenso de gradiente.
+Las matrices se manejan en formato disperso (CSR) con arrays de NumPy, así que clasificar
+un lote de mensajes cuesta unos pocos microsegundos por mensaje.
+"""
+import re
+import unicodedata
+import zlib
+from typing import Optional
+
+import numpy as np
+
+DIMENSION_HASH = 2 ** 16
+LONGITUD_RAIZ = 4
+
+MARCAS_COMBINANTES = re.compile('[\u0300-\u036f]')
+PATRON_TOKEN = re.compile(r'[^\W_]+')
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin acentos, para que 'jurídico' y 'juridico' compartan característica"""
+    if texto.isascii():
+        return texto.lower()
+    return MARCAS_COMBINANTES.sub('', unicodedata.normalize('NFKD', texto)).casefold()
+
+def tokenizar(texto: str) -> list:
+    return PATRON_TOKEN.findall(normalizar(texto))
+
+def bigramas(tokens: list) -> list:
+    return [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+def caracteristicas_tokens(tokens: list, ngramas: Optional[list] = None) -> list:
+    """Unigramas, bigramas y raíces truncadas (despido/despedir/despidos comparten 'desp')"""
+    raices = [f"~{token[:LONGITUD_RAIZ]}" for token in tokens if len(token) > LONGITUD_RAIZ]
+    return tokens + (bigramas(tokens) if ngramas is None else ngramas) + raices
+
+def caracteristicas(texto: str) -> list:
+    return caracteristicas_tokens(tokenizar(texto))
+
+class ClasificadorJuridico:
+    """Regresión logística sobre TF-IDF con hashing; predice P(tema jurídico)"""
+    def __init__(self, dimension: int = DIMENSION_HASH):
+        self.dimension = dimension
+        self.idf = np.ones(dimension, dtype=np.float32)
+        self.pesos = np.zeros(dimension, dtype=np.float32)
+        self.sesgo = 0.0
+
+    def _indice(self, caracteristica: str) -> int:
+        # crc32 es estable entre procesos (hash() de Python no lo es)
+        return zlib.crc32(caracteristica.encode('utf-8')) % self.dimension
+
+    def _conteos(self, listas_caracteristicas) -> tuple:
+        """Matriz documento-característica de frecuencias en CSR: (datos, columnas, punteros)"""
+        columnas = []
+        datos = []
+        punteros = [0]
+        for lista in listas_caracteristicas:
+            conteo = {}
+            for caracteristica in lista:
+                indice = self._indice(caracteristica)
+                conteo[indice] = conteo.get(indice, 0) + 1
+            columnas.extend(conteo.keys())
+            datos.extend(conteo.values())
+            punteros.append(len(columnas))
+        return (np.asarray(datos, dtype=np.float32),
+                np.asarray(columnas, dtype=np.int64),
+                np.asarray(punteros, dtype=np.int64))
+
+    def vectorizar(self, listas_caracteristicas) -> tuple:
+        """TF-IDF (tf sublineal) normalizado por L2 en formato CSR, más el índice de fila de cada valor"""
+        datos, columnas, punteros = self._conteos(listas_caracteristicas)
+        filas = np.repeat(np.arange(len(punteros) - 1), np.diff(punteros))
+        valores = (1 + np.log(datos)) * self.idf[columnas]
+        normas = np.sqrt(np.bincount(filas, weights=valores ** 2, minlength=len(punteros) - 1))
+        normas[normas == 0] = 1
+        return valores / normas[filas], columnas, filas
+
+    def _puntuaciones(self, valores, columnas, filas, n: int) -> np.ndarray:
+        return np.bincount(filas, weights=valores * self.pesos[columnas], minlength=n) + self.sesgo
+
+    def entrenar(self, textos: list, etiquetas: list, epocas: int = 300,
+                 tasa: float = 5.0, l2: float = 1e-4) -> float:
+        """Ajusta IDF y pesos; devuelve la pérdida logística final"""
+        n = len(textos)
+        etiquetas = np.asarray(etiquetas, dtype=np.float64)
+        listas = [caracteristicas(texto) for texto in textos]
+        _, columnas, punteros = self._conteos(listas)
+        frecuencia_documental = np.bincount(columnas, minlength=self.dimension)
+        self.idf = (np.log((1 + n) / (1 + frecuencia_documental)) + 1).astype(np.float32)
+
+        valores, columnas, filas = self.vectorizar(listas)
+        pesos = np.zeros(self.dimension, dtype=np.float64)
+        sesgo = 0.0
+        # Compensar clases desbalanceadas
+        positivos = max(etiquetas.sum(), 1)
+        negativos = max(n - etiquetas.sum(), 1)
+        ponderacion = np.where(etiquetas == 1, n / (2 * positivos), n / (2 * negativos))
+        perdida = 0.0
+        for _ in range(epocas):
+            z = np.bincount(filas, weights=valores * pesos[columnas], minlength=n) + sesgo
+            p = 1 / (1 + np.exp(-z))
+            error = (p - etiquetas) * ponderacion
+            gradiente = np.bincount(columnas, weights=valores * error[filas], minlength=self.dimension) / n
+            pesos -= tasa * (gradiente + l2 * pesos)
+            sesgo -= tasa * error.mean()
+            p = np.clip(p, 1e-9, 1 - 1e-9)
+            perdida = float(-np.mean(ponderacion * (etiquetas * np.log(p) + (1 - etiquetas) * np.log(1 - p))))
+        self.pesos = pesos.astype(np.float32)
+        self.sesgo = float(sesgo)
+        return perdida
+
+    def _probabilidades(self, listas_caracteristicas: list) -> np.ndarray:
+        if not listas_caracteristicas:
+            return np.zeros(0, dtype=np.float64)
+        valores, columnas, filas = self.vectorizar(listas_caracteristicas)
+        z = self._puntuaciones(valores, columnas, filas, len(listas_caracteristicas))
+        return 1 / (1 + np.exp(-z))
+
+    def classify_batch(self, textos) -> np.ndarray:
+        """Probabilidad de que cada texto sea jurídico, calculada para todo el lote a la vez"""
+        return self._probabilidades([caracteristicas(texto) for texto in textos])
+
+    def probabilidad(self, texto: str) -> float:
+        return float(self.classify_batch([texto])[0])
+
+    def probabilidad_tokens(self, tokens: list, ngramas: Optional[list] = None) -> float:
+        """Como probabilidad(), para un texto ya normalizado y tokenizado"""
+        return float(self._probabilidades([caracteristicas_tokens(tokens, ngramas)])[0])
+
+    def guardar(self, ruta: str):
+        np.savez_compressed(ruta, idf=self.idf, pesos=self.pesos, sesgo=np.array([self.sesgo]),
+                            dimension=np.array([self.dimension]))
+
+    @classmethod
+    def cargar(cls, ruta: str) -> Optional["ClasificadorJuridico"]:
+        try:
+            datos = np.load(ruta)
+        except (OSError, ValueError):
+            return None
+        clasificador = cls(int(datos['dimension'][0]))
+        clasificador.idf = datos['idf']
+        clasificador.pesos = datos['pesos']
+        clasificador.sesgo = float(datos['sesgo'][0])
+        return clasificador
@@ -0,0 +1,225 @@
+"""Corpus jurídico consultable: códigos, leyes y memorandos en PDF indexados con SQLite FTS5.
+
+Cada PDF se trocea por página y por sección (artículo, capítulo, título...) y los fragmentos
+se guardan en una tabla FTS5 con ranking BM25. La ingesta es incremental: los archivos se
+identifican por el SHA-256 de su contenido, de modo que los que no cambiaron (o solo se
+movieron) no se vuelven a extraer, y añadir un PDF solo cuesta indexar ese PDF:
+
+    python corpus_juridico.py --directorio corpus --db corpus_juridico.db
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Optional
+
+from artefacto_syllabus import PALABRAS_VACIAS, raiz_ligera
+from clasificador_juridico import tokenizar
+
+logger = logging.getLogger(__name__)
+
+CORPUS_DIR = os.getenv('CORPUS_DIR', 'corpus')
+CORPUS_DB = os.getenv('CORPUS_DB', 'corpus_juridico.db')
+FRAGMENTO_CORPUS_MAX_CARACTERES = int(os.getenv('FRAGMENTO_CORPUS_MAX_CARACTERES', '1500'))
+
+PATRON_SECCION = re.compile(
+    r'^\s*((art[íi]culo|cap[íi]tulo|t[íi]tulo|secci[óo]n|cl[áa]usula|libro|disposici[óo]n)\s+[\w.º°-]+.*)$',
+    re.IGNORECASE
+)
+
+def huella_archivo(ruta: str) -> str:
+    resumen = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+def fragmentar_pagina(texto: str, seccion: Optional[str],
+                      max_caracteres: int = FRAGMENTO_CORPUS_MAX_CARACTERES) -> tuple:
+    """Fragmentos (seccion, texto) de una página; devuelve también la sección abierta al final,
+    que continúa en la página siguiente"""
+    fragmentos = []
+    actual = []
+    longitud = 0
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea:
+            continue
+        encabezado = PATRON_SECCION.match(linea)
+        if actual and (encabezado or longitud + len(linea) > max_caracteres):
+            fragmentos.append((seccion, '\n'.join(actual)))
+            actual = []
+            longitud = 0
+        if encabezado:
+            seccion = encabezado.group(1)[:120]
+        actual.append(linea)
+        longitud += len(linea) + 1
+    if actual:
+        fragmentos.append((seccion, '\n'.join(actual)))
+    return fragmentos, seccion
+
+def consulta_fts(texto: str) -> Optional[str]:
+    """Consulta FTS5 segura a partir de texto libre: cada término sin palabras vacías se busca por
+    su raíz y también tal cual, porque el índice guarda las palabras originales sin reducir
+    (la raíz de 'leyes' es 'ley', que no casa con 'leyes')"""
+    terminos = []
+    for token in tokenizar(texto):
+        if token in PALABRAS_VACIAS:
+            continue
+        for forma in (raiz_ligera(token), token):
+            termino = f'"{forma}"*' if len(forma) >= 4 else f'"{forma}"'
+            if termino not in terminos:
+                terminos.append(termino)
+    return ' OR '.join(terminos) or None
+
+class CorpusJuridico:
+    """Índice FTS5 de los PDF de un directorio (una conexión por operación, como el resto del bot)"""
+    def __init__(self, ruta_db: str = CORPUS_DB):
+        self.ruta_db = ruta_db
+        self._inicializar()
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.ruta_db)
+        conn.execute("PRAGMA journal_mode=WAL")  # Las búsquedas no esperan a la ingesta
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _inicializar(self):
+        conn = self._conectar()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documentos
+                (huella TEXT PRIMARY KEY, ruta TEXT, tamano INTEGER, mtime_ns INTEGER,
+                 paginas INTEGER, fragmentos INTEGER, indexado REAL);
+            CREATE INDEX IF NOT EXISTS idx_documentos_ruta ON documentos (ruta);
+            CREATE TABLE IF NOT EXISTS fragmentos
+                (id INTEGER PRIMARY KEY,
+                 huella TEXT REFERENCES documentos (huella) ON DELETE CASCADE,
+                 pagina INTEGER, seccion TEXT, texto TEXT);
+            CREATE INDEX IF NOT EXISTS idx_fragmentos_huella ON fragmentos (huella);
+            CREATE VIRTUAL TABLE IF NOT EXISTS fragmentos_fts USING fts5
+                (texto, seccion, content='fragmentos', content_rowid='id',
+                 tokenize='unicode61 remove_diacritics 2');
+            CREATE TRIGGER IF NOT EXISTS fragmentos_ai AFTER INSERT ON fragmentos BEGIN
+                INSERT INTO fragmentos_fts (rowid, texto, seccion) VALUES (new.id, new.texto, new.seccion);
+            END;
+            CREATE TRIGGER IF NOT EXISTS fragmentos_ad AFTER DELETE ON fragmentos BEGIN
+                INSERT INTO fragmentos_fts (fragmentos_fts, rowid, texto, seccion)
+                VALUES ('delete', old.id, old.texto, old.seccion);
+            END;
+        ''')
+        conn.commit()
+        conn.close()
+
+    def _indexar_archivo(self, conn: sqlite3.Connection, ruta: str, huella: str, estado: os.stat_result) -> int:
+        from extraccion_pdf import iterar_paginas_pdf
+        filas = []
+        seccion = None
+        paginas = 0
+        for numero, texto in enumerate(iterar_paginas_pdf(ruta, acotado=True), start=1):
+            paginas = numero
+            fragmentos, seccion = fragmentar_pagina(texto, seccion)
+            filas.extend((huella, numero, seccion_fragmento, texto_fragmento)
+                         for seccion_fragmento, texto_fragmento in fragmentos)
+        # Borrar el documento arrastra sus fragmentos (y los triggers los quitan del índice FTS)
+        conn.execute("DELETE FROM documentos WHERE huella = ?", (huella,))
+        conn.execute('''INSERT INTO documentos (huella, ruta, tamano, mtime_ns, paginas, fragmentos, indexado)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (huella, ruta, estado.st_size, estado.st_mtime_ns, paginas, len(filas), time.time()))
+        conn.executemany("INSERT INTO fragmentos (huella, pagina, seccion, texto) VALUES (?, ?, ?, ?)", filas)
+        return len(filas)
+
+    def ingerir_directorio(self, directorio: str = CORPUS_DIR) -> dict:
+        """Indexa los PDF nuevos o modificados y retira los que ya no están; devuelve el resumen"""
+        resumen = {'nuevos': 0, 'sin_cambios': 0, 'movidos': 0, 'eliminados': 0, 'errores': 0, 'fragmentos': 0}
+        archivos = []
+        for raiz, _, nombres in os.walk(directorio):
+            archivos.extend(os.path.join(raiz, nombre) for nombre in sorted(nombres) if nombre.lower().endswith('.pdf'))
+
+        conn = self._conectar()
+        conocidos = {ruta: (huella, tamano, mtime_ns) for huella, ruta, tamano, mtime_ns
+                     in conn.execute("SELECT huella, ruta, tamano, mtime_ns FROM documentos")}
+        vistas = set()
+        for ruta in sorted(archivos):
+            try:
+                estado = os.stat(ruta)
+                previo = conocidos.get(ruta)
+                # Mismo tamaño y mtime: no hace falta ni leer el archivo
+                if previo and previo[1] == estado.st_size and previo[2] == estado.st_mtime_ns:
+                    vistas.add(previo[0])
+                    resumen['sin_cambios'] += 1
+                    continue
+                huella = huella_archivo(ruta)
+                if huella in vistas:
+                    continue  # Copia idéntica de otro archivo del corpus
+                vistas.add(huella)
+                fila = conn.execute("SELECT ruta FROM documentos WHERE huella = ?", (huella,)).fetchone()
+                if fila:
+                    # Contenido ya indexado (archivo movido, renombrado o solo tocado)
+                    conn.execute("UPDATE documentos SET ruta = ?, tamano = ?, mtime_ns = ? WHERE huella = ?",
+                                 (ruta, estado.st_size, estado.st_mtime_ns, huella))
+                    resumen['movidos' if fila[0] != ruta else 'sin_cambios'] += 1
+                else:
+                    inicio = time.perf_counter()
+                    resumen['fragmentos'] += self._indexar_archivo(conn, ruta, huella, estado)
+                    resumen['nuevos'] += 1
+                    logger.info(f"Indexado {ruta} en {time.perf_counter() - inicio:.1f} s")
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                resumen['errores'] += 1
+                logger.error(f"No se pudo indexar {ruta}: {e}")
+
+        retirados = [(huella,) for huella, *_ in conocidos.values() if huella not in vistas]
+        conn.executemany("DELETE FROM documentos WHERE huella = ?", retirados)
+        resumen['eliminados'] = len(retirados)
+        conn.commit()
+        conn.close()
+        return resumen
+
+    def buscar(self, consulta: str, k: int = 5) -> list:
+        """Fragmentos más relevantes (BM25) con un extracto que resalta las coincidencias"""
+        expresion = consulta_fts(consulta)
+        if expresion is None:
+            return []
+        conn = self._conectar()
+        filas = conn.execute('''
+            SELECT f.id, d.ruta, f.pagina, f.seccion, f.texto,
+                   snippet(fragmentos_fts, 0, '**', '**', ' … ', 24),
+                   bm25(fragmentos_fts, 1.0, 2.0) AS rango
+            FROM fragmentos_fts
+            JOIN fragmentos f ON f.id = fragmentos_fts.rowid
+            JOIN documentos d ON d.huella = f.huella
+            WHERE fragmentos_fts MATCH ?
+            ORDER BY rango LIMIT ?''', (expresion, k)).fetchall()
+        conn.close()
+        # bm25() de SQLite es negativo: cuanto menor, más relevante
+        return [{'id': id_fragmento, 'ruta': ruta, 'pagina': pagina, 'seccion': seccion, 'texto': texto,
+                 'extracto': extracto, 'puntuacion': -rango}
+                for id_fragmento, ruta, pagina, seccion, texto, extracto, rango in filas]
+
+    def estadisticas(self) -> dict:
+        conn = self._conectar()
+        documentos, paginas, fragmentos = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(paginas), 0), COALESCE(SUM(fragmentos), 0) FROM documentos").fetchone()
+        conn.close()
+        return {'documentos': documentos, 'paginas': paginas, 'fragmentos': fragmentos}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indexa un directorio de PDF jurídicos en SQLite FTS5")
+    parser.add_argument("--directorio", default=CORPUS_DIR)
+    parser.add_argument("--db", default=CORPUS_DB)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not os.path.isdir(args.directorio):
+        logger.info(f"No existe el directorio {args.directorio}; no hay nada que indexar")
+        return
+    inicio = time.perf_counter()
+    resumen = CorpusJuridico(args.db).ingerir_directorio(args.directorio)
+    logger.info(f"Ingesta completada en {time.perf_counter() - inicio:.1f} s: {resumen}")
+
+if __name__ == "__main__":
+    main()
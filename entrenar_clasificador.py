@@ -0,0 +1,115 @@
+"""Entrena el clasificador jurídico local y guarda el modelo junto al bot.
+
+Usa las muestras etiquetadas de muestras_clasificador.jsonl y, si existen, las consultas
+de la tabla `aprendizaje` de la base de datos que tengan area_juridica (las que no la tienen
+no se sabe si eran jurídicas y se descartan). Antes de guardar el modelo mide su precisión
+con validación cruzada, también dentro y fuera de la franja de duda que usa el bot:
+
+    python entrenar_clasificador.py --salida clasificador_juridico.npz
+"""
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+from clasificador_juridico import ClasificadorJuridico
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AREAS_NO_JURIDICAS = {'no_juridico', 'ninguna'}
+# Franja de duda del bot (CLASIFICADOR_UMBRAL_NO_JURIDICO / CLASIFICADOR_UMBRAL_JURIDICO en main.py)
+UMBRAL_NO_JURIDICO = 0.35
+UMBRAL_JURIDICO = 0.65
+
+def cargar_muestras(ruta: str) -> list:
+    muestras = []
+    with open(ruta, encoding='utf-8') as archivo:
+        for linea in archivo:
+            if linea.strip():
+                dato = json.loads(linea)
+                muestras.append((dato['texto'], int(dato['juridico'])))
+    return muestras
+
+def cargar_aprendizaje(ruta_db: str) -> list:
+    """Preguntas registradas por el bot con área conocida; el área 'no_juridico' las marca como negativas"""
+    try:
+        conn = sqlite3.connect(ruta_db)
+        filas = conn.execute("""SELECT pregunta, area_juridica FROM aprendizaje
+                                WHERE pregunta IS NOT NULL AND TRIM(COALESCE(area_juridica, '')) != ''""").fetchall()
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo leer la tabla aprendizaje: {e}")
+        return []
+    return [(pregunta, 0 if area.strip().lower() in AREAS_NO_JURIDICAS else 1) for pregunta, area in filas]
+
+def validacion_cruzada(muestras: list, pliegues: int, epocas: int) -> tuple:
+    """Probabilidades fuera de muestra de cada ejemplo (k pliegues estratificados) y sus etiquetas"""
+    etiquetas = np.array([etiqueta for _, etiqueta in muestras])
+    pliegue = np.empty(len(muestras), dtype=np.int64)
+    for clase in (0, 1):
+        indices = np.flatnonzero(etiquetas == clase)
+        pliegue[indices] = np.arange(len(indices)) % pliegues
+    probabilidades = np.zeros(len(muestras))
+    for k in range(pliegues):
+        entrenamiento = np.flatnonzero(pliegue != k)
+        prueba = np.flatnonzero(pliegue == k)
+        clasificador = ClasificadorJuridico()
+        clasificador.entrenar([muestras[i][0] for i in entrenamiento], etiquetas[entrenamiento], epocas=epocas)
+        probabilidades[prueba] = clasificador.classify_batch([muestras[i][0] for i in prueba])
+    return probabilidades, etiquetas
+
+def metricas(probabilidades: np.ndarray, etiquetas: np.ndarray,
+             umbral_no: float = UMBRAL_NO_JURIDICO, umbral_si: float = UMBRAL_JURIDICO) -> dict:
+    """Exactitud, precisión y exhaustividad a 0.5, y cobertura/exactitud fuera de la franja de duda"""
+    predicciones = probabilidades >= 0.5
+    positivos = etiquetas == 1
+    seguras = (probabilidades <= umbral_no) | (probabilidades >= umbral_si)
+    return {
+        'exactitud': float(np.mean(predicciones == positivos)),
+        'precision': float(np.sum(predicciones & positivos) / max(np.sum(predicciones), 1)),
+        'exhaustividad': float(np.sum(predicciones & positivos) / max(np.sum(positivos), 1)),
+        'cobertura': float(np.mean(seguras)),
+        'exactitud_segura': float(np.mean(predicciones[seguras] == positivos[seguras])) if seguras.any() else 0.0
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de temas jurídicos")
+    parser.add_argument("--muestras", default="muestras_clasificador.jsonl")
+    parser.add_argument("--db", default="bufete_legal.db")
+    parser.add_argument("--salida", default="clasificador_juridico.npz")
+    parser.add_argument("--epocas", type=int, default=300)
+    parser.add_argument("--pliegues", type=int, default=5, help="Pliegues de la validación cruzada (0 para omitirla)")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    muestras = cargar_muestras(args.muestras) + cargar_aprendizaje(args.db)
+    random.Random(args.semilla).shuffle(muestras)
+    logger.info(f"{len(muestras)} muestras ({sum(e for _, e in muestras)} jurídicas)")
+
+    if args.pliegues > 1:
+        resultado = metricas(*validacion_cruzada(muestras, args.pliegues, args.epocas))
+        logger.info(f"Validación cruzada ({args.pliegues} pliegues): exactitud {resultado['exactitud']:.1%}, "
+                    f"precisión {resultado['precision']:.1%}, exhaustividad {resultado['exhaustividad']:.1%}")
+        logger.info(f"Fuera de la franja {UMBRAL_NO_JURIDICO}-{UMBRAL_JURIDICO}: cobertura {resultado['cobertura']:.1%}, "
+                    f"exactitud {resultado['exactitud_segura']:.1%} (el resto lo decide la heurística)")
+
+    # El modelo final se entrena con todas las muestras
+    clasificador = ClasificadorJuridico()
+    perdida = clasificador.entrenar([t for t, _ in muestras], [e for _, e in muestras], epocas=args.epocas)
+    logger.info(f"Pérdida final: {perdida:.4f}")
+
+    textos = [texto for texto, _ in muestras] * 20
+    inicio = time.perf_counter()
+    clasificador.classify_batch(textos)
+    logger.info(f"Clasificación por lotes: {(time.perf_counter() - inicio) / len(textos) * 1e6:.1f} µs por mensaje")
+
+    clasificador.guardar(args.salida)
+    logger.info(f"Modelo guardado en {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Extracción de texto de PDF por páginas y pool de procesos para hacerla fuera del bot.
+
+Cada trabajador es un intérprete aparte (`python extraccion_pdf.py --trabajador`) que solo
+importa este módulo y pypdf, así que no arrastra la configuración ni la base de datos del
+bot. El pool limita la concurrencia al número de núcleos, aplica un tiempo máximo y un
+límite de memoria residente por trabajo, mata al trabajador si se cancela la petición y
+recicla los procesos tras N trabajos o si su pico de memoria ha crecido demasiado.
+
+Protocolo con el trabajador (stdin/stdout): una línea con la longitud en bytes seguida de
+un JSON, en ambos sentidos. Las peticiones llevan además la longitud y los bytes del PDF
+cuando el documento viaja en memoria en lugar de por ruta.
+"""
+import asyncio
+import gc
+import io
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    from PyPDF2 import PdfReader
+
+logger = logging.getLogger(__name__)
+
+# En modo acotado el lector se reabre cada N páginas para soltar los objetos ya parseados
+PAGINAS_POR_LECTOR = int(os.getenv('PAGINAS_POR_LECTOR', '50'))
+
+PDF_PROCESOS = int(os.getenv('PDF_PROCESOS', str(os.cpu_count() or 2)))
+PDF_TIMEOUT = float(os.getenv('PDF_TIMEOUT', '30'))
+PDF_LIMITE_RSS_MB = int(os.getenv('PDF_LIMITE_RSS_MB', '512'))
+PDF_TRABAJOS_POR_PROCESO = int(os.getenv('PDF_TRABAJOS_POR_PROCESO', '20'))
+# Un trabajador cuyo pico de memoria supera este umbral se recicla aunque haya terminado bien
+PDF_RECICLAR_RSS_MB = int(os.getenv('PDF_RECICLAR_RSS_MB', '256'))
+INTERVALO_VIGILANCIA = 0.2
+
+def _abrir(fuente: Union[str, bytes]):
+    return io.BytesIO(fuente) if isinstance(fuente, (bytes, bytearray)) else open(fuente, "rb")
+
+def iterar_paginas_pdf(fuente: Union[str, bytes], max_caracteres: Optional[int] = None,
+                       max_paginas: Optional[int] = None, acotado: bool = False):
+    """Genera el texto de cada página bajo demanda y se detiene al agotar el presupuesto.
+
+    `fuente` es la ruta del PDF o su contenido en bytes. La última página se recorta para
+    no pasar de max_caracteres. Con acotado=True la memoria no crece con el número de
+    páginas (útil para expedientes de cientos de páginas).
+    """
+    restantes = max_caracteres
+    with _abrir(fuente) as file:
+        reader = PdfReader(file)
+        total = len(reader.pages)
+        if max_paginas is not None:
+            total = min(total, max_paginas)
+        for numero in range(total):
+            if acotado and numero and numero % PAGINAS_POR_LECTOR == 0:
+                # Los objetos del lector forman ciclos: hay que recolectarlos explícitamente
+                del reader
+                gc.collect()
+                file.seek(0)
+                reader = PdfReader(file)
+            texto = reader.pages[numero].extract_text() or ""
+            if restantes is not None:
+                texto = texto[:restantes]
+                restantes -= len(texto)
+            yield texto
+            if restantes is not None and restantes <= 0:
+                return
+
+def extraer_texto(fuente: Union[str, bytes], max_caracteres: Optional[int] = None,
+                  max_paginas: Optional[int] = None, acotado: bool = False) -> str:
+    paginas = iterar_paginas_pdf(fuente, max_caracteres, max_paginas, acotado)
+    return "".join(f"{texto}\n" for texto in paginas)
+
+def extract_text_from_pdf(fuente: Union[str, bytes], max_caracteres: Optional[int] = None,
+                          max_paginas: Optional[int] = None, acotado: bool = False) -> Optional[str]:
+    """Extrae texto del PDF (completo, o hasta agotar el presupuesto de caracteres/páginas)"""
+    try:
+        return extraer_texto(fuente, max_caracteres, max_paginas, acotado)
+    except Exception as e:
+        logger.error(f"Error leyendo PDF: {e}")
+        return None
+
+# TRABAJADOR (proceso hijo)
+def _escribir_mensaje(salida, datos: dict):
+    cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+    salida.write(b"%d\n" % len(cuerpo) + cuerpo)
+    salida.flush()
+
+def _pico_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+def _bucle_trabajador(limite_mb: int):
+    """Atiende trabajos de extracción hasta que se cierra stdin"""
+    if resource and limite_mb:
+        # Respaldo del límite que vigila el proceso padre: sin espacio de direcciones,
+        # pypdf falla con MemoryError en lugar de hundir la máquina
+        limite = limite_mb * 2 * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+        except (ValueError, OSError):
+            pass
+    entrada = sys.stdin.buffer
+    # stdout queda reservado al protocolo; cualquier print accidental va a stderr
+    salida = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    while True:
+        cabecera = entrada.readline()
+        if not cabecera:
+            break
+        longitud_trabajo, longitud_datos = (int(valor) for valor in cabecera.split())
+        trabajo = json.loads(entrada.read(longitud_trabajo))
+        fuente = entrada.read(longitud_datos) if longitud_datos else trabajo['ruta']
+        try:
+            respuesta = {'ok': True, 'texto': extraer_texto(fuente, trabajo.get('max_caracteres'),
+                                                            trabajo.get('max_paginas'), trabajo.get('acotado', True))}
+        except MemoryError:
+            respuesta = {'ok': False, 'error': 'memoria agotada'}
+        except Exception as e:
+            respuesta = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        respuesta['pico_rss_kb'] = _pico_rss_kb()
+        _escribir_mensaje(salida, respuesta)
+
+# POOL (proceso del bot)
+class ErrorExtraccionPDF(Exception):
+    pass
+
+class TrabajadorPDF:
+    """Un proceso hijo de extracción y el número de trabajos que lleva"""
+    def __init__(self, proceso: asyncio.subprocess.Process):
+        self.proceso = proceso
+        self.trabajos = 0
+        self.pico_rss_kb = 0
+
+    @classmethod
+    async def iniciar(cls, limite_mb: int) -> "TrabajadorPDF":
+        proceso = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--trabajador', str(limite_mb),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        return cls(proceso)
+
+    async def ejecutar(self, trabajo: dict, datos: bytes = b"") -> dict:
+        cuerpo = json.dumps(trabajo).encode('utf-8')
+        self.proceso.stdin.write(b"%d %d\n" % (len(cuerpo), len(datos)) + cuerpo)
+        if datos:
+            self.proceso.stdin.write(datos)
+        await self.proceso.stdin.drain()
+        cabecera = await self.proceso.stdout.readline()
+        if not cabecera:
+            raise ErrorExtraccionPDF("el trabajador terminó inesperadamente")
+        respuesta = json.loads(await self.proceso.stdout.readexactly(int(cabecera)))
+        self.trabajos += 1
+        self.pico_rss_kb = respuesta.get('pico_rss_kb', 0)
+        return respuesta
+
+    def rss_actual_mb(self) -> Optional[float]:
+        """Memoria residente actual del proceso (solo Linux, vía /proc)"""
+        try:
+            with open(f"/proc/{self.proceso.pid}/statm") as archivo:
+                paginas = int(archivo.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            return None
+        return paginas * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+    def vivo(self) -> bool:
+        return self.proceso.returncode is None
+
+    def matar(self):
+        if self.vivo():
+            self.proceso.kill()
+
+    async def cerrar(self):
+        if self.vivo():
+            self.proceso.stdin.close()
+            try:
+                await asyncio.wait_for(self.proceso.wait(), 5)
+            except asyncio.TimeoutError:
+                self.matar()
+        await self.proceso.wait()
+
+class PoolExtraccionPDF:
+    """Extrae texto de PDF en procesos aparte, con tiempo máximo y límite de memoria por trabajo"""
+    def __init__(self, max_procesos: int = PDF_PROCESOS, timeout: float = PDF_TIMEOUT,
+                 limite_rss_mb: int = PDF_LIMITE_RSS_MB, trabajos_por_proceso: int = PDF_TRABAJOS_POR_PROCESO,
+                 reciclar_rss_mb: int = PDF_RECICLAR_RSS_MB):
+        self.max_procesos = max(1, max_procesos)
+        self.timeout = timeout
+        self.limite_rss_mb = limite_rss_mb
+        self.trabajos_por_proceso = trabajos_por_proceso
+        self.reciclar_rss_mb = reciclar_rss_mb
+        self._semaforo = asyncio.Semaphore(self.max_procesos)
+        self._libres = []
+        self._activos = set()
+        self.reciclados = 0
+
+    async def _vigilar(self, trabajador: TrabajadorPDF, tarea: asyncio.Task) -> dict:
+        """Espera el resultado comprobando el tiempo transcurrido y la memoria del trabajador"""
+        limite = time.monotonic() + self.timeout
+        while True:
+            hecho, _ = await asyncio.wait({tarea}, timeout=INTERVALO_VIGILANCIA)
+            if hecho:
+                return tarea.result()
+            if time.monotonic() >= limite:
+                raise ErrorExtraccionPDF(f"tiempo máximo de {self.timeout:.0f} s agotado")
+            rss = trabajador.rss_actual_mb()
+            if rss is not None and rss > self.limite_rss_mb:
+                raise ErrorExtraccionPDF(f"límite de memoria superado ({rss:.0f} MB)")
+
+    async def extraer(self, fuente: Union[str, bytes], max_caracteres: Optional[int] = None,
+                      max_paginas: Optional[int] = None, acotado: bool = True) -> str:
+        """Texto del PDF (ruta o bytes); lanza ErrorExtraccionPDF si falla, tarda demasiado o consume demasiada memoria"""
+        en_memoria = isinstance(fuente, (bytes, bytearray))
+        trabajo = {'ruta': None if en_memoria else os.path.abspath(fuente), 'max_caracteres': max_caracteres,
+                   'max_paginas': max_paginas, 'acotado': acotado}
+        datos = bytes(fuente) if en_memoria else b""
+        async with self._semaforo:
+            trabajador = self._libres.pop() if self._libres else await TrabajadorPDF.iniciar(self.limite_rss_mb)
+            self._activos.add(trabajador)
+            tarea = asyncio.ensure_future(trabajador.ejecutar(trabajo, datos))
+            sano = False
+            try:
+                respuesta = await self._vigilar(trabajador, tarea)
+                sano = True
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                raise ErrorExtraccionPDF(f"el trabajador terminó inesperadamente ({e})") from e
+            finally:
+                # Timeout, exceso de memoria, cancelación o fallo: el proceso no es reutilizable
+                if not sano:
+                    tarea.cancel()
+                    trabajador.matar()
+                self._activos.discard(trabajador)
+                await self._devolver(trabajador, sano)
+
+        if not respuesta['ok']:
+            raise ErrorExtraccionPDF(respuesta['error'])
+        return respuesta['texto']
+
+    async def _devolver(self, trabajador: TrabajadorPDF, sano: bool):
+        agotado = (trabajador.trabajos >= self.trabajos_por_proceso
+                   or trabajador.pico_rss_kb > self.reciclar_rss_mb * 1024)
+        if sano and trabajador.vivo() and not agotado:
+            self._libres.append(trabajador)
+            return
+        self.reciclados += 1
+        await trabajador.cerrar()
+
+    async def cerrar(self):
+        for trabajador in list(self._activos):
+            trabajador.matar()
+        trabajadores, self._libres = self._libres, []
+        for trabajador in trabajadores:
+            await trabajador.cerrar()
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == '--trabajador':
+        _bucle_trabajador(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    else:
+        # Uso manual: python extraccion_pdf.py documento.pdf [max_caracteres]
+        print(extraer_texto(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None, acotado=True))
@@ -4,7 +4,7 @@ import os
 from dotenv import load_dotenv
 import PyPDF2
 import pypdf
-import requests
+import aiohttp
 import json
 import logging
 from typing import Optional
@@ -19,7 +19,25 @@ matplotlib.use('Agg')  # Para funcionar en entornos sin UI
 import io
 import pandas as pd
 import numpy as np
-from collections import Counter
+from collections import Counter, deque, OrderedDict
+import time
+import hashlib
+import zlib
+import tempfile
+import sys
+import itertools
+import math
+import random
+import socket
+import ipaddress
+from contextlib import asynccontextmanager
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+from clasificador_juridico import ClasificadorJuridico, PATRON_TOKEN, bigramas, normalizar
+from extraccion_pdf import ErrorExtraccionPDF, PoolExtraccionPDF
+from artefacto_syllabus import construir_artefacto, cargar_artefacto, terminos_busqueda
+from corpus_juridico import CORPUS_DB, CORPUS_DIR, CorpusJuridico
+from patrones_juridicos import PATRONES_CONSULTA_JURIDICA, REGISTRO_REGEX
 
 # Configuración inicial
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +47,16 @@ load_dotenv()
 # Configurar intents
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class AbogadoBot(commands.Bot):
+    async def close(self):
+        # Cerrar el pool HTTP compartido y los procesos de extracción antes de desconectar
+        await ai_assistant.http.close()
+        await pool_pdf.cerrar()
+        await descargador_documentos.close()
+        await super().close()
+
+bot = AbogadoBot(command_prefix="!", intents=intents)
 
 # Base de datos mejorada para bufete de abogados
 def init_db():
@@ -65,6 +92,26 @@ def init_db():
                  (id INTEGER PRIMARY KEY, tipo TEXT, datos TEXT, 
                   fecha_creacion TEXT, usuario_id INTEGER)''')
     
+    # Tabla de caché de respuestas de IA
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_respuestas
+                 (clave TEXT PRIMARY KEY, respuesta TEXT, creado REAL,
+                  ultimo_acceso REAL)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_cache_respuestas_acceso
+                 ON cache_respuestas (ultimo_acceso)''')
+    
+    # Caché de documentos por huella SHA-256 (texto comprimido, área jurídica y dictamen)
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_documentos
+                 (huella TEXT PRIMARY KEY, nombre TEXT, texto BLOB, analisis TEXT,
+                  dictamen TEXT, version TEXT, tamano INTEGER, creado REAL,
+                  ultimo_acceso REAL)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_cache_documentos_acceso
+                 ON cache_documentos (ultimo_acceso)''')
+    
+    # Área jurídica de los documentos (añadida después; bases antiguas no la tienen)
+    columnas_documentos = {fila[1] for fila in c.execute("PRAGMA table_info(documentos)")}
+    if 'area_juridica' not in columnas_documentos:
+        c.execute("ALTER TABLE documentos ADD COLUMN area_juridica TEXT")
+    
     conn.commit()
     conn.close()
 
@@ -83,38 +130,160 @@ except ImportError:
 
 # Variables globales
 syllabus_text = None
+artefacto_syllabus = None  # Texto e índice del syllabus mapeados en memoria
 
 # TÉRMINOS JURÍDICOS AMPLIADOS
 LEGAL_TERMS = [
-    'derecho', 'ley', 'legal', 'jurídico', 'juridico', 'abogado', 'abogada', 
+    'derecho', 'ley', 'legal', 'jurídico', 'abogado', 'abogada',
     'proceso', 'juicio', 'demanda', 'demandar', 'demandado', 'demandante',
-    'contrato', 'cláusula', 'clausula', 'testamento', 'herencia', 'sucesión', 'sucesion',
+    'contrato', 'cláusula', 'testamento', 'herencia', 'sucesión',
     'penal', 'civil', 'mercantil', 'laboral', 'administrativo', 'constitucional',
-    'recurso', 'apelación', 'apelacion', 'casación', 'sentencia', 'fallo', 'juez', 'jueza',
-    'tribunal', 'juzgado', 'fiscal', 'fiscalía', 'fiscalia', 'notario', 'notaría', 'notaria',
+    'recurso', 'apelación', 'casación', 'sentencia', 'fallo', 'juez', 'jueza',
+    'tribunal', 'juzgado', 'fiscal', 'fiscalía', 'notario', 'notaría',
     'documento', 'escritura', 'poder', 'poder notarial', 'arrendamiento', 'compraventa',
-    'sociedad', 'empresa', 'mercantil', 'comercial', 'patente', 'marca', 'propiedad intelectual',
+    'sociedad', 'empresa', 'comercial', 'patente', 'marca', 'propiedad intelectual',
     'derechos de autor', 'familia', 'divorcio', 'patria potestad', 'alimentos', 'guarda y custodia',
-    'hipoteca', 'prenda', 'garantía', 'garantia', 'obligación', 'obligacion', 'deuda', 'moroso',
+    'hipoteca', 'prenda', 'garantía', 'obligación', 'deuda', 'moroso',
     'despido', 'despido improcedente', 'despido nulo', 'despido procedente', 'contrato laboral',
-    'convenio colectivo', 'negociación colectiva', 'negociacion colectiva', 'huelga', 'conflicto laboral',
-    'delito', 'falta', 'infracción', 'infraccion', 'pena', 'multa', 'prisión', 'prision', 'arresto',
-    'detención', 'detencion', 'habeas corpus', 'prueba', 'testigo', 'perito', 'peritaje',
-    'mediación', 'mediacion', 'arbitraje', 'conciliación', 'conciliacion', 'transacción', 'transaccion',
-    'responsabilidad civil', 'daños y perjuicios', 'indemnización', 'indemnizacion', 'prejuicio',
-    'competencia', 'competencia desleal', 'protección de datos', 'proteccion de datos', 'rgpd',
+    'convenio colectivo', 'negociación colectiva', 'huelga', 'conflicto laboral',
+    'delito', 'falta', 'infracción', 'pena', 'multa', 'prisión', 'arresto',
+    'detención', 'habeas corpus', 'prueba', 'testigo', 'perito', 'peritaje',
+    'mediación', 'arbitraje', 'conciliación', 'transacción',
+    'responsabilidad civil', 'daños y perjuicios', 'indemnización', 'prejuicio',
+    'competencia', 'competencia desleal', 'protección de datos', 'rgpd',
     'derecho al honor', 'derecho a la intimidad', 'derecho a la propia imagen', 'derechos fundamentales',
     'recurso de amparo', 'recurso de protección', 'recurso de inconstitucionalidad', 'recurso de casación',
-    'usufructo', 'nuda propiedad', 'nuda_propiedad', 'derecho real','derecho de uso', 'derecho de disfrute', 
-    'propiedad', 'dominio','derechos reales', 'derecho de goce', 'derecho de disposición','derecho de superficie',
-    'servidumbre', 'derecho real de garantía','hipoteca', 'prenda', 'anticresis', 'derecho de retención',
-    'bufete', 'despacho', 'cliente', 'expediente', 'procura', 'procurador', 'audiencia', 'prueba', 'diligencias',
-    'auto', 'resolución', 'recurso', 'alegato', 'informe', 'dictamen', 'peritación', 'tasación', 'embargo',
-    'litis', 'pleito', 'controversia', 'litigio', 'acuerdo', 'transacción', 'conciliación', 'mediación',
-    'árbitro', 'laudo', 'ejecución', 'sentencia', 'fallo', 'jurisprudencia', 'doctrina', 'normativa',
-    'reglamento', 'directiva', 'decreto', 'ordenanza', 'instrucción', 'circular', 'resolución', 'edicto',
-    'notificación', 'citación', 'emplazamiento', 'requerimiento', 'intimación', 'notificación', 'comunicación'
+    'usufructo', 'nuda propiedad', 'nuda_propiedad', 'derecho real', 'derecho de uso', 'derecho de disfrute',
+    'propiedad', 'dominio', 'derechos reales', 'derecho de goce', 'derecho de disposición', 'derecho de superficie',
+    'servidumbre', 'derecho real de garantía', 'anticresis', 'derecho de retención',
+    'bufete', 'despacho', 'cliente', 'expediente', 'procura', 'procurador', 'audiencia', 'diligencias',
+    'auto', 'resolución', 'alegato', 'informe', 'dictamen', 'peritación', 'tasación', 'embargo',
+    'litis', 'pleito', 'controversia', 'litigio', 'acuerdo',
+    'árbitro', 'laudo', 'ejecución', 'jurisprudencia', 'doctrina', 'normativa',
+    'reglamento', 'directiva', 'decreto', 'ordenanza', 'instrucción', 'circular', 'edicto',
+    'notificación', 'citación', 'emplazamiento', 'requerimiento', 'intimación', 'comunicación'
+]
+
+# NORMALIZACIÓN DE MENSAJES
+# Cada mensaje se pliega (minúsculas, sin acentos) y se tokeniza una sola vez; el enrutado,
+# los detectores de temas jurídicos y la caché de respuestas reutilizan el resultado.
+NORMALIZACION_CACHE_MAX = int(os.getenv('NORMALIZACION_CACHE_MAX', '512'))
+# Sin id de mensaje solo se guardan textos cortos: los prompts construidos (fragmentos de
+# documento, síntesis, RAG) no se repiten y expulsarían a los mensajes de Discord
+NORMALIZACION_MAX_CARACTERES = int(os.getenv('NORMALIZACION_MAX_CARACTERES', '500'))
+
+def normalizar_texto(texto: str) -> str:
+    """Pliega acentos, mayúsculas y espacios para comparar textos equivalentes"""
+    return ' '.join(normalizar(texto).split())
+
+class MensajeNormalizado:
+    """Texto plegado, tokens y bigramas de un mensaje"""
+    def __init__(self, texto: str):
+        self.original = texto
+        self.plegado = normalizar_texto(texto)
+        self.tokens = PATRON_TOKEN.findall(self.plegado)
+        self.ngramas = bigramas(self.tokens)
+        self.es_juridico = None  # Lo calcula AIAssistant.is_legal_related la primera vez
+
+class NormalizadorMensajes:
+    """Caché LRU de mensajes normalizados, por (id de mensaje de Discord, texto) o solo por texto corto"""
+    def __init__(self, max_entradas: int = NORMALIZACION_CACHE_MAX,
+                 max_caracteres: int = NORMALIZACION_MAX_CARACTERES):
+        self.max_entradas = max_entradas
+        self.max_caracteres = max_caracteres
+        self.entradas = OrderedDict()
+    
+    def obtener(self, texto: str, id_mensaje: Optional[int] = None) -> MensajeNormalizado:
+        if id_mensaje is None and len(texto) > self.max_caracteres:
+            return MensajeNormalizado(texto)
+        # El texto forma parte de la clave: un mismo mensaje puede llegar completo y recortado
+        # (sin el prefijo del comando) sin que una versión expulse a la otra
+        clave = (id_mensaje, texto) if id_mensaje is not None else texto
+        entrada = self.entradas.get(clave)
+        if entrada is None:
+            entrada = MensajeNormalizado(texto)
+            self.entradas[clave] = entrada
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.max_entradas:
+            self.entradas.popitem(last=False)
+        return entrada
+
+NORMALIZADOR_MENSAJES = NormalizadorMensajes()
+
+def normalizar_mensaje(texto: str, id_mensaje: Optional[int] = None) -> MensajeNormalizado:
+    return NORMALIZADOR_MENSAJES.obtener(texto, id_mensaje)
+
+# El registro de patrones vive en patrones_juridicos.py (también lo usa benchmark_regex.py)
+REGISTRO_REGEX.perfilar = os.getenv('PERFILAR_REGEX', '0') == '1'
+
+class BuscadorTerminos:
+    """Localiza todos los términos de un vocabulario en una sola pasada lineal.
+    
+    Usa una única alternancia compilada (términos más largos primero) con límites de
+    palabra y plural opcional en cada palabra ('despidos improcedentes'), sobre texto
+    plegado: 'jurídico' y 'juridico' son el mismo término. Los términos contenidos en
+    otros ('despido' dentro de 'despido improcedente') se derivan del término largo sin
+    volver a recorrer el texto.
+    """
+    def __init__(self, terminos):
+        self.terminos = list(dict.fromkeys(normalizar(termino) for termino in terminos))
+        alternancia = '|'.join(r'\s+'.join(rf'{re.escape(palabra)}(?:e?s)?' for palabra in termino.split())
+                               for termino in sorted(self.terminos, key=len, reverse=True))
+        self.patron = re.compile(rf'(?<!\w)({alternancia})(?!\w)')
+        # Forma encontrada (singular o plural en cada palabra) -> término del vocabulario. Un
+        # grupo con nombre por término evitaría el diccionario, pero hace la búsqueda ~30 veces
+        # más lenta; los términos literales tienen prioridad sobre el plural de otro término.
+        self.formas = {}
+        for termino in self.terminos:
+            for sufijos in itertools.product(('', 's', 'es'), repeat=len(termino.split())):
+                forma = ' '.join(palabra + sufijo for palabra, sufijo in zip(termino.split(), sufijos))
+                self.formas.setdefault(forma, termino)
+        self.formas.update({termino: termino for termino in self.terminos})
+        self.orden = {termino: indice for indice, termino in enumerate(self.terminos)}
+        self.anidados = {}
+        for termino in self.terminos:
+            internos = []
+            for otro in self.terminos:
+                if otro == termino:
+                    continue
+                for m in re.finditer(rf'(?<!\w){re.escape(otro)}(?!\w)', termino):
+                    internos.append((m.start(), otro))
+            if internos:
+                self.anidados[termino] = internos
+    
+    def buscar(self, texto: str, plegado: bool = False) -> list:
+        """Devuelve cada aparición como (posición en el texto plegado, término), incluidos los anidados"""
+        apariciones = []
+        for m in self.patron.finditer(texto if plegado else normalizar(texto)):
+            termino = self.formas[' '.join(m.group(1).split())]
+            apariciones.append((m.start(), termino))
+            for desplazamiento, interno in self.anidados.get(termino, ()):
+                apariciones.append((m.start() + desplazamiento, interno))
+        return apariciones
+    
+    def encontrados(self, texto: str, plegado: bool = False) -> list:
+        """Términos distintos presentes en el texto, en el orden del vocabulario"""
+        distintos = {termino for _, termino in self.buscar(texto, plegado)}
+        return sorted(distintos, key=self.orden.__getitem__)
+    
+    def contiene(self, texto: str, plegado: bool = False) -> bool:
+        return self.patron.search(texto if plegado else normalizar(texto)) is not None
+
+BUSCADOR_TERMINOS_LEGALES = BuscadorTerminos(LEGAL_TERMS)
+
+# Temas ajenos al derecho, salvo que la consulta mencione también alguna excepción jurídica
+PALABRAS_NO_JURIDICAS = [
+    'tecnología', 'ciencia', 'salud', 'bienestar', 'finanzas', 'negocios', 'cultura', 'educación',
+    'historia', 'geografía', 'entretenimiento', 'videojuegos', 'deportes', 'cocina', 'música', 'arte',
+    'cine', 'películas', 'series', 'programación', 'matemáticas', 'física', 'química', 'biología',
+    'medicina', 'deporte', 'ejercicio', 'video', 'juego', 'juguete', 'comida', 'receta'
 ]
+EXCEPCIONES_JURIDICAS = [
+    'propiedad', 'derecho', 'contrato', 'ley', 'legal', 'ilegal', 'jurídico', 'juicio',
+    'proceso', 'demanda', 'testamento', 'herencia', 'usufructo', 'nuda propiedad'
+]
+BUSCADOR_NO_JURIDICOS = BuscadorTerminos(PALABRAS_NO_JURIDICAS)
+BUSCADOR_EXCEPCIONES_JURIDICAS = BuscadorTerminos(EXCEPCIONES_JURIDICAS)
 
 # PROMPT MEJORADO PARA ABOGADO NOVATO
 SYSTEM_PROMPT_ABOGADO_NOVATO = """Eres un abogado junior (novato) que trabaja en un bufete de abogados. 
@@ -232,150 +401,1396 @@ def obtener_sinonimos(termino):
     }
     return sinónimos_completos.get(termino, [])
 
-class AIAssistant:
+# CONFIGURACIÓN DEL CLIENTE HTTP PARA PROVEEDORES DE IA
+HTTP_TIMEOUT_IA = float(os.getenv('HTTP_TIMEOUT_IA', '30'))
+HTTP_MAX_CONEXIONES = int(os.getenv('HTTP_MAX_CONEXIONES', '100'))
+HTTP_MAX_CONEXIONES_POR_HOST = int(os.getenv('HTTP_MAX_CONEXIONES_POR_HOST', '20'))
+HTTP_KEEPALIVE = float(os.getenv('HTTP_KEEPALIVE', '60'))
+
+class ClienteHTTPIA:
+    """Cliente HTTP asíncrono con pool de conexiones keep-alive compartido"""
+    def __init__(self, max_conexiones: int = HTTP_MAX_CONEXIONES,
+                 max_por_host: int = HTTP_MAX_CONEXIONES_POR_HOST,
+                 timeout: float = HTTP_TIMEOUT_IA):
+        self.max_conexiones = max_conexiones
+        self.max_por_host = max_por_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Crea la sesión de forma perezosa dentro del event loop en ejecución"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_conexiones,
+                limit_per_host=self.max_por_host,
+                keepalive_timeout=HTTP_KEEPALIVE,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+    
+    async def post_json(self, url: str, headers: dict, payload: dict, observar=None) -> dict:
+        """POST con cuerpo JSON; lanza excepción si el estado HTTP no es 2xx
+        
+        observar(estado, cabeceras) se llama con cada respuesta, también con las de error.
+        """
+        session = self._get_session()
+        async with session.post(url, headers=headers, json=payload) as response:
+            if observar is not None:
+                observar(response.status, response.headers)
+            response.raise_for_status()
+            return await response.json(content_type=None)
+    
+    async def post_stream(self, url: str, headers: dict, payload: dict, observar=None):
+        """POST con respuesta SSE; genera el texto de cada delta hasta recibir [DONE]"""
+        session = self._get_session()
+        # En streaming el límite es entre fragmentos, no sobre la respuesta completa
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout.total)
+        async with session.post(url, headers=headers, json=payload, timeout=timeout) as response:
+            if observar is not None:
+                observar(response.status, response.headers)
+            response.raise_for_status()
+            async for linea in response.content:
+                linea = linea.decode('utf-8').strip()
+                if not linea.startswith('data:'):
+                    continue
+                datos = linea[5:].strip()
+                if datos == '[DONE]':
+                    return
+                evento = json.loads(datos)
+                if not evento.get('choices'):
+                    continue
+                fragmento = evento['choices'][0].get('delta', {}).get('content')
+                if fragmento:
+                    yield fragmento
+        # La conexión se cerró sin [DONE]: la respuesta está incompleta
+        raise aiohttp.ClientPayloadError("el stream terminó sin [DONE]")
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+# CONFIGURACIÓN DE PETICIONES CUBIERTAS (HEDGING) ENTRE PROVEEDORES
+HEDGING_IA = os.getenv('HEDGING_IA', '1') == '1'
+HEDGE_PERCENTIL = float(os.getenv('HEDGE_PERCENTIL', '95'))
+HEDGE_RETRASO_DEFECTO = float(os.getenv('HEDGE_RETRASO_DEFECTO', '4'))
+HEDGE_RETRASO_MIN = float(os.getenv('HEDGE_RETRASO_MIN', '0.5'))
+HEDGE_RETRASO_MAX = float(os.getenv('HEDGE_RETRASO_MAX', '15'))
+HEDGE_MUESTRAS_MIN = 20
+
+class EstadisticasLatencia:
+    """Ventana deslizante de latencias de un proveedor (en segundos)"""
+    def __init__(self, ventana: int = 200):
+        self.muestras = deque(maxlen=ventana)
+    
+    def registrar(self, segundos: float):
+        self.muestras.append(segundos)
+    
+    def percentil(self, p: float) -> Optional[float]:
+        if not self.muestras:
+            return None
+        ordenadas = sorted(self.muestras)
+        indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+        return ordenadas[indice]
+
+# CIRCUIT BREAKER Y SALUD DE PROVEEDORES
+CIRCUITO_UMBRAL_FALLOS = int(os.getenv('CIRCUITO_UMBRAL_FALLOS', '3'))
+CIRCUITO_ENFRIAMIENTO = float(os.getenv('CIRCUITO_ENFRIAMIENTO', '30'))
+SALUD_EWMA_ALFA = float(os.getenv('SALUD_EWMA_ALFA', '0.3'))
+
+class SaludProveedor:
+    """Tasa de éxito y latencia EWMA de un proveedor, con circuito cerrado/abierto/semiabierto"""
+    def __init__(self, nombre: str, latencia_estimada: float = 1.0, umbral_fallos: int = CIRCUITO_UMBRAL_FALLOS,
+                 enfriamiento: float = CIRCUITO_ENFRIAMIENTO, alfa: float = SALUD_EWMA_ALFA):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.alfa = alfa
+        self.estado = 'cerrado'
+        self.fallos_consecutivos = 0
+        self.tasa_exito = 1.0
+        # Estimación inicial hasta tener mediciones reales
+        self.latencia_ewma = latencia_estimada
+        self.abierto_desde = 0.0
+        self.sonda_desde: Optional[float] = None
+    
+    def disponible(self) -> bool:
+        """Indica si se puede usar el proveedor, sin reservar nada (sirve para ordenar)"""
+        ahora = time.monotonic()
+        if self.estado == 'cerrado':
+            return True
+        if self.estado == 'abierto' and ahora - self.abierto_desde < self.enfriamiento:
+            return False
+        # Semiabierto: una sonda a la vez (si se quedó colgada, se permite otra)
+        return self.sonda_desde is None or ahora - self.sonda_desde >= HTTP_TIMEOUT_IA
+    
+    def reservar_sonda(self) -> bool:
+        """Justo antes de la petición real: en semiabierto ocupa el único hueco de sonda"""
+        if not self.disponible():
+            return False
+        if self.estado != 'cerrado':
+            self.estado = 'semiabierto'
+            self.sonda_desde = time.monotonic()
+        return True
+    
+    def registrar_exito(self, latencia: float):
+        self.fallos_consecutivos = 0
+        self.tasa_exito = self.alfa + (1 - self.alfa) * self.tasa_exito
+        self.latencia_ewma = self.alfa * latencia + (1 - self.alfa) * self.latencia_ewma
+        if self.estado != 'cerrado':
+            logger.info(f"Circuito de {self.nombre} cerrado de nuevo tras una sonda correcta")
+        self.estado = 'cerrado'
+        self.sonda_desde = None
+    
+    def registrar_fallo(self):
+        self.fallos_consecutivos += 1
+        self.tasa_exito = (1 - self.alfa) * self.tasa_exito
+        if self.estado == 'semiabierto' or self.fallos_consecutivos >= self.umbral_fallos:
+            if self.estado != 'abierto':
+                logger.warning(f"Circuito de {self.nombre} abierto tras {self.fallos_consecutivos} fallos consecutivos")
+            self.estado = 'abierto'
+            self.abierto_desde = time.monotonic()
+            self.sonda_desde = None
+    
+    def liberar_sonda(self):
+        """Libera la sonda si la petición se canceló sin resultado"""
+        self.sonda_desde = None
+    
+    def puntuacion(self) -> float:
+        """Coste esperado (menor es mejor): latencia penalizada por la tasa de fallos"""
+        return self.latencia_ewma / max(self.tasa_exito, 0.05)
+
+# CACHÉ DE RESPUESTAS (memoria LRU + SQLite persistente)
+MODELO_GROQ = "llama-3.1-8b-instant"
+MODELO_OPENROUTER = "google/gemma-7b-it:free"
+CACHE_RESPUESTAS_ACTIVA = os.getenv('CACHE_RESPUESTAS', '1') == '1'
+CACHE_TTL_SEGUNDOS = float(os.getenv('CACHE_TTL_SEGUNDOS', str(7 * 24 * 3600)))
+CACHE_MAX_MEMORIA = int(os.getenv('CACHE_MAX_MEMORIA', '512'))
+CACHE_MAX_DISCO = int(os.getenv('CACHE_MAX_DISCO', '10000'))
+
+VERSION_SYSTEM_PROMPT = hashlib.sha256(SYSTEM_PROMPT_ABOGADO_NOVATO.encode('utf-8')).hexdigest()[:16]
+
+def clave_prompt(prompt: str, modelo: str, id_mensaje: Optional[int] = None) -> str:
+    """Clave estable de una petición: prompt normalizado, modelo y versión del system prompt"""
+    # Un mensaje de Discord ya está normalizado (enrutado, clasificador); un prompt construido
+    # se pliega directamente, sin tokenizarlo ni guardarlo en la caché de normalización
+    plegado = normalizar_mensaje(prompt, id_mensaje).plegado if id_mensaje is not None else normalizar_texto(prompt)
+    base = f"{VERSION_SYSTEM_PROMPT}|{modelo}|{plegado}"
+    return hashlib.sha256(base.encode('utf-8')).hexdigest()
+
+class RespuestaCompartida:
+    """Respuesta en vuelo cuyos fragmentos pueden leer varios consumidores a la vez"""
     def __init__(self):
-        self.groq_api_key = os.getenv('GROQ_API_KEY')
-        self.openrouter_api_key = os.getenv('OPENROUTER_API_KEY')
+        self.fragmentos = []
+        self.terminada = False
+        # El proveedor falló después de publicar texto: lo publicado está truncado
+        self.interrumpida = False
+        self.tarea: Optional[asyncio.Task] = None
+        self._cambio = asyncio.Event()
+    
+    def publicar(self, fragmento: str):
+        self.fragmentos.append(fragmento)
+        self._avisar()
+    
+    def terminar(self):
+        self.terminada = True
+        self._avisar()
+    
+    def _avisar(self):
+        # Despierta a los lectores actuales y prepara un evento nuevo para la próxima espera
+        self._cambio.set()
+        self._cambio = asyncio.Event()
+    
+    async def leer(self):
+        indice = 0
+        while True:
+            while indice < len(self.fragmentos):
+                yield self.fragmentos[indice]
+                indice += 1
+            if self.terminada:
+                return
+            await self._cambio.wait()
+
+class CacheRespuestas:
+    """Caché en dos niveles: LRU en memoria con TTL delante de una tabla SQLite"""
+    def __init__(self, db_path: str = 'bufete_legal.db', ttl: float = CACHE_TTL_SEGUNDOS,
+                 max_memoria: int = CACHE_MAX_MEMORIA, max_disco: int = CACHE_MAX_DISCO):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+    
+    async def obtener(self, clave: str, contar_fallo: bool = True) -> Optional[str]:
+        """Busca en memoria y, si no está, en SQLite (en un hilo, sin bloquear el event loop)"""
+        respuesta = self.obtener_memoria(clave)
+        if respuesta is not None:
+            return respuesta
+        
+        fila = await asyncio.to_thread(self._leer_disco, clave)
+        if fila is not None:
+            self._guardar_memoria(clave, *fila)
+            self.aciertos_disco += 1
+            return fila[0]
+        
+        if contar_fallo:
+            self.registrar_fallo()
+        return None
+    
+    def registrar_fallo(self):
+        self.fallos += 1
     
-    def is_legal_related(self, prompt: str) -> bool:
+    def obtener_memoria(self, clave: str) -> Optional[str]:
+        """Consulta solo el nivel LRU en memoria (síncrona, sin E/S)"""
+        entrada = self._memoria.get(clave)
+        if entrada is None:
+            return None
+        respuesta, creado = entrada
+        if time.time() - creado >= self.ttl:
+            del self._memoria[clave]
+            return None
+        self._memoria.move_to_end(clave)
+        self.aciertos_memoria += 1
+        return respuesta
+    
+    def _leer_disco(self, clave: str) -> Optional[tuple]:
+        ahora = time.time()
+        try:
+            conn = sqlite3.connect(self.db_path)
+            c = conn.cursor()
+            c.execute("SELECT respuesta, creado FROM cache_respuestas WHERE clave = ?", (clave,))
+            fila = c.fetchone()
+            if fila and ahora - fila[1] < self.ttl:
+                c.execute("UPDATE cache_respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+                conn.commit()
+                conn.close()
+                return fila
+            if fila:
+                c.execute("DELETE FROM cache_respuestas WHERE clave = ?", (clave,))
+                conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error leyendo caché de respuestas: {e}")
+        return None
+    
+    async def guardar(self, clave: str, respuesta: str):
+        ahora = time.time()
+        self._guardar_memoria(clave, respuesta, ahora)
+        await asyncio.to_thread(self._guardar_disco, clave, respuesta, ahora)
+    
+    def _guardar_disco(self, clave: str, respuesta: str, ahora: float):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            c = conn.cursor()
+            c.execute("INSERT OR REPLACE INTO cache_respuestas (clave, respuesta, creado, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                     (clave, respuesta, ahora, ahora))
+            # Expulsar las entradas menos usadas si se supera el tamaño máximo
+            c.execute('''DELETE FROM cache_respuestas WHERE clave IN
+                         (SELECT clave FROM cache_respuestas ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?)''',
+                     (self.max_disco,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error guardando en caché de respuestas: {e}")
+    
+    def _guardar_memoria(self, clave: str, respuesta: str, creado: float):
+        self._memoria[clave] = (respuesta, creado)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+    
+    def estadisticas(self) -> dict:
+        total = self.aciertos_memoria + self.aciertos_disco + self.fallos
+        return {
+            'aciertos_memoria': self.aciertos_memoria,
+            'aciertos_disco': self.aciertos_disco,
+            'fallos': self.fallos,
+            'tasa_aciertos': (self.aciertos_memoria + self.aciertos_disco) / total if total else 0.0,
+            'entradas_memoria': len(self._memoria)
+        }
+
+# PROVEEDORES COMPATIBLES CON LA API DE OPENAI
+# Las URL base se pueden sustituir (p. ej. por mock_proveedor_ia.py) para pruebas sin conexión
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', "https://api.groq.com").rstrip('/')
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai").rstrip('/')
+
+PROVEEDORES_IA = {
+    'groq': {
+        'nombre': 'Groq API',
+        'url': f"{GROQ_BASE_URL}/openai/v1/chat/completions",
+        'modelo': MODELO_GROQ,
+        'max_tokens': 2500,
+        'contexto': 131072,
+        'latencia_estimada': 2.0
+    },
+    'openrouter': {
+        'nombre': 'OpenRouter',
+        'url': f"{OPENROUTER_BASE_URL}/api/v1/chat/completions",
+        'modelo': MODELO_OPENROUTER,
+        'max_tokens': None,
+        'contexto': 8192,
+        'latencia_estimada': 5.0
+    }
+}
+
+# POOL DE API KEYS Y ENDPOINTS POR PROVEEDOR
+# <PROVEEDOR>_API_KEYS="clave1,clave2|3" (peso opcional tras |) y
+# <PROVEEDOR>_ENDPOINTS='[{"url": "http://127.0.0.1:8080/v1/chat/completions", "api_key": "local", "peso": 2, "modelo": "llama-3.1-8b"}]'
+BLOQUEO_429_DEFECTO = float(os.getenv('BLOQUEO_429_DEFECTO', '10'))
+# Peso mínimo de un endpoint: random.choices falla si todos los pesos son cero
+PESO_MINIMO_ENDPOINT = 0.01
+PATRON_DURACION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+def parsear_reinicio(valor: Optional[str]) -> Optional[float]:
+    """Segundos hasta el reinicio de cuota: '2m59.56s' (Groq), '7.66s', segundos o epoch en ms"""
+    if not valor:
+        return None
+    valor = valor.strip()
+    try:
+        numero = float(valor)
+    except ValueError:
+        partes = PATRON_DURACION.findall(valor)
+        if not partes:
+            return None
+        factores = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+        return sum(float(cantidad) * factores[unidad] for cantidad, unidad in partes)
+    if numero > 1e12:
+        # Marca de tiempo en milisegundos (OpenRouter)
+        return max(0.0, numero / 1000 - time.time())
+    return numero
+
+class EndpointIA:
+    """Una API key (y URL) de un proveedor, con su cuota restante según las cabeceras de respuesta"""
+    def __init__(self, url: str, api_key: str, peso: float = 1.0, modelo: Optional[str] = None):
+        self.url = url
+        self.api_key = api_key
+        self.peso = peso
+        self.modelo = modelo
+        self.restantes: Optional[int] = None
+        self.limite: Optional[int] = None
+        self.reinicio = 0.0
+        self.bloqueado_hasta = 0.0
+        self.en_vuelo = 0
+        self.peticiones = 0
+    
+    def etiqueta(self) -> str:
+        return f"{self.url} (...{self.api_key[-4:]})"
+    
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def disponible(self, ahora: float) -> bool:
+        return ahora >= self.bloqueado_hasta
+    
+    def peso_efectivo(self, ahora: float) -> float:
+        """Peso configurado, reducido según la cuota que queda y las peticiones en curso"""
+        peso = self.peso
+        if self.restantes is not None and self.limite and ahora < self.reinicio:
+            peso *= max(self.restantes / self.limite, 0.02)
+        return peso / (1 + self.en_vuelo)
+    
+    def actualizar(self, estado: int, cabeceras):
+        """Lee la cuota de las cabeceras x-ratelimit-* y bloquea la clave si está agotada"""
+        ahora = time.monotonic()
+        restantes = cabeceras.get('x-ratelimit-remaining-requests') or cabeceras.get('x-ratelimit-remaining')
+        limite = cabeceras.get('x-ratelimit-limit-requests') or cabeceras.get('x-ratelimit-limit')
+        reinicio = parsear_reinicio(cabeceras.get('x-ratelimit-reset-requests') or cabeceras.get('x-ratelimit-reset'))
+        if restantes is not None and restantes.isdigit():
+            self.restantes = int(restantes)
+        if limite is not None and limite.isdigit():
+            self.limite = int(limite)
+        if reinicio is not None:
+            self.reinicio = ahora + reinicio
+        
+        if estado == 429:
+            espera = parsear_reinicio(cabeceras.get('retry-after'))
+            if espera is None:
+                espera = max(self.reinicio - ahora, BLOQUEO_429_DEFECTO)
+            self.bloqueado_hasta = ahora + espera
+            logger.warning(f"Clave {self.etiqueta()} limitada durante {espera:.1f}s")
+        elif self.restantes == 0 and self.reinicio > ahora:
+            self.bloqueado_hasta = self.reinicio
+
+class PoolEndpoints:
+    """Endpoints de un proveedor con balanceo ponderado según peso y cuota restante"""
+    def __init__(self, endpoints: list):
+        self.endpoints = endpoints
+        self._aleatorio = random.Random()
+    
+    def __len__(self):
+        return len(self.endpoints)
+    
+    def disponible(self) -> bool:
+        ahora = time.monotonic()
+        return any(endpoint.disponible(ahora) for endpoint in self.endpoints)
+    
+    def elegir(self, excluir=()) -> Optional[EndpointIA]:
+        ahora = time.monotonic()
+        candidatos = [e for e in self.endpoints if e.disponible(ahora) and e not in excluir]
+        if not candidatos:
+            return None
+        pesos = [e.peso_efectivo(ahora) for e in candidatos]
+        return self._aleatorio.choices(candidatos, weights=pesos)[0]
+
+def parsear_peso(valor) -> float:
+    """Peso configurado de un endpoint, acotado a PESO_MINIMO_ENDPOINT; ValueError si no es un número"""
+    peso = float(valor)
+    if not math.isfinite(peso):
+        raise ValueError(f"peso no finito: {valor}")
+    return max(peso, PESO_MINIMO_ENDPOINT)
+
+def cargar_endpoints(proveedor: str) -> list:
+    """Construye los endpoints de un proveedor a partir de las variables de entorno"""
+    config = PROVEEDORES_IA[proveedor]
+    prefijo = proveedor.upper()
+    claves = []
+    if os.getenv(f'{prefijo}_API_KEY'):
+        claves.append((os.getenv(f'{prefijo}_API_KEY'), 1.0))
+    for entrada in os.getenv(f'{prefijo}_API_KEYS', '').split(','):
+        entrada = entrada.strip()
+        if not entrada:
+            continue
+        clave, _, peso = entrada.partition('|')
+        try:
+            claves.append((clave.strip(), parsear_peso(peso) if peso else 1.0))
+        except ValueError:
+            # Sin mostrar la clave en el log
+            logger.error(f"{prefijo}_API_KEYS: peso no válido {peso!r} para la clave ...{clave.strip()[-4:]}; se ignora")
+    
+    endpoints = []
+    vistas = set()
+    for clave, peso in claves:
+        if clave not in vistas:
+            vistas.add(clave)
+            endpoints.append(EndpointIA(config['url'], clave, peso))
+    
+    try:
+        extra = json.loads(os.getenv(f'{prefijo}_ENDPOINTS', '[]'))
+    except json.JSONDecodeError as e:
+        logger.error(f"{prefijo}_ENDPOINTS no es JSON válido: {e}")
+        extra = []
+    if not isinstance(extra, list):
+        logger.error(f"{prefijo}_ENDPOINTS debe ser una lista JSON de endpoints")
+        extra = []
+    for posicion, definicion in enumerate(extra):
+        try:
+            endpoints.append(EndpointIA(
+                definicion['url'],
+                definicion.get('api_key', 'sin-clave'),
+                parsear_peso(definicion.get('peso', 1.0)),
+                definicion.get('modelo')
+            ))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            logger.error(f"{prefijo}_ENDPOINTS: entrada {posicion} no válida ({e!r}); se ignora")
+    return endpoints
+
+# Streaming de tokens hacia Discord (segundos mínimos entre ediciones del mensaje)
+STREAMING_IA = os.getenv('STREAMING_IA', '1') == '1'
+STREAM_INTERVALO_EDICION = float(os.getenv('STREAM_INTERVALO_EDICION', '1.2'))
+
+# Clasificador local de temas jurídicos (ver entrenar_clasificador.py). Solo decide cuando
+# está seguro; en la franja intermedia se usa la heurística de palabras clave.
+RUTA_CLASIFICADOR = os.getenv('RUTA_CLASIFICADOR', 'clasificador_juridico.npz')
+CLASIFICADOR_UMBRAL_JURIDICO = float(os.getenv('CLASIFICADOR_UMBRAL_JURIDICO', '0.65'))
+CLASIFICADOR_UMBRAL_NO_JURIDICO = float(os.getenv('CLASIFICADOR_UMBRAL_NO_JURIDICO', '0.35'))
+CLASIFICADOR_JURIDICO = ClasificadorJuridico.cargar(RUTA_CLASIFICADOR)
+if CLASIFICADOR_JURIDICO is None:
+    logger.warning(f"⚠️ No se encontró el clasificador {RUTA_CLASIFICADOR}; se usará solo la heurística de palabras clave")
+
+MENSAJE_NO_JURIDICO = "⚠️ Lo siento, solo puedo responder preguntas relacionadas con derecho y asuntos jurídicos. Como abogado junior, debo mantenerme dentro de mi área de expertise."
+MENSAJE_IA_NO_DISPONIBLE = "⚠️ Los servicios de IA no están disponibles temporalmente. Como abogado junior, recomiendo consultar directamente con un socio senior."
+MENSAJE_RESPUESTA_INTERRUMPIDA = "\n\n⚠️ La respuesta se interrumpió por un error del servicio de IA y está incompleta. Vuelve a intentarlo en unos minutos."
+
+class AIAssistant:
+    def __init__(self, http: Optional[ClienteHTTPIA] = None):
+        self.pools = {proveedor: PoolEndpoints(cargar_endpoints(proveedor)) for proveedor in PROVEEDORES_IA}
+        # Modelos que pueden responder (también los de *_ENDPOINTS): forman parte de la clave de caché
+        self.firma_modelos = '|'.join(sorted({endpoint.modelo or PROVEEDORES_IA[proveedor]['modelo']
+                                              for proveedor, pool in self.pools.items()
+                                              for endpoint in pool.endpoints}))
+        self.http = http or ClienteHTTPIA()
+        self.hedging = HEDGING_IA
+        self.latencias = {proveedor: EstadisticasLatencia() for proveedor in PROVEEDORES_IA}
+        # Tiempo hasta el primer fragmento en streaming: decide cuándo cubrir un stream lento
+        self.latencias_primer_fragmento = {proveedor: EstadisticasLatencia() for proveedor in PROVEEDORES_IA}
+        self.salud = {proveedor: SaludProveedor(config['nombre'], config['latencia_estimada'])
+                      for proveedor, config in PROVEEDORES_IA.items()}
+        self.cache = CacheRespuestas() if CACHE_RESPUESTAS_ACTIVA else None
+        # Peticiones idénticas en vuelo (single-flight): clave -> RespuestaCompartida
+        self._en_vuelo = {}
+        self.peticiones_coalescidas = 0
+    
+    def is_legal_related(self, prompt: str, id_mensaje: Optional[int] = None) -> bool:
         """Verifica SIEMPRE si el prompt está relacionado con derecho"""
-        prompt_lower = prompt.lower()
-        
-        palabras_no_juridicas = [
-            'tecnología', 'tecnologia', 'ciencia', 'salud', 'bienestar', 'finanzas',
-            'negocios', 'cultura', 'educación', 'educacion', 'historia', 'geografía',
-            'geografia', 'entretenimiento', 'videojuegos', 'deportes', 'cocina',
-            'música', 'musica', 'arte', 'cine', 'películas', 'series', 'programación',
-            'programacion', 'matemáticas', 'matematicas', 'física', 'fisica', 'química',
-            'quimica', 'biología', 'biologia', 'medicina', 'deporte', 'ejercicio',
-            'video', 'juego', 'juguete', 'comida', 'receta', 'música', 'deporte', 'ejercicio',
-        ]
-        
-        excepciones_juridicas = [
-            'propiedad', 'derecho', 'contrato', 'ley', 'legal', 'jurídico', 'juicio',
-            'proceso', 'demanda', 'testamento', 'herencia', 'usufructo', 'nuda propiedad'
-        ]
-        
-        for palabra in palabras_no_juridicas:
-            if palabra in prompt_lower and not any(exc in prompt_lower for exc in excepciones_juridicas):
+        mensaje = normalizar_mensaje(prompt, id_mensaje)
+        if mensaje.es_juridico is None:
+            mensaje.es_juridico = self._clasificar(mensaje)
+        return mensaje.es_juridico
+
+    def _clasificar(self, mensaje: MensajeNormalizado) -> bool:
+        if CLASIFICADOR_JURIDICO is not None:
+            probabilidad = CLASIFICADOR_JURIDICO.probabilidad_tokens(mensaje.tokens, mensaje.ngramas)
+            if probabilidad >= CLASIFICADOR_UMBRAL_JURIDICO:
+                return True
+            if probabilidad <= CLASIFICADOR_UMBRAL_NO_JURIDICO:
                 return False
+        return self._heuristica_juridica(mensaje)
+
+    def _heuristica_juridica(self, mensaje: MensajeNormalizado) -> bool:
+        """Heurística de palabras clave (respaldo del clasificador)"""
+        texto = mensaje.plegado
+        if (BUSCADOR_NO_JURIDICOS.contiene(texto, plegado=True)
+                and not BUSCADOR_EXCEPCIONES_JURIDICAS.contiene(texto, plegado=True)):
+            return False
         
-        for term in LEGAL_TERMS:
-            if term in prompt_lower:
-                return True
+        if BUSCADOR_TERMINOS_LEGALES.contiene(texto, plegado=True):
+            return True
         
-        patterns = [
-            r'(cómo|como)\s+(demandar|demandar|demanda|reclamar).*',
-            r'(qué|que)\s+(debo|debería|deberia).*(hacer|hacerlo|proceder).*(legal|ley|derecho)',
-            r'(necesito|quiero)\s+(hacer|redactar).*(contrato|testamento|poder)',
-            r'(cuánto|cuanto)\s+(tiempo|dura|tarda).*(proceso|juicio|demanda)',
-            r'(qué|que)\s+(derechos|obligaciones).*(tengo|tiene)',
-            r'(es|son)\s+(legal|legales|ilegal|ilegales).*',
-        ]
-        
-        for pattern in patterns:
-            if re.search(pattern, prompt_lower):
-                return True
-                
-        return False
+        return REGISTRO_REGEX.alguno(PATRONES_CONSULTA_JURIDICA, texto)
     
-    def groq_assistant(self, prompt: str) -> Optional[str]:
-        """Usa Groq API con Llama 3.1 para temas legales"""
-        if not self.groq_api_key:
+    def _payload(self, proveedor: str, endpoint: EndpointIA, prompt: str, stream: bool = False) -> dict:
+        """Cuerpo de la petición de chat para el proveedor y endpoint indicados"""
+        config = PROVEEDORES_IA[proveedor]
+        payload = {
+            "model": endpoint.modelo or config['modelo'],
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT_ABOGADO_NOVATO
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7
+        }
+        if config['max_tokens']:
+            payload["max_tokens"] = config['max_tokens']
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    async def _completar(self, proveedor: str, prompt: str) -> Optional[str]:
+        """Pide una respuesta completa (sin streaming) al proveedor, rotando de clave ante un 429"""
+        pool = self.pools[proveedor]
+        if not self.salud[proveedor].reservar_sonda():
+            # Semiabierto con la sonda ya ocupada por otra petición
             return None
+        intentados = []
+        inicio = time.perf_counter()
+        while True:
+            endpoint = pool.elegir(excluir=intentados)
+            if endpoint is None:
+                if intentados:
+                    # Todas las claves del proveedor están limitadas
+                    self.salud[proveedor].registrar_fallo()
+                else:
+                    self.salud[proveedor].liberar_sonda()
+                return None
+            intentados.append(endpoint)
             
-        try:
-            url = "https://api.groq.com/openai/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.groq_api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "llama-3.1-8b-instant",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": SYSTEM_PROMPT_ABOGADO_NOVATO
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2500
-            }
+            endpoint.en_vuelo += 1
+            endpoint.peticiones += 1
+            try:
+                data = await self.http.post_json(endpoint.url, endpoint.headers(),
+                                                 self._payload(proveedor, endpoint, prompt),
+                                                 observar=endpoint.actualizar)
+                respuesta = data['choices'][0]['message']['content']
+                
+            except asyncio.CancelledError:
+                self.salud[proveedor].liberar_sonda()
+                raise
+            except aiohttp.ClientResponseError as e:
+                if e.status == 429:
+                    continue
+                logger.error(f"Error con {PROVEEDORES_IA[proveedor]['nombre']}: {e}")
+                self.salud[proveedor].registrar_fallo()
+                return None
+            except Exception as e:
+                logger.error(f"Error con {PROVEEDORES_IA[proveedor]['nombre']}: {e}")
+                self.salud[proveedor].registrar_fallo()
+                return None
+            finally:
+                endpoint.en_vuelo -= 1
             
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
+            self._registrar_exito(proveedor, time.perf_counter() - inicio)
+            return respuesta
+    
+    def _registrar_exito(self, proveedor: str, latencia: float):
+        self.latencias[proveedor].registrar(latencia)
+        self.salud[proveedor].registrar_exito(latencia)
+    
+    async def groq_assistant(self, prompt: str) -> Optional[str]:
+        """Usa Groq API con Llama 3.1 para temas legales"""
+        return await self._completar('groq', prompt)
+    
+    async def openrouter_assistant(self, prompt: str) -> Optional[str]:
+        """Usa OpenRouter como alternativa para temas legales"""
+        return await self._completar('openrouter', prompt)
+    
+    def orden_proveedores(self) -> list:
+        """Proveedores utilizables ordenados por salud; los de circuito abierto no cuestan nada"""
+        candidatos = []
+        for indice, proveedor in enumerate(PROVEEDORES_IA):
+            if not self.pools[proveedor].disponible():
+                continue
+            if not self.salud[proveedor].disponible():
+                continue
+            candidatos.append((self.salud[proveedor].puntuacion(), indice, proveedor))
+        return [proveedor for *_, proveedor in sorted(candidatos)]
+    
+    def retraso_cobertura(self, proveedor: str = 'groq', primer_fragmento: bool = False) -> float:
+        """Tiempo de espera antes de lanzar la petición de respaldo, según el p95 observado"""
+        estadisticas = (self.latencias_primer_fragmento if primer_fragmento else self.latencias)[proveedor]
+        if len(estadisticas.muestras) < HEDGE_MUESTRAS_MIN:
+            return HEDGE_RETRASO_DEFECTO
+        retraso = estadisticas.percentil(HEDGE_PERCENTIL)
+        return max(HEDGE_RETRASO_MIN, min(HEDGE_RETRASO_MAX, retraso))
+    
+    async def _respuesta_cubierta(self, prompt: str, primario: str, respaldo: str) -> Optional[str]:
+        """Lanza el primario y, si no responde a tiempo, el respaldo en paralelo; gana el primero"""
+        primaria = asyncio.create_task(self._completar(primario, prompt))
+        pendientes = {primaria}
+        try:
+            hechas, _ = await asyncio.wait(pendientes, timeout=self.retraso_cobertura(primario))
+            if hechas:
+                pendientes = set()
+                respuesta = primaria.result()
+                if respuesta:
+                    return respuesta
+                # El primario falló rápido: no hay carrera, solo el respaldo
+                return await self._completar(respaldo, prompt)
             
-        except Exception as e:
-            logger.error(f"Error con Groq API: {e}")
+            logger.info(f"{PROVEEDORES_IA[primario]['nombre']} supera el retraso de cobertura, lanzando {PROVEEDORES_IA[respaldo]['nombre']} en paralelo")
+            pendientes.add(asyncio.create_task(self._completar(respaldo, prompt)))
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    respuesta = tarea.result()
+                    if respuesta:
+                        return respuesta
             return None
+        finally:
+            # Cancelar la petición perdedora para liberar la conexión
+            for tarea in pendientes:
+                tarea.cancel()
     
-    def openrouter_assistant(self, prompt: str) -> Optional[str]:
-        """Usa OpenRouter como alternativa para temas legales"""
-        if not self.openrouter_api_key:
+    async def get_response(self, prompt: str, id_mensaje: Optional[int] = None,
+                           comprobar_tema: bool = True) -> str:
+        """Obtiene respuesta de la IA disponible para temas legales.
+        
+        comprobar_tema=False cuando el llamante ya validó la pregunta original y el prompt
+        lleva contexto añadido (RAG), que no debe volver a clasificarse.
+        """
+        if comprobar_tema and not self.is_legal_related(prompt, id_mensaje):
+            return MENSAJE_NO_JURIDICO
+        
+        clave = self._clave_peticion(prompt, id_mensaje)
+        if self.cache is not None:
+            # El fallo lo contabiliza solo quien lanza la petición (ver _compartir)
+            response = await self.cache.obtener(clave, contar_fallo=False)
+            if response:
+                return response
+        
+        # Si se une a un streaming que se corta a medias, repite la consulta (de nuevo compartida)
+        for _ in range(2):
+            compartida = self._compartir(clave, lambda c: self._producir_completa(prompt, clave, c))
+            response = ''.join([fragmento async for fragmento in compartida.leer()])
+            if not compartida.interrumpida:
+                return response or MENSAJE_IA_NO_DISPONIBLE
+        return MENSAJE_IA_NO_DISPONIBLE
+    
+    async def respuesta_en_cache(self, prompt: str, id_mensaje: Optional[int] = None) -> Optional[str]:
+        """Devuelve la respuesta cacheada para el prompt sin llamar a ningún proveedor"""
+        if self.cache is None:
             return None
-            
+        # El fallo se contabiliza después, cuando se consulte de verdad a la IA
+        return await self.cache.obtener(self._clave_peticion(prompt, id_mensaje), contar_fallo=False)
+    
+    def _clave_peticion(self, prompt: str, id_mensaje: Optional[int] = None) -> str:
+        return clave_prompt(prompt, self.firma_modelos, id_mensaje)
+    
+    async def stream_response(self, prompt: str, id_mensaje: Optional[int] = None, comprobar_tema: bool = True):
+        """Genera la respuesta por fragmentos a medida que el proveedor la emite (SSE); ver
+        get_response para comprobar_tema"""
+        if comprobar_tema and not self.is_legal_related(prompt, id_mensaje):
+            yield MENSAJE_NO_JURIDICO
+            return
+        
+        clave = self._clave_peticion(prompt, id_mensaje)
+        if self.cache is not None:
+            # El fallo lo contabiliza solo quien lanza la petición (ver _compartir)
+            response = await self.cache.obtener(clave, contar_fallo=False)
+            if response:
+                yield response
+                return
+        
+        compartida = self._compartir(clave, lambda c: self._producir_stream(prompt, clave, c))
+        recibido = False
+        async for fragmento in compartida.leer():
+            recibido = True
+            yield fragmento
+        if compartida.interrumpida:
+            yield MENSAJE_RESPUESTA_INTERRUMPIDA
+        elif not recibido:
+            yield MENSAJE_IA_NO_DISPONIBLE
+    
+    def _compartir(self, clave: str, productor) -> RespuestaCompartida:
+        """Se une a la petición idéntica en vuelo o lanza una nueva con el productor dado"""
+        compartida = self._en_vuelo.get(clave)
+        if compartida is not None:
+            self.peticiones_coalescidas += 1
+            return compartida
+        
+        # Un fallo de caché por petición real al proveedor, no por cada consumidor coalescido
+        if self.cache is not None:
+            self.cache.registrar_fallo()
+        compartida = RespuestaCompartida()
+        self._en_vuelo[clave] = compartida
+        
+        async def ejecutar():
+            try:
+                await productor(compartida)
+            except Exception as e:
+                logger.error(f"Error obteniendo respuesta de IA: {e}")
+                compartida.interrumpida = bool(compartida.fragmentos)
+            finally:
+                self._en_vuelo.pop(clave, None)
+                compartida.terminar()
+        
+        # La tarea no depende de ningún consumidor: si uno cancela, los demás siguen recibiendo
+        compartida.tarea = asyncio.create_task(ejecutar())
+        return compartida
+    
+    async def _guardar_cache(self, clave: str, respuesta: str):
+        if self.cache is not None:
+            await self.cache.guardar(clave, respuesta)
+    
+    async def _producir_completa(self, prompt: str, clave: str, compartida: RespuestaCompartida):
+        response = await self._consultar_proveedores(prompt)
+        if response:
+            compartida.publicar(response)
+            await self._guardar_cache(clave, response)
+    
+    async def _producir_stream(self, prompt: str, clave: str, compartida: RespuestaCompartida):
+        orden = self.orden_proveedores()
+        partes = None
+        if self.hedging and len(orden) >= 2:
+            partes = await self._stream_cubierto(prompt, orden[0], orden[1], compartida)
+        else:
+            for proveedor in orden:
+                partes = await self._stream_proveedor(proveedor, prompt, compartida.publicar)
+                if partes is not None:
+                    break
+        if partes is None:
+            return
+        if not partes:
+            # Con texto parcial ya publicado no se mezclan respuestas de dos proveedores ni
+            # se cachea nada: los lectores reciben la marca de respuesta interrumpida
+            compartida.interrumpida = True
+            return
+        await self._guardar_cache(clave, ''.join(partes))
+    
+    async def _stream_cubierto(self, prompt: str, primario: str, respaldo: str,
+                               compartida: RespuestaCompartida) -> Optional[list]:
+        """Como _respuesta_cubierta, pero la carrera la gana el primer stream que emite un fragmento.
+        
+        El perdedor se cancela antes de que el ganador publique nada en `compartida`.
+        """
+        tareas = {}
+        ganador = None
+        
+        def publicador(proveedor: str):
+            def publicar(fragmento: str):
+                nonlocal ganador
+                if ganador is None:
+                    ganador = proveedor
+                    for otro, tarea in tareas.items():
+                        if otro != proveedor:
+                            tarea.cancel()
+                compartida.publicar(fragmento)
+            return publicar
+        
+        primaria = asyncio.create_task(self._stream_proveedor(primario, prompt, publicador(primario)))
+        tareas[primario] = primaria
         try:
-            url = "https://openrouter.ai/api/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "google/gemma-7b-it:free",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": SYSTEM_PROMPT_ABOGADO_NOVATO
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.7
-            }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            return response.json()['choices'][0]['message']['content']
+            hechas, _ = await asyncio.wait({primaria}, timeout=self.retraso_cobertura(primario, primer_fragmento=True))
+            if hechas:
+                partes = primaria.result()
+                if partes is not None:
+                    return partes
+                # El primario falló rápido sin emitir nada: no hay carrera, solo el respaldo
+                return await self._stream_proveedor(respaldo, prompt, compartida.publicar)
+            if ganador is not None:
+                # El primario ya está emitiendo: no hace falta respaldo
+                return await primaria
             
-        except Exception as e:
-            logger.error(f"Error con OpenRouter: {e}")
+            logger.info(f"{PROVEEDORES_IA[primario]['nombre']} no emite a tiempo, lanzando {PROVEEDORES_IA[respaldo]['nombre']} en paralelo")
+            tareas[respaldo] = asyncio.create_task(self._stream_proveedor(respaldo, prompt, publicador(respaldo)))
+            pendientes = set(tareas.values())
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.cancelled():
+                        continue
+                    partes = tarea.result()
+                    if partes is not None:
+                        return partes
             return None
+        finally:
+            for tarea in tareas.values():
+                tarea.cancel()
     
-    def get_response(self, prompt: str) -> str:
-        """Obtiene respuesta de la IA disponible para temas legales"""
-        if not self.is_legal_related(prompt):
-            return "⚠️ Lo siento, solo puedo responder preguntas relacionadas con derecho y asuntos jurídicos. Como abogado junior, debo mantenerme dentro de mi área de expertise."
+    async def _stream_proveedor(self, proveedor: str, prompt: str, publicar) -> Optional[list]:
+        """Publica los fragmentos de un proveedor; None si falló sin emitir nada, [] si falló a medias"""
+        pool = self.pools[proveedor]
+        if not self.salud[proveedor].reservar_sonda():
+            # Semiabierto con la sonda ya ocupada por otra petición
+            return None
+        intentados = []
+        inicio = time.perf_counter()
+        while True:
+            endpoint = pool.elegir(excluir=intentados)
+            if endpoint is None:
+                if intentados:
+                    self.salud[proveedor].registrar_fallo()
+                else:
+                    self.salud[proveedor].liberar_sonda()
+                return None
+            intentados.append(endpoint)
             
-        response = self.groq_assistant(prompt)
-        if response:
-            return response
+            partes = []
+            endpoint.en_vuelo += 1
+            endpoint.peticiones += 1
+            try:
+                async for fragmento in self.http.post_stream(endpoint.url, endpoint.headers(),
+                                                             self._payload(proveedor, endpoint, prompt, stream=True),
+                                                             observar=endpoint.actualizar):
+                    if not partes:
+                        self.latencias_primer_fragmento[proveedor].registrar(time.perf_counter() - inicio)
+                    partes.append(fragmento)
+                    publicar(fragmento)
+            except asyncio.CancelledError:
+                self.salud[proveedor].liberar_sonda()
+                raise
+            except Exception as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 429 and not partes:
+                    continue
+                logger.error(f"Error en streaming con {PROVEEDORES_IA[proveedor]['nombre']}: {e}")
+                self.salud[proveedor].registrar_fallo()
+                # Lista vacía: hubo texto parcial publicado, que no debe cachearse
+                return [] if partes else None
+            finally:
+                endpoint.en_vuelo -= 1
             
-        response = self.openrouter_assistant(prompt)
-        if response:
-            return response
+            if not partes:
+                self.salud[proveedor].registrar_fallo()
+                return None
             
-        return "⚠️ Los servicios de IA no están disponibles temporalmente. Como abogado junior, recomiendo consultar directamente con un socio senior."
+            self._registrar_exito(proveedor, time.perf_counter() - inicio)
+            return partes
+    
+    async def _consultar_proveedores(self, prompt: str) -> Optional[str]:
+        """Consulta los proveedores (con cobertura si está activa) sin pasar por la caché"""
+        orden = self.orden_proveedores()
+        if self.hedging and len(orden) >= 2:
+            return await self._respuesta_cubierta(prompt, orden[0], orden[1])
+        
+        for proveedor in orden:
+            response = await self._completar(proveedor, prompt)
+            if response:
+                return response
+        return None
+
+# EXTRACCIÓN DE PDF (en procesos aparte, ver extraccion_pdf.py)
+# Tope absoluto de extracción. analizar_documento extrae solo lo que cubren los fragmentos
+# del plan del usuario, multiplicado por MARGEN_EXTRACCION para poder descartar los menos
+# relevantes (ver max_caracteres_extraccion)
+MAX_CARACTERES_EXTRACCION = int(os.getenv('MAX_CARACTERES_EXTRACCION', '200000'))
+MAX_PAGINAS_EXTRACCION = int(os.getenv('MAX_PAGINAS_EXTRACCION', '150'))
+MARGEN_EXTRACCION = float(os.getenv('MARGEN_EXTRACCION', '2'))
+
+# Los adjuntos de hasta este tamaño se procesan en memoria; los mayores, en un temporal único
+ADJUNTO_MAX_MEMORIA_MB = float(os.getenv('ADJUNTO_MAX_MEMORIA_MB', '8'))
+
+pool_pdf = PoolExtraccionPDF()
 
-def extract_text_from_pdf(pdf_path: str) -> Optional[str]:
-    """Extrae texto del PDF del syllabus"""
-    text = ""
+async def extraer_texto_pdf(fuente, max_caracteres: Optional[int] = None,
+                            max_paginas: Optional[int] = None) -> Optional[str]:
+    """Extrae el texto (de una ruta o de bytes) sin bloquear el bot; None si el PDF falla,
+    tarda demasiado o agota la memoria"""
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"Error leyendo PDF: {e}")
+        return await pool_pdf.extraer(fuente, max_caracteres, max_paginas)
+    except ErrorExtraccionPDF as e:
+        origen = "adjunto en memoria" if isinstance(fuente, bytes) else fuente
+        logger.error(f"Error leyendo PDF ({origen}): {e}")
         return None
 
+async def cargar_syllabus(ruta_pdf: str) -> Optional[str]:
+    """Texto del syllabus desde su artefacto precompilado; solo se vuelve a extraer si el PDF cambió"""
+    global artefacto_syllabus
+    # on_ready se repite tras cada reconexión: si el PDF no cambió, no hay nada que hacer
+    if artefacto_syllabus is not None and await asyncio.to_thread(artefacto_syllabus.vigente, ruta_pdf):
+        return artefacto_syllabus.texto
+    
+    artefacto = await asyncio.to_thread(cargar_artefacto, ruta_pdf)
+    if artefacto is None:
+        texto = await extraer_texto_pdf(ruta_pdf)
+        if not texto:
+            return None
+        try:
+            await asyncio.to_thread(construir_artefacto, ruta_pdf, None, texto)
+            artefacto = await asyncio.to_thread(cargar_artefacto, ruta_pdf)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el artefacto del syllabus: {e}")
+        if artefacto is None:
+            return texto
+    
+    if artefacto_syllabus is not None:
+        artefacto_syllabus.cerrar()
+    artefacto_syllabus = artefacto
+    return artefacto.texto
+
+# CORPUS JURÍDICO (códigos, leyes y memorandos indexados con FTS5, ver corpus_juridico.py)
+corpus_juridico = CorpusJuridico(CORPUS_DB)
+ingesta_corpus = None  # Proceso de ingesta en curso, para no lanzar dos a la vez
+
+async def ingerir_corpus() -> int:
+    """Ingesta incremental en un proceso aparte (la extracción de PDF no debe frenar al bot)"""
+    proceso = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus_juridico.py'),
+        '--directorio', CORPUS_DIR, '--db', CORPUS_DB
+    )
+    return await proceso.wait()
+
+# CACHÉ DE DOCUMENTOS POR CONTENIDO
+CACHE_DOCUMENTOS_ACTIVA = os.getenv('CACHE_DOCUMENTOS', '1') == '1'
+CACHE_DOCUMENTOS_MAX_MB = float(os.getenv('CACHE_DOCUMENTOS_MAX_MB', '200'))
+# Forma parte de la huella: si cambian los límites o el extractor, el texto guardado
+# (quizá recortado con otros límites) deja de reutilizarse. Subir la versión al cambiar el extractor.
+def version_extraccion(max_caracteres: int) -> str:
+    return f"1|{max_caracteres}|{MAX_PAGINAS_EXTRACCION}"
+
+class CacheDocumentos:
+    """Texto extraído, área jurídica y dictamen de cada documento, por huella de contenido (LRU por tamaño)"""
+    def __init__(self, db_path: str = 'bufete_legal.db', max_mb: float = CACHE_DOCUMENTOS_MAX_MB):
+        self.db_path = db_path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, huella: str) -> Optional[dict]:
+        try:
+            conn = sqlite3.connect(self.db_path)
+            c = conn.cursor()
+            c.execute("SELECT texto, analisis, dictamen, version, creado FROM cache_documentos WHERE huella = ?", (huella,))
+            fila = c.fetchone()
+            if fila:
+                c.execute("UPDATE cache_documentos SET ultimo_acceso = ? WHERE huella = ?", (time.time(), huella))
+                conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error leyendo caché de documentos: {e}")
+            return None
+        if not fila:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        texto, analisis, dictamen, version, creado = fila
+        return {
+            'texto': zlib.decompress(texto).decode('utf-8'),
+            'analisis': json.loads(analisis) if analisis else None,
+            'dictamen': dictamen,
+            'version': version,
+            'creado': creado
+        }
+    
+    def guardar(self, huella: str, nombre: str, texto: str, analisis: dict, dictamen: Optional[str], version: str):
+        ahora = time.time()
+        comprimido = zlib.compress(texto.encode('utf-8'), 6)
+        analisis_json = json.dumps(analisis, ensure_ascii=False)
+        tamano = len(comprimido) + len(analisis_json) + len(dictamen or '')
+        try:
+            conn = sqlite3.connect(self.db_path)
+            c = conn.cursor()
+            c.execute('''INSERT OR REPLACE INTO cache_documentos
+                         (huella, nombre, texto, analisis, dictamen, version, tamano, creado, ultimo_acceso)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (huella, nombre, comprimido, analisis_json, dictamen, version, tamano, ahora, ahora))
+            # Expulsar los documentos menos usados hasta volver al tamaño máximo
+            c.execute('''DELETE FROM cache_documentos WHERE huella IN
+                         (SELECT huella FROM (SELECT huella, SUM(tamano) OVER (ORDER BY ultimo_acceso DESC) AS acumulado
+                                              FROM cache_documentos) WHERE acumulado > ?)''',
+                     (self.max_bytes,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error guardando en caché de documentos: {e}")
+
+cache_documentos = CacheDocumentos() if CACHE_DOCUMENTOS_ACTIVA else None
+
+async def huella_contenido(contenido, max_caracteres: int) -> str:
+    """SHA-256 de version_extraccion(max_caracteres) y de los bytes del documento (o del
+    archivo temporal, leído por bloques en un hilo)"""
+    version = version_extraccion(max_caracteres).encode('utf-8') + b'\x00'
+    if isinstance(contenido, bytes):
+        return hashlib.sha256(version + contenido).hexdigest()
+    def calcular():
+        resumen = hashlib.sha256(version)
+        with open(contenido, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+                resumen.update(bloque)
+        return resumen.hexdigest()
+    return await asyncio.to_thread(calcular)
+
+@asynccontextmanager
+async def contenido_adjunto(archivo: discord.Attachment):
+    """Bytes del adjunto o, si supera ADJUNTO_MAX_MEMORIA_MB, ruta de un temporal único que se borra al salir"""
+    if archivo.size <= ADJUNTO_MAX_MEMORIA_MB * 1024 * 1024:
+        yield await archivo.read()
+        return
+    descriptor, ruta = tempfile.mkstemp(prefix="adjunto_", suffix=os.path.splitext(archivo.filename)[1])
+    os.close(descriptor)
+    try:
+        await archivo.save(ruta)
+        yield ruta
+    finally:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+# DESCARGA DE DOCUMENTOS DESDE URL
+URL_MAX_MB = float(os.getenv('URL_MAX_MB', '25'))
+URL_TIMEOUT = float(os.getenv('URL_TIMEOUT', '30'))
+URL_CACHE_DIR = os.getenv('URL_CACHE_DIR', 'cache_urls')
+URL_CACHE_MAX_MB = float(os.getenv('URL_CACHE_MAX_MB', '500'))
+# Los documentos usados hace menos de esto no se podan: puede haber un análisis leyéndolos
+URL_CACHE_GRACIA = float(os.getenv('URL_CACHE_GRACIA', '600'))
+URL_MAX_REDIRECCIONES = 5
+URL_TAMANO_BLOQUE = 64 * 1024
+# Solo para pruebas locales (p. ej. contra mock_proveedor_ia.py): permite descargar de la red interna
+URL_PERMITIR_INTERNAS = os.getenv('URL_PERMITIR_INTERNAS', '0') == '1'
+
+class ErrorDescarga(Exception):
+    """Fallo al descargar un documento; el mensaje se puede mostrar al usuario"""
+
+class DireccionNoPermitida(OSError):
+    """El destino de una descarga es una dirección interna (loopback, privada, link-local...)"""
+
+def direccion_publica(direccion: str) -> bool:
+    """Solo direcciones enrutables en Internet: fuera loopback, privadas, link-local, reservadas..."""
+    try:
+        ip = ipaddress.ip_address(direccion.split('%', 1)[0])
+    except ValueError:
+        return False
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+class ResolvedorPublico(aiohttp.abc.AbstractResolver):
+    """DNS que descarta las direcciones internas. Se aplica al conectar (en cada salto de una
+    redirección), así que un DNS que cambie de respuesta tras una comprobación previa no sirve de nada"""
+    def __init__(self):
+        self._resolvedor = aiohttp.ThreadedResolver()
+    
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET) -> list:
+        direcciones = await self._resolvedor.resolve(host, port, family)
+        publicas = [d for d in direcciones if direccion_publica(d['host'])]
+        if not publicas:
+            raise DireccionNoPermitida(f"{host} solo resuelve a direcciones internas")
+        return publicas
+    
+    async def close(self):
+        await self._resolvedor.close()
+
+class ExtractorTextoHTML(HTMLParser):
+    """Texto visible de una página (sin scripts, estilos ni navegación)"""
+    IGNORADAS = {'script', 'style', 'noscript', 'nav', 'header', 'footer', 'template'}
+    BLOQUES = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'article', 'section'}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.partes = []
+        self.ignorando = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.IGNORADAS:
+            self.ignorando += 1
+        elif tag in self.BLOQUES:
+            self.partes.append('\n')
+    
+    def handle_endtag(self, tag):
+        if tag in self.IGNORADAS and self.ignorando:
+            self.ignorando -= 1
+        elif tag in self.BLOQUES:
+            self.partes.append('\n')
+    
+    def handle_data(self, data):
+        if not self.ignorando:
+            self.partes.append(data)
+    
+    def texto(self) -> str:
+        lineas = (' '.join(linea.split()) for linea in ''.join(self.partes).split('\n'))
+        return '\n'.join(linea for linea in lineas if linea)
+
+def detectar_tipo_documento(muestra: bytes, content_type: str) -> Optional[str]:
+    """'pdf', 'html' o 'texto' según los primeros bytes (el Content-Type de muchos servidores miente)"""
+    if b'%PDF-' in muestra[:1024]:
+        return 'pdf'
+    inicio = muestra[:512].lstrip().lower()
+    if 'html' in content_type or inicio.startswith((b'<!doctype html', b'<html', b'<?xml')):
+        return 'html'
+    if content_type.startswith('text/') or 'json' in content_type:
+        return 'texto'
+    try:
+        muestra[:4096].decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Un carácter multibyte cortado al final de la muestra no cuenta como binario
+        if e.start < len(muestra[:4096]) - 4:
+            return None
+    return 'texto'
+
+class DocumentoDescargado:
+    """Documento descargado en la caché de disco"""
+    def __init__(self, url: str, ruta: str, meta: dict, desde_cache: bool):
+        self.url = url
+        self.ruta = ruta
+        self.tipo = meta['tipo']
+        self.charset = meta.get('charset') or 'utf-8'
+        self.nombre = meta.get('nombre') or url
+        self.tamano = meta.get('tamano', 0)
+        self.desde_cache = desde_cache
+    
+    def texto(self, max_caracteres: Optional[int] = None) -> str:
+        """Texto de un documento HTML o de texto plano (los PDF van al pool de extracción)"""
+        with open(self.ruta, 'rb') as archivo:
+            contenido = archivo.read()
+        try:
+            texto = contenido.decode(self.charset, errors='replace')
+        except LookupError:
+            texto = contenido.decode('utf-8', errors='replace')
+        if self.tipo == 'html':
+            extractor = ExtractorTextoHTML()
+            extractor.feed(texto)
+            extractor.close()
+            texto = extractor.texto()
+        return texto[:max_caracteres] if max_caracteres else texto
+
+class DescargadorDocumentos:
+    """Descargas en streaming con límite de tamaño y caché en disco con GET condicional (ETag/Last-Modified)"""
+    def __init__(self, directorio: str = URL_CACHE_DIR, max_mb: float = URL_MAX_MB,
+                 cache_max_mb: float = URL_CACHE_MAX_MB, timeout: float = URL_TIMEOUT):
+        self.directorio = directorio
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.cache_max_bytes = int(cache_max_mb * 1024 * 1024)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.descargas = 0
+        self.revalidadas = 0
+        self.aciertos = 0
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # Sin caché DNS propia: cada conexión pasa por ResolvedorPublico
+            connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONEXIONES, keepalive_timeout=HTTP_KEEPALIVE,
+                                             use_dns_cache=False,
+                                             resolver=None if URL_PERMITIR_INTERNAS else ResolvedorPublico())
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers={'User-Agent': 'LexIA-AbogadoJunior/1.0'})
+        return self._session
+    
+    def _rutas(self, url: str) -> tuple:
+        clave = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directorio, clave)
+        return base + '.bin', base + '.json'
+    
+    def _leer_meta(self, ruta_meta: str, ruta_datos: str) -> Optional[dict]:
+        if not os.path.exists(ruta_datos):
+            return None
+        try:
+            with open(ruta_meta, encoding='utf-8') as archivo:
+                return json.loads(archivo.read())
+        except (OSError, ValueError):
+            return None
+    
+    def _escribir_meta(self, ruta_meta: str, meta: dict):
+        temporal = ruta_meta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(meta, ensure_ascii=False))
+        os.replace(temporal, ruta_meta)
+    
+    @staticmethod
+    def _max_age(cache_control: str) -> Optional[int]:
+        directivas = [d.strip().lower() for d in cache_control.split(',')]
+        if 'no-cache' in directivas or 'no-store' in directivas:
+            return None
+        for directiva in directivas:
+            if directiva.startswith('max-age='):
+                try:
+                    return int(directiva[8:])
+                except ValueError:
+                    return None
+        return None
+    
+    @staticmethod
+    def _nombre(url: str, response: aiohttp.ClientResponse) -> str:
+        disposicion = response.content_disposition
+        if disposicion is not None and disposicion.filename:
+            return disposicion.filename
+        ruta = response.url.path.rstrip('/')
+        return ruta.rsplit('/', 1)[-1] or response.url.host or url
+    
+    @staticmethod
+    def _validar_destino(url: str):
+        """Esquema http(s) y, si el host es una IP literal (que no pasa por el DNS), que sea pública"""
+        partes = urlsplit(url)
+        if partes.scheme.lower() not in ('http', 'https') or not partes.hostname:
+            raise ErrorDescarga("La URL debe empezar por http:// o https://")
+        if URL_PERMITIR_INTERNAS:
+            return
+        try:
+            ipaddress.ip_address(partes.hostname.split('%', 1)[0])
+        except ValueError:
+            return  # Nombre de host: lo comprueba ResolvedorPublico al conectar
+        if not direccion_publica(partes.hostname):
+            raise ErrorDescarga("No se permiten URL de direcciones internas")
+    
+    @asynccontextmanager
+    async def _abrir(self, url: str, cabeceras: dict):
+        """GET que sigue las redirecciones a mano, validando el destino de cada salto"""
+        for _ in range(URL_MAX_REDIRECCIONES + 1):
+            self._validar_destino(url)
+            async with self._get_session().get(url, headers=cabeceras, allow_redirects=False) as response:
+                if response.status in (301, 302, 303, 307, 308) and response.headers.get('Location'):
+                    url = urljoin(str(response.url), response.headers['Location'])
+                    continue
+                yield response
+                return
+        raise ErrorDescarga("La URL redirige demasiadas veces")
+    
+    def _podar(self):
+        """Borra los documentos menos usados hasta volver al tamaño máximo de la caché
+        (salvo los usados en los últimos URL_CACHE_GRACIA segundos, que pueden estar leyéndose)"""
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.endswith('.bin'):
+                ruta = os.path.join(self.directorio, nombre)
+                try:
+                    estado = os.stat(ruta)
+                except OSError:
+                    continue
+                entradas.append((estado.st_mtime, estado.st_size, ruta))
+        total = sum(tamano for _, tamano, _ in entradas)
+        limite_uso = time.time() - URL_CACHE_GRACIA
+        for mtime, tamano, ruta in sorted(entradas):
+            if total <= self.cache_max_bytes or mtime > limite_uso:
+                break
+            for eliminar in (ruta, ruta[:-4] + '.json'):
+                try:
+                    os.remove(eliminar)
+                except OSError:
+                    pass
+            total -= tamano
+    
+    async def descargar(self, url: str) -> DocumentoDescargado:
+        """Documento de la caché si sigue vigente (o el servidor responde 304); si no, lo descarga"""
+        self._validar_destino(url)
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta_datos, ruta_meta = self._rutas(url)
+        meta = await asyncio.to_thread(self._leer_meta, ruta_meta, ruta_datos)
+        
+        if meta and meta.get('expira', 0) > time.time():
+            self.aciertos += 1
+            os.utime(ruta_datos)
+            return DocumentoDescargado(url, ruta_datos, meta, desde_cache=True)
+        
+        cabeceras = {'Accept': 'application/pdf, text/html;q=0.9, text/plain;q=0.8, */*;q=0.5'}
+        if meta and meta.get('etag'):
+            cabeceras['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            cabeceras['If-Modified-Since'] = meta['last_modified']
+        
+        try:
+            async with self._abrir(url, cabeceras) as response:
+                if response.status == 304 and meta:
+                    self.revalidadas += 1
+                    max_age = self._max_age(response.headers.get('Cache-Control', ''))
+                    meta['expira'] = time.time() + max_age if max_age else 0
+                    await asyncio.to_thread(self._escribir_meta, ruta_meta, meta)
+                    os.utime(ruta_datos)
+                    return DocumentoDescargado(url, ruta_datos, meta, desde_cache=True)
+                if response.status != 200:
+                    raise ErrorDescarga(f"No se pudo descargar el documento (HTTP {response.status})")
+                if response.content_length and response.content_length > self.max_bytes:
+                    raise ErrorDescarga(f"El documento supera el máximo de {self.max_bytes // (1024 * 1024)} MB")
+                
+                content_type = response.content_type or ''
+                descriptor, temporal = tempfile.mkstemp(prefix='.descarga-', dir=self.directorio)
+                try:
+                    tamano = 0
+                    tipo = None
+                    with os.fdopen(descriptor, 'wb') as archivo:
+                        async for bloque in response.content.iter_chunked(URL_TAMANO_BLOQUE):
+                            if tamano == 0:
+                                tipo = detectar_tipo_documento(bloque, content_type)
+                                if tipo is None:
+                                    raise ErrorDescarga("Tipo de documento no soportado (solo PDF, HTML o texto)")
+                            tamano += len(bloque)
+                            # Se corta en cuanto se pasa del límite, aunque el servidor no enviara Content-Length
+                            if tamano > self.max_bytes:
+                                raise ErrorDescarga(f"El documento supera el máximo de {self.max_bytes // (1024 * 1024)} MB")
+                            archivo.write(bloque)
+                    if tamano == 0:
+                        raise ErrorDescarga("El documento está vacío")
+                    os.replace(temporal, ruta_datos)
+                except BaseException:
+                    try:
+                        os.remove(temporal)
+                    except OSError:
+                        pass
+                    raise
+                
+                max_age = self._max_age(response.headers.get('Cache-Control', ''))
+                meta = {
+                    'url': url,
+                    'nombre': self._nombre(url, response),
+                    'tipo': tipo,
+                    'charset': response.charset,
+                    'tamano': tamano,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'expira': time.time() + max_age if max_age else 0
+                }
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Error descargando {url}: {e!r}")
+            if isinstance(getattr(e, 'os_error', None), DireccionNoPermitida):
+                raise ErrorDescarga("No se permiten URL de direcciones internas") from e
+            raise ErrorDescarga("Error al acceder a la URL proporcionada") from e
+        
+        self.descargas += 1
+        await asyncio.to_thread(self._escribir_meta, ruta_meta, meta)
+        await asyncio.to_thread(self._podar)
+        return DocumentoDescargado(url, ruta_datos, meta, desde_cache=False)
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+descargador_documentos = DescargadorDocumentos()
+
+AREAS_JURIDICAS = ['civil', 'penal', 'laboral', 'mercantil', 'administrativo', 'constitucional', 'familiar']
+BUSCADOR_AREAS_JURIDICAS = BuscadorTerminos(AREAS_JURIDICAS)
+
 def analizar_texto_juridico(texto: str) -> dict:
     """Analiza texto jurídico para identificar conceptos clave"""
     resultados = {
@@ -387,29 +1802,681 @@ def analizar_texto_juridico(texto: str) -> dict:
     }
     
     # Detectar áreas jurídicas
-    areas = ['civil', 'penal', 'laboral', 'mercantil', 'administrativo', 'constitucional', 'familiar']
-    for area in areas:
-        if area in texto.lower():
-            resultados['areas_juridicas'].append(area)
+    resultados['areas_juridicas'] = BUSCADOR_AREAS_JURIDICAS.encontrados(texto)
     
-    # Detectar términos jurídicos clave
-    for termino in LEGAL_TERMS:
-        if termino in texto.lower():
-            resultados['terminos_clave'].append(termino)
+    # Detectar términos jurídicos clave (una sola pasada sobre el texto)
+    resultados['terminos_clave'] = BUSCADOR_TERMINOS_LEGALES.encontrados(texto)
     
     # Detectar plazos (patrones como "días", "meses", "años")
-    plazos = re.findall(r'(\d+)\s*(día|días|mes|meses|año|años)', texto, re.IGNORECASE)
-    resultados['plazos'] = plazos
+    resultados['plazos'] = REGISTRO_REGEX.findall('plazos', texto)
     
     # Detectar referencias legales
-    referencias = re.findall(r'(ley|artículo|art|Ley|Artículo|Art)\s*(\d+[/\-]\d+|\d+)', texto)
-    resultados['referencias_legales'] = referencias
+    resultados['referencias_legales'] = REGISTRO_REGEX.findall('referencias', texto)
     
     return resultados
 
+# ANÁLISIS VECTORIZADO DE CORPUS
+SEPARADOR_CORPUS = '\x00'  # Ningún patrón lo cruza: no es \w ni \s
+
+class MatrizTerminos:
+    """Matriz documento-término de conteos en formato CSR (datos, columnas, punteros)"""
+    def __init__(self, datos: np.ndarray, columnas: np.ndarray, punteros: np.ndarray, vocabulario: list):
+        self.datos = datos
+        self.columnas = columnas
+        self.punteros = punteros
+        self.vocabulario = vocabulario
+    
+    @classmethod
+    def desde_apariciones(cls, filas: np.ndarray, columnas: np.ndarray, n_documentos: int, vocabulario: list):
+        """Agrupa pares (documento, término) repetidos en conteos"""
+        claves, conteos = np.unique(filas * len(vocabulario) + columnas, return_counts=True)
+        filas_unicas = claves // len(vocabulario)
+        punteros = np.zeros(n_documentos + 1, dtype=np.int64)
+        np.cumsum(np.bincount(filas_unicas, minlength=n_documentos), out=punteros[1:])
+        return cls(conteos, claves % len(vocabulario), punteros, vocabulario)
+    
+    def fila(self, indice: int) -> dict:
+        inicio, fin = self.punteros[indice], self.punteros[indice + 1]
+        return {self.vocabulario[c]: int(n) for c, n in zip(self.columnas[inicio:fin], self.datos[inicio:fin])}
+    
+    def densa(self) -> np.ndarray:
+        matriz = np.zeros((len(self.punteros) - 1, len(self.vocabulario)), dtype=np.int64)
+        filas = np.repeat(np.arange(len(self.punteros) - 1), np.diff(self.punteros))
+        matriz[filas, self.columnas] = self.datos
+        return matriz
+
+def _unir_corpus(textos: list) -> tuple:
+    """Concatena los textos con un separador y devuelve también el desplazamiento de cada uno"""
+    textos = [(texto or '').replace(SEPARADOR_CORPUS, ' ') for texto in textos]
+    longitudes = np.fromiter((len(texto) + 1 for texto in textos), dtype=np.int64, count=len(textos))
+    inicios = np.cumsum(longitudes) - longitudes
+    return SEPARADOR_CORPUS.join(textos), inicios
+
+def _matriz_buscador(buscador: BuscadorTerminos, corpus: str, inicios: np.ndarray) -> MatrizTerminos:
+    """Conteos por documento de un corpus ya plegado (ver _unir_corpus)"""
+    apariciones = buscador.buscar(corpus, plegado=True)
+    posiciones = np.fromiter((posicion for posicion, _ in apariciones), dtype=np.int64, count=len(apariciones))
+    columnas = np.fromiter((buscador.orden[termino] for _, termino in apariciones), dtype=np.int64, count=len(apariciones))
+    filas = np.searchsorted(inicios, posiciones, side='right') - 1
+    return MatrizTerminos.desde_apariciones(filas, columnas, len(inicios), buscador.terminos)
+
+def _agrupar_coincidencias(nombre: str, corpus: str, inicios: np.ndarray) -> list:
+    """findall del registro sobre todo el corpus, repartido por documento"""
+    coincidencias = REGISTRO_REGEX.finditer(nombre, corpus)
+    grupos = [[] for _ in inicios]
+    if coincidencias:
+        posiciones = np.fromiter((m.start() for m in coincidencias), dtype=np.int64, count=len(coincidencias))
+        for fila, m in zip(np.searchsorted(inicios, posiciones, side='right') - 1, coincidencias):
+            grupos[fila].append(m.groups())
+    return grupos
+
+def _area_principal(areas: MatrizTerminos) -> list:
+    """Área más mencionada de cada documento (None si no menciona ninguna)"""
+    conteo = areas.densa()
+    principal = np.where(conteo.max(axis=1) > 0, conteo.argmax(axis=1), -1)
+    return [areas.vocabulario[i] if i >= 0 else None for i in principal]
+
+def areas_principales(textos: list) -> list:
+    """Solo el área principal de cada texto; no busca términos, plazos ni referencias"""
+    corpus, inicios = _unir_corpus([normalizar(texto or '') for texto in textos])
+    return _area_principal(_matriz_buscador(BUSCADOR_AREAS_JURIDICAS, corpus, inicios))
+
+def analizar_corpus_juridico(textos: list) -> dict:
+    """Versión por lotes de analizar_texto_juridico para N documentos a la vez.
+    
+    Recorre el corpus concatenado una sola vez por buscador y por patrón, y devuelve
+    las matrices documento-término de áreas y términos junto con los plazos y las
+    referencias de cada documento.
+    """
+    corpus, inicios = _unir_corpus(textos)
+    # Los términos se buscan sobre el texto plegado; plazos y referencias, sobre el original
+    plegado, inicios_plegado = _unir_corpus([normalizar(texto or '') for texto in textos])
+    areas = _matriz_buscador(BUSCADOR_AREAS_JURIDICAS, plegado, inicios_plegado)
+    return {
+        'areas': areas,
+        'terminos': _matriz_buscador(BUSCADOR_TERMINOS_LEGALES, plegado, inicios_plegado),
+        'area_principal': _area_principal(areas),
+        'plazos': _agrupar_coincidencias('plazos', corpus, inicios),
+        'referencias_legales': _agrupar_coincidencias('referencias', corpus, inicios)
+    }
+
+def reetiquetar_documentos(ruta_db: str = 'bufete_legal.db', lote: int = 5000) -> int:
+    """Recalcula el área jurídica principal de todos los documentos; devuelve cuántos se etiquetaron"""
+    conn = sqlite3.connect(ruta_db)
+    c = conn.cursor()
+    etiquetados = 0
+    ultimo_id = 0
+    while True:
+        c.execute("SELECT id, contenido FROM documentos WHERE id > ? ORDER BY id LIMIT ?", (ultimo_id, lote))
+        filas = c.fetchall()
+        if not filas:
+            break
+        ultimo_id = filas[-1][0]
+        areas = areas_principales([contenido for _, contenido in filas])
+        c.executemany("UPDATE documentos SET area_juridica = ? WHERE id = ?",
+                      [(area, id_documento) for (id_documento, _), area in zip(filas, areas)])
+        etiquetados += sum(area is not None for area in areas)
+    conn.commit()
+    conn.close()
+    return etiquetados
+
+# CONSTRUCCIÓN DE PROMPTS CON PRESUPUESTO DE TOKENS
+CARACTERES_POR_TOKEN = 3.5  # Aproximación para texto en español
+PRESUPUESTO_DOCUMENTO_TOKENS = int(os.getenv('PRESUPUESTO_DOCUMENTO_TOKENS', '2000'))
+RESERVA_SALIDA_TOKENS = 1024
+SEGMENTO_MAX_CARACTERES = 800
+PATRON_INICIO_CLAUSULA = re.compile(
+    r'^\s*(cl[áa]usula|art[íi]culo|art\.|cap[íi]tulo|secci[óo]n|t[íi]tulo|'
+    r'primer[oa]|segund[oa]|tercer[oa]|cuart[oa]|quint[oa]|sext[oa]|s[ée]ptim[oa]|octav[oa]|noven[oa]|d[ée]cim[oa]|'
+    r'\d{1,3}[.)]|[ivxlc]{1,6}[.)])(\s|$)',
+    re.IGNORECASE
+)
+PATRON_FIN_FRASE = re.compile(r'(?<=[.;:])\s+')
+
+PLANTILLA_ANALISIS_DOCUMENTO = """
+        Como abogado junior, analiza este documento legal y proporciona un dictamen profesional:
+        
+        DOCUMENTO: {nombre}
+        CONTENIDO: {contenido}
+        
+        Proporciona un análisis estructurado con:
+        1. 📋 Tipo de documento identificado
+        2. ⚖️ Área jurídica principal y secundarias
+        3. 🔍 Puntos clave relevantes
+        4. ⚠️ Posibles problemas o irregularidades
+        5. 💡 Recomendaciones y próximos pasos
+        
+        Mantén el tono de un abogado junior: profesional pero reconociendo limitaciones.
+        """
+
+PLANTILLA_ANALISIS_FRAGMENTO = """
+        Como abogado junior, analiza el fragmento {indice} de {total} del documento legal "{nombre}".
+        Es solo una parte: no concluyas sobre el documento completo.
+        
+        FRAGMENTO:
+        {contenido}
+        
+        Enumera de forma breve, en viñetas:
+        - Partes, obligaciones y derechos que aparecen
+        - Plazos, importes y referencias legales
+        - Posibles problemas o irregularidades
+        """
+
+PLANTILLA_SINTESIS_DOCUMENTO = """
+        Como abogado junior, integra estos análisis parciales del documento legal "{nombre}"
+        (cada uno cubre un fragmento consecutivo; puede haber repeticiones por el solapamiento):
+        
+        {analisis_parciales}
+        
+        Redacta un único dictamen profesional, sin repetir información, con:
+        1. 📋 Tipo de documento identificado
+        2. ⚖️ Área jurídica principal y secundarias
+        3. 🔍 Puntos clave relevantes
+        4. ⚠️ Posibles problemas o irregularidades
+        5. 💡 Recomendaciones y próximos pasos
+        
+        Mantén el tono de un abogado junior: profesional pero reconociendo limitaciones.
+        """
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida (sin tokenizador) del número de tokens de un texto"""
+    return math.ceil(len(texto) / CARACTERES_POR_TOKEN)
+
+def presupuesto_documento(instrucciones: str) -> int:
+    """Tokens disponibles para el documento en el modelo con menos contexto"""
+    libres = min(
+        config['contexto'] - (config['max_tokens'] or RESERVA_SALIDA_TOKENS)
+        for config in PROVEEDORES_IA.values()
+    )
+    libres -= estimar_tokens(SYSTEM_PROMPT_ABOGADO_NOVATO) + estimar_tokens(instrucciones)
+    return max(0, min(PRESUPUESTO_DOCUMENTO_TOKENS, libres))
+
+def segmentar_texto(texto: str, max_caracteres: int = SEGMENTO_MAX_CARACTERES) -> list:
+    """Divide el texto en segmentos alineados con cláusulas/artículos y de tamaño acotado"""
+    piezas = []
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if not linea:
+            continue
+        if len(linea) <= max_caracteres:
+            piezas.append(linea)
+            continue
+        # Líneas muy largas (PDF sin saltos): cortar por frases y, si hace falta, a ciegas
+        for frase in PATRON_FIN_FRASE.split(linea):
+            for inicio in range(0, len(frase), max_caracteres):
+                piezas.append(frase[inicio:inicio + max_caracteres])
+    
+    segmentos = []
+    actual = []
+    longitud = 0
+    for pieza in piezas:
+        if actual and (PATRON_INICIO_CLAUSULA.match(pieza) or longitud + len(pieza) > max_caracteres):
+            segmentos.append(' '.join(actual))
+            actual = []
+            longitud = 0
+        actual.append(pieza)
+        longitud += len(pieza) + 1
+    if actual:
+        segmentos.append(' '.join(actual))
+    return segmentos
+
+def puntuar_segmento(segmento: str) -> int:
+    """Señales jurídicas de un segmento: términos, áreas, plazos y referencias legales"""
+    analisis = analizar_texto_juridico(segmento)
+    return (len(analisis['terminos_clave']) + len(analisis['areas_juridicas'])
+            + 2 * len(analisis['plazos']) + 2 * len(analisis['referencias_legales']))
+
+def seleccionar_fragmentos_relevantes(texto: str, presupuesto_tokens: int) -> str:
+    """Elige los segmentos con mayor densidad jurídica hasta agotar el presupuesto de tokens"""
+    if estimar_tokens(texto) <= presupuesto_tokens:
+        return texto
+    
+    segmentos = segmentar_texto(texto)
+    candidatos = []
+    for indice, segmento in enumerate(segmentos):
+        tokens = estimar_tokens(segmento)
+        candidatos.append((puntuar_segmento(segmento) / tokens, indice, tokens))
+    
+    elegidos = []
+    usados = 0
+    for densidad, indice, tokens in sorted(candidatos, key=lambda c: (-c[0], c[1])):
+        # Los segmentos sin señales jurídicas (portadas, relleno) no merecen tokens
+        if densidad == 0 or usados + tokens > presupuesto_tokens:
+            continue
+        elegidos.append(indice)
+        usados += tokens
+    
+    if not elegidos:
+        return texto[:int(presupuesto_tokens * CARACTERES_POR_TOKEN)]
+    
+    # Reconstruir en el orden original, marcando los saltos de texto omitido
+    partes = []
+    anterior = None
+    for indice in sorted(elegidos):
+        if anterior is not None and indice != anterior + 1:
+            partes.append("[...]")
+        partes.append(segmentos[indice])
+        anterior = indice
+    return '\n'.join(partes)
+
+# Los dictámenes en caché solo valen mientras no cambien la plantilla ni el prompt del sistema
+VERSION_ANALISIS = hashlib.sha256(
+    (PLANTILLA_ANALISIS_DOCUMENTO + PLANTILLA_ANALISIS_FRAGMENTO + PLANTILLA_SINTESIS_DOCUMENTO
+     + VERSION_SYSTEM_PROMPT).encode('utf-8')).hexdigest()[:16]
+
+def fragmentar_documento(texto: str, max_tokens: int, solape: int = 1) -> list:
+    """Fragmentos de hasta max_tokens alineados con cláusulas; cada uno repite las `solape`
+    últimas cláusulas del anterior para no partir el contexto de una obligación"""
+    segmentos = segmentar_texto(texto)
+    fragmentos = []
+    actual = []
+    tokens_actual = 0
+    for segmento in segmentos:
+        tokens = estimar_tokens(segmento)
+        if actual and tokens_actual + tokens > max_tokens:
+            fragmentos.append('\n'.join(actual))
+            arrastre = actual[-solape:] if solape else []
+            tokens_arrastre = sum(estimar_tokens(s) for s in arrastre)
+            # El solapamiento nunca ocupa más de la mitad del fragmento siguiente
+            if tokens_arrastre > max_tokens // 2 or tokens_arrastre + tokens > max_tokens:
+                arrastre = []
+                tokens_arrastre = 0
+            actual = list(arrastre)
+            tokens_actual = tokens_arrastre
+        actual.append(segmento)
+        tokens_actual += tokens
+    if actual:
+        fragmentos.append('\n'.join(actual))
+    return fragmentos
+
+def construir_prompt_documento(nombre_documento: str, texto_documento: str) -> str:
+    """Prompt de análisis con el contenido más relevante que cabe en el presupuesto del modelo"""
+    instrucciones = PLANTILLA_ANALISIS_DOCUMENTO.format(nombre=nombre_documento, contenido="")
+    contenido = seleccionar_fragmentos_relevantes(texto_documento, presupuesto_documento(instrucciones))
+    return PLANTILLA_ANALISIS_DOCUMENTO.format(nombre=nombre_documento, contenido=contenido)
+
 # Inicializar asistente de IA para derecho
 ai_assistant = AIAssistant()
 
+# PLANIFICADOR DE CONSULTAS A LA IA (prioridad por nivel + límites por usuario y servidor)
+NIVELES_PRIORIDAD = {'vip': 0, 'freemium': 1}
+NIVEL_POR_DEFECTO = os.getenv('NIVEL_POR_DEFECTO', 'freemium')
+ROLES_VIP = {rol.strip().lower() for rol in os.getenv('ROLES_VIP', 'vip,premium').split(',') if rol.strip()}
+USUARIOS_VIP = {int(uid) for uid in os.getenv('USUARIOS_VIP', '').split(',') if uid.strip().isdigit()}
+PLANIFICADOR_CONCURRENCIA = int(os.getenv('PLANIFICADOR_CONCURRENCIA', '4'))
+PLANIFICADOR_RESERVA_VIP = int(os.getenv('PLANIFICADOR_RESERVA_VIP', '1'))
+PLANIFICADOR_REFRESCO = 5.0
+# (capacidad, tokens recargados por segundo)
+LIMITES_USUARIO = {
+    'vip': (10, 1 / 6),
+    'freemium': (3, 1 / 30)
+}
+LIMITE_SERVIDOR = (30, 0.5)
+
+class CuboTokens:
+    """Token bucket: admite ráfagas hasta la capacidad y se recarga a ritmo constante"""
+    def __init__(self, capacidad: float, recarga: float):
+        self.capacidad = capacidad
+        self.recarga = recarga
+        self.tokens = capacidad
+        self.ultimo = time.monotonic()
+    
+    def _recargar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.recarga)
+        self.ultimo = ahora
+    
+    def espera(self, cantidad: float = 1) -> float:
+        """Segundos hasta que haya `cantidad` tokens disponibles (0 si ya los hay)"""
+        self._recargar()
+        if self.tokens >= cantidad:
+            return 0.0
+        return (cantidad - self.tokens) / self.recarga
+    
+    def consumir(self, cantidad: float = 1):
+        self._recargar()
+        self.tokens -= cantidad
+
+class PlanificadorIA:
+    """Cola con prioridad por nivel de usuario y concurrencia global acotada"""
+    def __init__(self, concurrencia: int = PLANIFICADOR_CONCURRENCIA, reserva_vip: int = PLANIFICADOR_RESERVA_VIP):
+        self.concurrencia = concurrencia
+        self.reserva_vip = min(reserva_vip, concurrencia - 1)
+        self.activas = 0
+        self._cola = []
+        self._secuencia = itertools.count()
+        self.cubos_usuario = {}
+        self.cubos_servidor = {}
+    
+    def nivel_de(self, autor) -> str:
+        """Determina el nivel del usuario por su ID o sus roles de Discord"""
+        if autor.id in USUARIOS_VIP:
+            return 'vip'
+        if any(rol.name.lower() in ROLES_VIP for rol in getattr(autor, 'roles', [])):
+            return 'vip'
+        return NIVEL_POR_DEFECTO if NIVEL_POR_DEFECTO in NIVELES_PRIORIDAD else 'freemium'
+    
+    def comprobar_limites(self, usuario_id: int, servidor_id: Optional[int], nivel: str, coste: int = 1) -> float:
+        """Consume `coste` tokens del usuario y del servidor; devuelve los segundos de espera si no hay"""
+        cubo_usuario = self.cubos_usuario.get(usuario_id)
+        if cubo_usuario is None or cubo_usuario.capacidad != LIMITES_USUARIO[nivel][0]:
+            cubo_usuario = self.cubos_usuario[usuario_id] = CuboTokens(*LIMITES_USUARIO[nivel])
+        cubos = [cubo_usuario]
+        if servidor_id is not None:
+            if servidor_id not in self.cubos_servidor:
+                self.cubos_servidor[servidor_id] = CuboTokens(*LIMITE_SERVIDOR)
+            cubos.append(self.cubos_servidor[servidor_id])
+        
+        espera = max(cubo.espera(coste) for cubo in cubos)
+        if espera > 0:
+            return espera
+        for cubo in cubos:
+            cubo.consumir(coste)
+        return 0.0
+    
+    def _limite(self, nivel: str) -> int:
+        # Los usuarios freemium no pueden ocupar los huecos reservados para VIP
+        if nivel == 'vip':
+            return self.concurrencia
+        return self.concurrencia - self.reserva_vip
+    
+    def _despachar(self):
+        """Asigna los huecos libres a las entradas en espera por orden de prioridad"""
+        for entrada in sorted(self._cola, key=lambda e: e[:2]):
+            futuro = entrada[3]
+            if futuro.done():
+                self._cola.remove(entrada)
+                continue
+            if self.activas >= self.concurrencia:
+                break
+            if self.activas >= self._limite(entrada[2]):
+                continue
+            self._cola.remove(entrada)
+            self.activas += 1
+            futuro.set_result(None)
+    
+    def posicion(self, entrada) -> int:
+        return 1 + sum(1 for otra in self._cola if otra[:2] < entrada[:2] and not otra[3].done())
+    
+    @asynccontextmanager
+    async def turno(self, nivel: str, avisar_posicion=None):
+        """Espera un hueco de ejecución; avisar_posicion(n) recibe la posición en cola si hay espera"""
+        futuro = asyncio.get_running_loop().create_future()
+        entrada = (NIVELES_PRIORIDAD[nivel], next(self._secuencia), nivel, futuro)
+        self._cola.append(entrada)
+        self._despachar()
+        try:
+            ultima_posicion = None
+            while not futuro.done():
+                posicion = self.posicion(entrada)
+                if avisar_posicion is not None and posicion != ultima_posicion:
+                    ultima_posicion = posicion
+                    try:
+                        await avisar_posicion(posicion)
+                    except Exception as e:
+                        logger.warning(f"No se pudo avisar la posición en cola: {e}")
+                    continue
+                await asyncio.wait({futuro}, timeout=PLANIFICADOR_REFRESCO)
+        except asyncio.CancelledError:
+            if futuro.done():
+                # Ya teníamos hueco asignado: devolverlo
+                self.activas -= 1
+                self._despachar()
+            else:
+                futuro.cancel()
+                self._cola.remove(entrada)
+            raise
+        
+        try:
+            yield
+        finally:
+            self.activas -= 1
+            self._despachar()
+
+planificador_ia = PlanificadorIA()
+
+async def reservar_consulta_ia(ctx, coste: int = 1) -> Optional[str]:
+    """Aplica los límites de consultas del usuario (coste = llamadas a la IA que hará la orden);
+    devuelve su nivel o None si debe esperar"""
+    nivel = planificador_ia.nivel_de(ctx.author)
+    servidor_id = ctx.guild.id if ctx.guild else None
+    espera = planificador_ia.comprobar_limites(ctx.author.id, servidor_id, nivel, coste)
+    if espera > 0:
+        if coste > 1:
+            await ctx.send(f"⏳ Analizar este documento cuesta {coste} consultas de tu plan ({nivel}). Intenta de nuevo en {math.ceil(espera)} segundos.")
+        else:
+            await ctx.send(f"⏳ Has alcanzado el límite de consultas de tu plan ({nivel}). Intenta de nuevo en {math.ceil(espera)} segundos.")
+        return None
+    return nivel
+
+def aviso_cola(mensaje_discord):
+    """Callback que muestra al usuario su posición en la cola editando el mensaje de espera"""
+    async def avisar(posicion: int):
+        await mensaje_discord.edit(content=f"⏳ Tu consulta está en cola (posición {posicion}). Los miembros VIP tienen prioridad.")
+    return avisar
+
+# ANÁLISIS DE DOCUMENTOS LARGOS POR FRAGMENTOS (MAP-REDUCE)
+MAPREDUCE_CONCURRENCIA = int(os.getenv('MAPREDUCE_CONCURRENCIA', '4'))
+MAPREDUCE_MAX_FRAGMENTOS = int(os.getenv('MAPREDUCE_MAX_FRAGMENTOS', '24'))
+MAPREDUCE_SOLAPE = int(os.getenv('MAPREDUCE_SOLAPE', '1'))
+PROGRESO_INTERVALO = 1.5  # Segundos mínimos entre ediciones del mensaje de progreso
+
+# Análisis en curso por usuario (un conjunto de tareas: puede lanzar varios a la vez),
+# para poder cancelarlos todos con !cancelar
+analisis_en_curso = {}
+
+def elegir_fragmentos(fragmentos: list, maximo: int) -> list:
+    """Si hay demasiados fragmentos, conserva los de mayor densidad jurídica en su orden original"""
+    if len(fragmentos) <= maximo:
+        return fragmentos
+    densidades = [puntuar_segmento(f) / max(1, estimar_tokens(f)) for f in fragmentos]
+    elegidos = sorted(sorted(range(len(fragmentos)), key=lambda i: -densidades[i])[:maximo])
+    return [fragmentos[i] for i in elegidos]
+
+def aviso_progreso(mensaje_discord):
+    """Callback que edita el mensaje de espera con el avance, sin superar una edición cada PROGRESO_INTERVALO"""
+    ultima = [0.0]
+    async def avisar(texto: str, forzar: bool = False):
+        ahora = time.monotonic()
+        if not forzar and ahora - ultima[0] < PROGRESO_INTERVALO:
+            return
+        ultima[0] = ahora
+        try:
+            await mensaje_discord.edit(content=texto)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el progreso: {e}")
+    return avisar
+
+def max_fragmentos_nivel(nivel: str) -> int:
+    """Cada fragmento es una consulta al cupo del usuario (y la síntesis, otra más): un documento
+    no puede costar más que la capacidad del cubo de su plan"""
+    return max(1, min(MAPREDUCE_MAX_FRAGMENTOS, int(LIMITES_USUARIO[nivel][0]) - 1))
+
+def max_caracteres_extraccion(nivel: str) -> int:
+    """Caracteres que merece la pena extraer para el plan: los que cubren sus fragmentos, con
+    margen para elegir los más relevantes (el resto se descartaría sin analizar)"""
+    cubiertos = max_fragmentos_nivel(nivel) * PRESUPUESTO_DOCUMENTO_TOKENS * CARACTERES_POR_TOKEN
+    return min(MAX_CARACTERES_EXTRACCION, int(cubiertos * MARGEN_EXTRACCION))
+
+def fragmentos_documento(nombre_documento: str, texto_documento: str, maximo: int) -> tuple:
+    """(fragmentos elegidos, fragmentos totales) para el map-reduce; ([], 0) si el documento
+    cabe en una sola consulta"""
+    instrucciones = PLANTILLA_ANALISIS_DOCUMENTO.format(nombre=nombre_documento, contenido="")
+    if estimar_tokens(texto_documento) <= presupuesto_documento(instrucciones):
+        return [], 0
+    instrucciones_fragmento = PLANTILLA_ANALISIS_FRAGMENTO.format(nombre=nombre_documento, indice=0, total=0,
+                                                                  contenido="")
+    fragmentos = fragmentar_documento(texto_documento, presupuesto_documento(instrucciones_fragmento),
+                                      MAPREDUCE_SOLAPE)
+    return elegir_fragmentos(fragmentos, maximo), len(fragmentos)
+
+def coste_analisis(fragmentos: list) -> int:
+    """Consultas a la IA de un análisis: una por fragmento más la síntesis, o una sola"""
+    return len(fragmentos) + 1 if fragmentos else 1
+
+async def analizar_documento_ia(nombre_documento: str, texto_documento: str, fragmentos: list,
+                                omitidos: int, nivel: str, processing_msg) -> str:
+    """Dictamen del documento: una sola consulta si no hay fragmentos; si no, map-reduce
+    (fragmentos analizados en paralelo y una síntesis final)"""
+    if not fragmentos:
+        async with planificador_ia.turno(nivel, aviso_cola(processing_msg)):
+            return await ai_assistant.get_response(construir_prompt_documento(nombre_documento, texto_documento))
+    
+    total = len(fragmentos)
+    avisar = aviso_progreso(processing_msg)
+    if omitidos:
+        await avisar(f"📄 **Documento extenso:** por el límite de tu plan ({nivel}) se analizan los {total} "
+                     f"fragmentos más relevantes de {total + omitidos}... (0/{total}) ⚖️", forzar=True)
+    else:
+        await avisar(f"📄 **Documento extenso:** analizando {total} fragmentos... (0/{total}) ⚖️", forzar=True)
+    
+    limite = asyncio.Semaphore(MAPREDUCE_CONCURRENCIA)
+    completados = 0
+    
+    async def analizar_fragmento(indice: int, fragmento: str) -> str:
+        nonlocal completados
+        prompt = PLANTILLA_ANALISIS_FRAGMENTO.format(nombre=nombre_documento, indice=indice + 1, total=total,
+                                                     contenido=fragmento)
+        async with limite:
+            async with planificador_ia.turno(nivel):
+                respuesta = await ai_assistant.get_response(prompt)
+        completados += 1
+        await avisar(f"📄 **Documento extenso:** analizando {total} fragmentos... ({completados}/{total}) ⚖️")
+        return respuesta
+    
+    tareas = [asyncio.create_task(analizar_fragmento(i, f)) for i, f in enumerate(fragmentos)]
+    try:
+        parciales = await asyncio.gather(*tareas)
+    finally:
+        # Si se cancela el análisis (o falla un fragmento), no dejar consultas huérfanas en la cola
+        for tarea in tareas:
+            tarea.cancel()
+    
+    validos = [(i, p) for i, p in enumerate(parciales)
+               if p and p not in (MENSAJE_IA_NO_DISPONIBLE, MENSAJE_NO_JURIDICO)]
+    if not validos:
+        return MENSAJE_IA_NO_DISPONIBLE
+    
+    # Reduce: cada análisis parcial recibe la parte proporcional del presupuesto de la síntesis
+    instrucciones_sintesis = PLANTILLA_SINTESIS_DOCUMENTO.format(nombre=nombre_documento, analisis_parciales="")
+    por_parcial = int(presupuesto_documento(instrucciones_sintesis) / len(validos) * CARACTERES_POR_TOKEN)
+    bloques = [f"[Fragmento {i + 1}/{total}]\n{p[:por_parcial]}" for i, p in validos]
+    await avisar(f"🧩 **Integrando {len(validos)} análisis parciales en el dictamen...** ⚖️", forzar=True)
+    async with planificador_ia.turno(nivel, aviso_cola(processing_msg)):
+        sintesis = await ai_assistant.get_response(
+            PLANTILLA_SINTESIS_DOCUMENTO.format(nombre=nombre_documento, analisis_parciales='\n\n'.join(bloques)))
+    if sintesis in (MENSAJE_IA_NO_DISPONIBLE, MENSAJE_NO_JURIDICO):
+        # Sin síntesis, los análisis parciales siguen siendo útiles
+        return '\n\n'.join(f"**Fragmento {i + 1}/{total}**\n{p}" for i, p in validos)
+    return sintesis
+
+# RECUPERACIÓN DE CONTEXTO PARA EL ASISTENTE (RAG)
+# Antes de consultar a la IA se buscan los pasajes más relevantes del syllabus, de la base
+# de conocimiento y del corpus indexado; el prompt los incluye con un identificador citable.
+RAG_ASISTENTE = os.getenv('RAG_ASISTENTE', '1') == '1'
+RAG_PRESUPUESTO_TOKENS = int(os.getenv('RAG_PRESUPUESTO_TOKENS', '700'))
+RAG_PASAJES_POR_FUENTE = int(os.getenv('RAG_PASAJES_POR_FUENTE', '3'))
+RAG_CARACTERES_PASAJE = 600
+RAG_RELEVANCIA_RELATIVA = float(os.getenv('RAG_RELEVANCIA_RELATIVA', '0.5'))  # Frente al mejor de su fuente
+RAG_CONSTANTE_FUSION = 60  # Reciprocal rank fusion: las puntuaciones de cada fuente no son comparables
+
+PLANTILLA_CONSULTA_CON_CONTEXTO = """Responde a la consulta apoyándote en el CONTEXTO cuando sea pertinente.
+Cita entre corchetes el identificador de cada pasaje que uses (por ejemplo [S3] o [C12]).
+Si el contexto no cubre la consulta, dilo en una frase y responde con tu criterio.
+Sé conciso: ve directo a los puntos relevantes, sin introducciones genéricas.
+
+CONTEXTO:
+{contexto}
+
+CONSULTA: {consulta}"""
+
+class IndiceBM25Memoria:
+    """BM25 en memoria para colecciones pequeñas (la base de conocimiento)"""
+    def __init__(self, documentos: list, k1: float = 1.2, b: float = 0.75):
+        self.documentos = documentos  # [(identificador, texto)]
+        self.k1 = k1
+        self.b = b
+        self.frecuencias = [Counter(terminos_busqueda(texto)) for _, texto in documentos]
+        self.longitudes = [sum(conteo.values()) for conteo in self.frecuencias]
+        self.longitud_media = (sum(self.longitudes) / len(self.longitudes)) if documentos else 1.0
+        frecuencia_documental = Counter(termino for conteo in self.frecuencias for termino in conteo)
+        n = len(documentos)
+        self.idf = {termino: math.log(1 + (n - df + 0.5) / (df + 0.5)) for termino, df in frecuencia_documental.items()}
+    
+    def buscar(self, consulta: str, k: int = 3) -> list:
+        terminos = set(terminos_busqueda(consulta)) & self.idf.keys()
+        resultados = []
+        for (identificador, texto), conteo, longitud in zip(self.documentos, self.frecuencias, self.longitudes):
+            puntuacion = 0.0
+            for termino in terminos:
+                tf = conteo.get(termino, 0)
+                if tf:
+                    norma = self.k1 * (1 - self.b + self.b * longitud / self.longitud_media)
+                    puntuacion += self.idf[termino] * tf * (self.k1 + 1) / (tf + norma)
+            if puntuacion > 0:
+                resultados.append((puntuacion, identificador, texto))
+        resultados.sort(key=lambda r: -r[0])
+        return resultados[:k]
+
+INDICE_BASE_CONOCIMIENTO = IndiceBM25Memoria([
+    (f"B:{area}/{tema}", f"{area.replace('_', ' ')} {tema.replace('_', ' ')}\n{texto}")
+    for area, temas in BASE_CONOCIMIENTO.items()
+    for tema, texto in temas.items()
+])
+
+def _compactar(texto: str, max_caracteres: int = RAG_CARACTERES_PASAJE) -> str:
+    texto = ' '.join(texto.replace('**', '').split())
+    return texto if len(texto) <= max_caracteres else texto[:max_caracteres].rsplit(' ', 1)[0] + '…'
+
+async def recuperar_contexto(consulta: str, presupuesto_tokens: int = RAG_PRESUPUESTO_TOKENS) -> list:
+    """Pasajes relevantes de todas las fuentes, fusionados por rango y dentro del presupuesto:
+    [{'id', 'fuente', 'texto'}]"""
+    listas = []
+    if artefacto_syllabus is not None:
+        listas.append([{'id': f"S{indice}", 'fuente': f"Syllabus §{indice}", 'texto': texto, 'puntuacion': puntuacion}
+                       for indice, puntuacion, texto in artefacto_syllabus.buscar(consulta, RAG_PASAJES_POR_FUENTE)])
+    listas.append([{'id': identificador, 'fuente': "Base de conocimiento", 'texto': texto, 'puntuacion': puntuacion}
+                   for puntuacion, identificador, texto in INDICE_BASE_CONOCIMIENTO.buscar(consulta, RAG_PASAJES_POR_FUENTE)])
+    try:
+        fragmentos = await asyncio.to_thread(corpus_juridico.buscar, consulta, RAG_PASAJES_POR_FUENTE)
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo consultar el corpus para el contexto: {e}")
+        fragmentos = []
+    listas.append([{'id': f"C{f['id']}", 'fuente': f"{os.path.basename(f['ruta'])}, pág. {f['pagina']}",
+                    'texto': f['texto'], 'puntuacion': f['puntuacion']} for f in fragmentos])
+    
+    fusion = {}
+    for lista in listas:
+        if not lista:
+            continue
+        # Los pasajes muy por debajo del mejor de su fuente suelen coincidir solo en términos sueltos
+        corte = lista[0]['puntuacion'] * RAG_RELEVANCIA_RELATIVA
+        for rango, pasaje in enumerate(p for p in lista if p['puntuacion'] >= corte):
+            entrada = fusion.setdefault(pasaje['id'], [0.0, pasaje])
+            entrada[0] += 1 / (RAG_CONSTANTE_FUSION + rango + 1)
+    
+    elegidos = []
+    usados = 0
+    for _, pasaje in sorted(fusion.values(), key=lambda e: -e[0]):
+        texto = _compactar(pasaje['texto'])
+        tokens = estimar_tokens(texto) + 4
+        if usados + tokens > presupuesto_tokens:
+            continue
+        elegidos.append({'id': pasaje['id'], 'fuente': pasaje['fuente'], 'texto': texto})
+        usados += tokens
+    return elegidos
+
+async def construir_prompt_asistente(consulta: str) -> tuple:
+    """Prompt con el bloque de contexto recuperado y los pasajes usados (sin contexto, la consulta tal cual)"""
+    if not RAG_ASISTENTE:
+        return consulta, []
+    instrucciones = PLANTILLA_CONSULTA_CON_CONTEXTO.format(contexto="", consulta=consulta)
+    pasajes = await recuperar_contexto(consulta, min(RAG_PRESUPUESTO_TOKENS, presupuesto_documento(instrucciones)))
+    if not pasajes:
+        return consulta, []
+    contexto = '\n'.join(f"[{p['id']}] ({p['fuente']}) {p['texto']}" for p in pasajes)
+    return PLANTILLA_CONSULTA_CON_CONTEXTO.format(contexto=contexto, consulta=consulta), pasajes
+
 # Tarea programada para recordatorios
 async def check_recordatorios():
     await bot.wait_until_ready()
@@ -449,7 +2516,7 @@ async def on_ready():
     
     # Cargar syllabus si existe
     if os.path.exists("syllabus.pdf"):
-        syllabus_text = extract_text_from_pdf("syllabus.pdf")
+        syllabus_text = await cargar_syllabus("syllabus.pdf")
         if syllabus_text:
             print("📄 Syllabus legal cargado correctamente")
         else:
@@ -468,26 +2535,28 @@ async def on_message(message):
     
     # Comandos naturales (sin !)
     if not message.content.startswith('!'):
-        msg = message.content.lower()
+        # Solo se pliega la primera palabra para enrutar: el resto del mensaje lo normaliza
+        # una única vez el comando que lo recibe
+        partes = message.content.split(None, 1)
+        orden = normalizar_texto(partes[0]) if partes else ''
         
-        if msg.startswith(('preguntar ', 'consulta ', 'duda ')):
-            pregunta = message.content.split(' ', 1)[1]
+        if orden in ('preguntar', 'consulta', 'duda') and len(partes) > 1:
             ctx = await bot.get_context(message)
-            await ctx.invoke(bot.get_command('preguntar'), pregunta=pregunta)
+            await ctx.invoke(bot.get_command('preguntar'), pregunta=partes[1])
             return
         
-        elif msg.startswith(('asistente ', 'ia ', 'chat ', 'ai ', 'abogado ', 'analizar ')):
-            mensaje = message.content.split(' ', 1)[1]
+        elif orden in ('asistente', 'ia', 'chat', 'ai', 'abogado', 'analizar') and len(partes) > 1:
             ctx = await bot.get_context(message)
-            await ctx.invoke(bot.get_command('asistente'), mensaje=mensaje)
+            await ctx.invoke(bot.get_command('asistente'), mensaje=partes[1])
             return
         
-        elif msg in ['hola', 'saludos', 'hi', 'hello', 'buenos días']:
+        msg = normalizar_mensaje(message.content, message.id).plegado
+        if msg in ['hola', 'saludos', 'hi', 'hello', 'buenos dias']:
             ctx = await bot.get_context(message)
             await ctx.invoke(bot.get_command('hola'))
             return
         
-        elif msg in ['estadisticas', 'estadísticas', 'métricas', 'métricas']:
+        elif msg in ['estadisticas', 'metricas']:
             ctx = await bot.get_context(message)
             await ctx.invoke(bot.get_command('estadisticas'))
             return
@@ -511,24 +2580,38 @@ async def analizar_documento(ctx, documento_url: str = None):
         
         processing_msg = await ctx.send("📄 **Abogado Junior analizando documento...** ⚖️")
         
+        # Solo se extrae lo que el plan del usuario puede llegar a analizar
+        nivel_usuario = planificador_ia.nivel_de(ctx.author)
+        limite_extraccion = max_caracteres_extraccion(nivel_usuario)
         texto_documento = ""
         nombre_documento = ""
+        huella = None
+        en_cache = None
         
         if documento_url:
-            # Descargar desde URL (implementación básica)
+            # Descarga en streaming con caché HTTP; los PDF van al pool de extracción
             try:
-                response = requests.get(documento_url, timeout=10)
-                if response.status_code == 200:
-                    # Aquí se podría implementar extracción de texto según el tipo
-                    texto_documento = "Contenido del documento desde URL (análisis simulado)"
-                    nombre_documento = documento_url.split('/')[-1]
-                else:
-                    await processing_msg.delete()
-                    await ctx.send("❌ No se pudo descargar el documento desde la URL")
-                    return
-            except:
+                documento = await descargador_documentos.descargar(documento_url)
+            except ErrorDescarga as e:
                 await processing_msg.delete()
-                await ctx.send("❌ Error al acceder a la URL proporcionada")
+                await ctx.send(f"❌ {e}")
+                return
+            nombre_documento = documento.nombre
+            
+            if cache_documentos is not None:
+                huella = await huella_contenido(documento.ruta, limite_extraccion)
+                en_cache = await asyncio.to_thread(cache_documentos.obtener, huella)
+            if en_cache:
+                texto_documento = en_cache['texto']
+            elif documento.tipo == 'pdf':
+                texto_documento = await extraer_texto_pdf(documento.ruta, limite_extraccion,
+                                                          MAX_PAGINAS_EXTRACCION)
+            else:
+                texto_documento = await asyncio.to_thread(documento.texto, limite_extraccion)
+            
+            if not texto_documento:
+                await processing_msg.delete()
+                await ctx.send("❌ No se pudo extraer texto del documento")
                 return
         else:
             # Procesar archivo adjunto
@@ -536,10 +2619,16 @@ async def analizar_documento(ctx, documento_url: str = None):
             nombre_documento = archivo.filename
             
             if nombre_documento.lower().endswith('.pdf'):
-                # Guardar temporalmente y extraer texto
-                await archivo.save(f"temp_{nombre_documento}")
-                texto_documento = extract_text_from_pdf(f"temp_{nombre_documento}")
-                os.remove(f"temp_{nombre_documento}")
+                # Leer en memoria (o en un temporal único si es muy grande) y extraer texto
+                async with contenido_adjunto(archivo) as contenido:
+                    if cache_documentos is not None:
+                        huella = await huella_contenido(contenido, limite_extraccion)
+                        en_cache = await asyncio.to_thread(cache_documentos.obtener, huella)
+                    if en_cache:
+                        texto_documento = en_cache['texto']
+                    else:
+                        texto_documento = await extraer_texto_pdf(contenido, limite_extraccion,
+                                                                  MAX_PAGINAS_EXTRACCION)
                 
                 if not texto_documento:
                     await processing_msg.delete()
@@ -549,32 +2638,68 @@ async def analizar_documento(ctx, documento_url: str = None):
                 # Para otros tipos de archivo (simulado)
                 texto_documento = f"Contenido del documento {nombre_documento} (análisis simulado)"
         
-        # Análisis con IA
-        prompt_analisis = f"""
-        Como abogado junior, analiza este documento legal y proporciona un dictamen profesional:
-        
-        DOCUMENTO: {nombre_documento}
-        CONTENIDO: {texto_documento[:3000]}
-        
-        Proporciona un análisis estructurado con:
-        1. 📋 Tipo de documento identificado
-        2. ⚖️ Área jurídica principal y secundarias
-        3. 🔍 Puntos clave relevantes
-        4. ⚠️ Posibles problemas o irregularidades
-        5. 💡 Recomendaciones y próximos pasos
-        
-        Mantén el tono de un abogado junior: profesional pero reconociendo limitaciones.
-        """
+        if en_cache and en_cache['analisis'] and 'area_juridica' in en_cache['analisis']:
+            area_juridica = en_cache['analisis']['area_juridica']
+        else:
+            area_juridica = areas_principales([texto_documento])[0]
         
-        analisis = ai_assistant.get_response(prompt_analisis)
+        marca = None
+        aviso_parcial = None
+        if en_cache and en_cache['dictamen'] and en_cache['version'] == VERSION_ANALISIS:
+            # Mismo documento y misma plantilla: no hace falta volver a consultar a la IA ni gastar cuota
+            analisis = en_cache['dictamen']
+            fecha_cache = datetime.datetime.fromtimestamp(en_cache['creado']).strftime("%Y-%m-%d %H:%M")
+            marca = f"♻️ Análisis en caché del {fecha_cache}"
+            aviso_parcial = (en_cache['analisis'] or {}).get('aviso_parcial')
+        else:
+            # Cada fragmento es una llamada a la IA: se cobran todas, no una por documento
+            maximo = max_fragmentos_nivel(nivel_usuario)
+            fragmentos, total_fragmentos = await asyncio.to_thread(fragmentos_documento, nombre_documento,
+                                                                   texto_documento, maximo)
+            nivel = await reservar_consulta_ia(ctx, coste_analisis(fragmentos))
+            if nivel is None:
+                await processing_msg.delete()
+                return
+            # Texto recortado en la extracción o fragmentos descartados: el dictamen no cubre todo
+            if fragmentos and (len(texto_documento) >= limite_extraccion or total_fragmentos > len(fragmentos)):
+                aviso_parcial = (f"Por el límite de tu plan ({nivel}) solo se analizaron las {len(fragmentos)} "
+                                 f"secciones más relevantes del documento.")
+            
+            # Análisis con IA en una tarea aparte, para que !cancelar pueda detenerlo
+            tarea = asyncio.create_task(analizar_documento_ia(nombre_documento, texto_documento, fragmentos,
+                                                              total_fragmentos - len(fragmentos), nivel,
+                                                              processing_msg))
+            analisis_en_curso.setdefault(ctx.author.id, set()).add(tarea)
+            try:
+                analisis = await tarea
+            except asyncio.CancelledError:
+                if tarea in analisis_en_curso.get(ctx.author.id, ()):
+                    # No lo canceló el usuario: se está cerrando el bot
+                    raise
+                await processing_msg.delete()
+                await ctx.send("🛑 Análisis del documento cancelado.")
+                return
+            finally:
+                tareas_usuario = analisis_en_curso.get(ctx.author.id)
+                if tareas_usuario is not None:
+                    tareas_usuario.discard(tarea)
+                    if not tareas_usuario:
+                        del analisis_en_curso[ctx.author.id]
+            
+            if huella:
+                # Las respuestas de error no se guardan: el siguiente intento debe llegar a la IA
+                dictamen = analisis if analisis not in (MENSAJE_IA_NO_DISPONIBLE, MENSAJE_NO_JURIDICO) else None
+                await asyncio.to_thread(cache_documentos.guardar, huella, nombre_documento, texto_documento,
+                                        {'area_juridica': area_juridica, 'aviso_parcial': aviso_parcial},
+                                        dictamen, VERSION_ANALISIS)
         
         # Guardar análisis en base de datos
         try:
             conn = sqlite3.connect('bufete_legal.db')
             c = conn.cursor()
             fecha_analisis = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-            c.execute("INSERT INTO documentos (nombre, tipo, contenido, usuario_id, fecha_analisis) VALUES (?, ?, ?, ?, ?)",
-                     (nombre_documento, "analizado", texto_documento[:1000], ctx.author.id, fecha_analisis))
+            c.execute("INSERT INTO documentos (nombre, tipo, contenido, usuario_id, fecha_analisis, area_juridica) VALUES (?, ?, ?, ?, ?, ?)",
+                     (nombre_documento, "analizado", texto_documento[:1000], ctx.author.id, fecha_analisis, area_juridica))
             conn.commit()
             conn.close()
         except Exception as e:
@@ -594,6 +2719,10 @@ async def analizar_documento(ctx, documento_url: str = None):
                 )
                 if i == 0:
                     embed.set_author(name=f"Análisis de {nombre_documento}")
+                    if aviso_parcial:
+                        embed.add_field(name="📑 Análisis parcial", value=aviso_parcial, inline=False)
+                    if marca:
+                        embed.set_footer(text=marca)
                 await ctx.send(embed=embed)
         else:
             embed = discord.Embed(
@@ -602,13 +2731,26 @@ async def analizar_documento(ctx, documento_url: str = None):
                 color=0x0099ff
             )
             embed.set_author(name=f"Análisis de {nombre_documento}")
-            embed.set_footer(text="Análisis realizado por Abogado Junior - Revisar con socio senior")
+            if aviso_parcial:
+                embed.add_field(name="📑 Análisis parcial", value=aviso_parcial, inline=False)
+            pie = "Análisis realizado por Abogado Junior - Revisar con socio senior"
+            embed.set_footer(text=f"{marca} · {pie}" if marca else pie)
             await ctx.send(embed=embed)
             
     except Exception as e:
         logger.error(f"Error analizando documento: {e}")
         await ctx.send("❌ Error procesando el documento. Intenta más tarde.")
 
+@bot.command()
+async def cancelar(ctx):
+    """Cancela los análisis de documento en curso del usuario"""
+    tareas = [tarea for tarea in analisis_en_curso.pop(ctx.author.id, ()) if not tarea.done()]
+    if not tareas:
+        await ctx.send("ℹ️ No tienes ningún análisis de documento en curso.")
+        return
+    for tarea in tareas:
+        tarea.cancel()
+
 @bot.command()
 async def estadisticas(ctx, tipo: str = "general"):
     """Genera estadísticas y gráficos del bufete"""
@@ -694,6 +2836,45 @@ async def estadisticas(ctx, tipo: str = "general"):
             else:
                 await ctx.send("ℹ️ No hay documentos analizados para generar estadísticas.")
         
+        elif tipo == "cache":
+            # Estadísticas de la caché de respuestas de IA
+            if ai_assistant.cache is None:
+                await ctx.send("ℹ️ La caché de respuestas está desactivada.")
+            else:
+                datos = ai_assistant.cache.estadisticas()
+                embed = discord.Embed(
+                    title="🗄️ Caché de Respuestas IA",
+                    description="Aciertos y fallos desde el último arranque",
+                    color=0x00ff00
+                )
+                embed.add_field(name="⚡ Aciertos en memoria", value=str(datos['aciertos_memoria']), inline=True)
+                embed.add_field(name="💾 Aciertos en disco", value=str(datos['aciertos_disco']), inline=True)
+                embed.add_field(name="❌ Fallos", value=str(datos['fallos']), inline=True)
+                embed.add_field(name="🎯 Tasa de aciertos", value=f"{datos['tasa_aciertos']:.1%}", inline=True)
+                embed.add_field(name="🔗 Consultas coalescidas", value=str(ai_assistant.peticiones_coalescidas), inline=True)
+                if cache_documentos is not None:
+                    embed.add_field(name="📄 Documentos en caché (aciertos/fallos)",
+                                    value=f"{cache_documentos.aciertos}/{cache_documentos.fallos}", inline=True)
+                await ctx.send(embed=embed)
+        
+        elif tipo == "regex":
+            # Perfil de las expresiones regulares (requiere PERFILAR_REGEX=1)
+            if not REGISTRO_REGEX.perfilar:
+                await ctx.send("ℹ️ El perfilado de expresiones regulares está desactivado (PERFILAR_REGEX=1).")
+            else:
+                embed = discord.Embed(
+                    title="🔎 Perfil de Expresiones Regulares",
+                    description="Llamadas, coincidencias y tiempo acumulado por patrón",
+                    color=0x00ff00
+                )
+                for perfil in REGISTRO_REGEX.estadisticas():
+                    embed.add_field(
+                        name=perfil['nombre'],
+                        value=f"{perfil['llamadas']} llamadas · {perfil['coincidencias']} coincidencias · {perfil['tiempo'] * 1000:.2f} ms",
+                        inline=False
+                    )
+                await ctx.send(embed=embed)
+        
         conn.close()
         await processing_msg.delete()
         
@@ -701,6 +2882,29 @@ async def estadisticas(ctx, tipo: str = "general"):
         logger.error(f"Error generando estadísticas: {e}")
         await ctx.send("❌ Error generando estadísticas. Intenta más tarde.")
 
+async def aviso_solo_administradores(ctx, error):
+    """Errores de los comandos de mantenimiento, reservados a los administradores del servidor"""
+    if isinstance(error, commands.CheckFailure):
+        await ctx.send("🔒 Este comando solo está disponible para administradores del servidor.")
+    else:
+        logger.error(f"Error en !{ctx.command}: {error}")
+
+@bot.command()
+@commands.guild_only()
+@commands.has_permissions(administrator=True)
+async def reetiquetar(ctx):
+    """Recalcula el área jurídica de todos los documentos archivados (solo administradores)"""
+    processing_msg = await ctx.send("🏷️ Reetiquetando documentos archivados...")
+    try:
+        inicio = time.perf_counter()
+        etiquetados = await asyncio.to_thread(reetiquetar_documentos)
+        await processing_msg.edit(content=f"✅ {etiquetados} documentos etiquetados en {time.perf_counter() - inicio:.1f} s")
+    except Exception as e:
+        logger.error(f"Error reetiquetando documentos: {e}")
+        await processing_msg.edit(content="❌ Error reetiquetando documentos. Intenta más tarde.")
+
+reetiquetar.error(aviso_solo_administradores)
+
 # @bot.command()
 # async def nuevo_caso(ctx, cliente: str, tipo: str, prioridad: str = "media", *, descripcion: str):
 #     """Crea un nuevo caso legal con prioridad"""
@@ -846,11 +3050,134 @@ async def mis_casos(ctx, estado: str = "todos"):
     except Exception as e:
         await ctx.send(f"❌ Error recuperando casos: {str(e)}")
 
+def embed_asistente(respuesta: str, mensaje: str, pasajes: Optional[list] = None) -> discord.Embed:
+    """Embed de respuesta del asistente (se reutiliza para las ediciones parciales)"""
+    embed = discord.Embed(
+        title="🧠 Asistente Jurídico IA",
+        description=respuesta,
+        color=0x0099ff
+    )
+    embed.add_field(name="Consulta", value=mensaje, inline=False)
+    if pasajes:
+        # Solo las fuentes que la respuesta cita (todas mientras aún se está generando)
+        citadas = [p for p in pasajes if f"[{p['id']}]" in respuesta] or pasajes
+        embed.add_field(name="📚 Fuentes", value='\n'.join(f"[{p['id']}] {p['fuente']}" for p in citadas)[:1024],
+                        inline=False)
+    embed.set_footer(text="Respuesta generada por Abogado Junior IA | Revisar con socio senior para casos específicos")
+    return embed
+
+async def editar_en_streaming(mensaje_discord, fragmentos, construir_embed, max_length=2800) -> str:
+    """Edita un mensaje con el texto parcial a un ritmo seguro para el rate limit de Discord"""
+    partes = []
+    ultima_edicion = 0.0
+    async for fragmento in fragmentos:
+        partes.append(fragmento)
+        ahora = time.monotonic()
+        if ahora - ultima_edicion < STREAM_INTERVALO_EDICION:
+            continue
+        parcial = ''.join(partes)
+        if len(parcial) > max_length:
+            # El resto solo se verá en la edición final ya recortada
+            continue
+        try:
+            await mensaje_discord.edit(content=None, embed=construir_embed(parcial + " ▌"))
+        except discord.HTTPException as e:
+            logger.warning(f"No se pudo editar el mensaje en streaming: {e}")
+        ultima_edicion = ahora
+    return ''.join(partes)
+
+@bot.command()
+async def buscar_corpus(ctx, *, consulta):
+    """Busca en el corpus jurídico indexado y muestra los fragmentos más relevantes"""
+    try:
+        resultados = await asyncio.to_thread(corpus_juridico.buscar, consulta, 5)
+        if not resultados:
+            await ctx.send("🔎 No encontré fragmentos del corpus que coincidan con tu búsqueda.")
+            return
+        
+        embed = discord.Embed(
+            title="📖 Corpus Jurídico",
+            description=f"Resultados para: {consulta[:200]}",
+            color=0x0099ff
+        )
+        for resultado in resultados:
+            ubicacion = f"{os.path.basename(resultado['ruta'])} · pág. {resultado['pagina']}"
+            if resultado['seccion']:
+                ubicacion += f" · {resultado['seccion'][:60]}"
+            embed.add_field(name=f"[#{resultado['id']}] {ubicacion}"[:256],
+                            value=' '.join(resultado['extracto'].split())[:1024], inline=False)
+        embed.set_footer(text="Fragmentos ordenados por relevancia (BM25)")
+        await ctx.send(embed=embed)
+    except Exception as e:
+        logger.error(f"Error buscando en el corpus: {e}")
+        await ctx.send("❌ Error buscando en el corpus. Intenta más tarde.")
+
+@bot.command()
+@commands.guild_only()
+@commands.has_permissions(administrator=True)
+async def indexar_corpus(ctx):
+    """Indexa los PDF nuevos o modificados del directorio del corpus (solo administradores)"""
+    global ingesta_corpus
+    if ingesta_corpus is not None and not ingesta_corpus.done():
+        await ctx.send("⏳ Ya hay una indexación del corpus en curso.")
+        return
+    
+    processing_msg = await ctx.send(f"🗂️ Indexando el corpus jurídico ({CORPUS_DIR})...")
+    inicio = time.perf_counter()
+    ingesta_corpus = asyncio.create_task(ingerir_corpus())
+    try:
+        codigo = await ingesta_corpus
+        if codigo != 0:
+            raise RuntimeError(f"la ingesta terminó con código {codigo}")
+        datos = await asyncio.to_thread(corpus_juridico.estadisticas)
+        await processing_msg.edit(content=(
+            f"✅ Corpus indexado en {time.perf_counter() - inicio:.1f} s: {datos['documentos']} documentos, "
+            f"{datos['paginas']} páginas, {datos['fragmentos']} fragmentos"))
+    except Exception as e:
+        logger.error(f"Error indexando el corpus: {e}")
+        await processing_msg.edit(content="❌ Error indexando el corpus. Intenta más tarde.")
+
+indexar_corpus.error(aviso_solo_administradores)
+
+@bot.command()
+async def preguntar(ctx, *, pregunta):
+    """Responde preguntas sobre el syllabus de derecho con los pasajes más relevantes"""
+    if artefacto_syllabus is None:
+        await ctx.send("❌ El syllabus no está disponible.")
+        return
+    
+    if not ai_assistant.is_legal_related(pregunta, ctx.message.id):
+        await ctx.send("⚠️ Solo puedo responder preguntas sobre derecho y asuntos jurídicos.")
+        return
+    
+    try:
+        # Búsqueda BM25 en el índice del syllabus (sin palabras vacías y con stemming ligero)
+        resultados = artefacto_syllabus.buscar(pregunta, k=3)
+        if resultados:
+            respuesta = "\n\n".join(
+                f"**[§{indice} · {puntuacion:.2f}]** {' '.join(texto.split())[:320]}"
+                for indice, puntuacion, texto in resultados
+            )
+        else:
+            respuesta = "No encontré información específica sobre eso en el syllabus."
+        
+        embed = discord.Embed(
+            title="📚 Respuesta del Syllabus Legal",
+            description=respuesta,
+            color=0x00ff00
+        )
+        embed.add_field(name="Pregunta", value=pregunta[:1024], inline=False)
+        embed.set_footer(text="Información basada en el syllabus del curso de derecho")
+        await ctx.send(embed=embed)
+    except Exception as e:
+        logger.error(f"Error procesando pregunta: {e}")
+        await ctx.send("❌ Error procesando tu pregunta. Intenta de nuevo.")
+
 @bot.command()
 async def asistente(ctx, *, mensaje):
     """Pregunta al asistente de IA especializado en derecho"""
     try:
-        if not ai_assistant.is_legal_related(mensaje):
+        if not ai_assistant.is_legal_related(mensaje, ctx.message.id):
             embed = discord.Embed(
                 title="🚫 Tema No Jurídico",
                 description="Como abogado junior, solo puedo responder preguntas sobre derecho y asuntos jurídicos.",
@@ -865,21 +3192,41 @@ async def asistente(ctx, *, mensaje):
             await ctx.send(embed=embed)
             return
         
-        processing_msg = await ctx.send("⚖️ Abogado Junior procesando tu consulta...")
+        # Contexto recuperado del syllabus, la base de conocimiento y el corpus indexado. El tema
+        # ya se validó sobre el mensaje: el prompt aumentado no vuelve a pasar por el clasificador
+        prompt, pasajes = await construir_prompt_asistente(mensaje)
+        # Con contexto el prompt ya no es el texto del mensaje: se cachea por su contenido
+        id_mensaje = None if pasajes else ctx.message.id
         
-        respuesta = ai_assistant.get_response(mensaje)
-        respuesta = limitar_respuesta_inteligente(respuesta, 2800)
+        # Las respuestas ya cacheadas no consumen cupo ni esperan en la cola
+        respuesta = await ai_assistant.respuesta_en_cache(prompt, id_mensaje)
+        if respuesta:
+            await ctx.send(embed=embed_asistente(limitar_respuesta_inteligente(respuesta, 2800), mensaje, pasajes))
+            return
         
-        embed = discord.Embed(
-            title="🧠 Asistente Jurídico IA",
-            description=respuesta,
-            color=0x0099ff
-        )
-        embed.add_field(name="Consulta", value=mensaje, inline=False)
-        embed.set_footer(text="Respuesta generada por Abogado Junior IA | Revisar con socio senior para casos específicos")
+        nivel = await reservar_consulta_ia(ctx)
+        if nivel is None:
+            return
         
-        await processing_msg.delete()
-        await ctx.send(embed=embed)
+        processing_msg = await ctx.send("⚖️ Abogado Junior procesando tu consulta...")
+        
+        async with planificador_ia.turno(nivel, aviso_cola(processing_msg)):
+            if STREAMING_IA:
+                respuesta = await editar_en_streaming(
+                    processing_msg,
+                    ai_assistant.stream_response(prompt, id_mensaje, comprobar_tema=False),
+                    lambda parcial: embed_asistente(parcial, mensaje, pasajes)
+                )
+            else:
+                respuesta = await ai_assistant.get_response(prompt, id_mensaje, comprobar_tema=False)
+        if respuesta.endswith(MENSAJE_RESPUESTA_INTERRUMPIDA):
+            # El aviso de respuesta incompleta se conserva aunque haya que recortar el texto
+            parcial = respuesta[:-len(MENSAJE_RESPUESTA_INTERRUMPIDA)]
+            respuesta = limitar_respuesta_inteligente(parcial, 2800 - len(MENSAJE_RESPUESTA_INTERRUMPIDA)) + MENSAJE_RESPUESTA_INTERRUMPIDA
+        else:
+            respuesta = limitar_respuesta_inteligente(respuesta, 2800)
+        
+        await processing_msg.edit(content=None, embed=embed_asistente(respuesta, mensaje, pasajes))
         
     except Exception as e:
         logger.error(f"Error con asistente IA: {e}")
@@ -918,8 +3265,13 @@ async def ayuda(ctx):
     
     embed.add_field(name="`!hola`", value="Presentación del abogado junior", inline=False)
     embed.add_field(name="`!analizar_documento [url]`", value="Analiza un documento legal adjunto o desde URL", inline=False)
+    embed.add_field(name="`!cancelar`", value="Cancela los análisis de documento en curso", inline=False)
+    embed.add_field(name="`!preguntar [pregunta]`", value="Busca la respuesta en el syllabus del curso", inline=False)
+    embed.add_field(name="`!buscar_corpus [consulta]`", value="Busca en los códigos, leyes y memorandos indexados", inline=False)
+    embed.add_field(name="`!indexar_corpus`", value="Indexa los PDF nuevos o modificados del corpus (solo administradores)", inline=False)
     embed.add_field(name="`!asistente [pregunta]` o `abogado [pregunta]`", value="Consulta al asistente jurídico IA", inline=False)
-    embed.add_field(name="`!estadisticas [tipo]`", value="Genera estadísticas del bufete (general, casos, documentos)", inline=False)
+    embed.add_field(name="`!estadisticas [tipo]`", value="Genera estadísticas del bufete (general, casos, documentos, cache, regex)", inline=False)
+    embed.add_field(name="`!reetiquetar`", value="Recalcula el área jurídica de los documentos archivados (solo administradores)", inline=False)
     embed.add_field(name="`!nuevo_caso [cliente] [tipo] [prioridad] [descripción]`", value="Crea un nuevo caso legal", inline=False)
     embed.add_field(name="`!mis_casos [estado]`", value="Muestra tus casos (todos, abiertos, cerrados)", inline=False)
     embed.add_field(name="`!recordatorio [caso_id] [días] [mensaje]`", value="Programa un recordatorio para un caso", inline=False)
@@ -13,6 +13,7 @@ import sqlite3
 import datetime
 from datetime import timedelta
 import asyncio
+from artefacto_syllabus import obtener_artefacto
 
 # Base de datos simple para casos
 def init_db():
@@ -66,6 +67,7 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 
 # Variables globales
 syllabus_text = None
+indice_syllabus = None  # Índice BM25 de los pasajes del syllabus
 
 # TÉRMINOS JURÍDICOS
 LEGAL_TERMS = [
@@ -447,13 +449,15 @@ async def check_recordatorios():
 
 @bot.event
 async def on_ready():
-    global syllabus_text
+    global syllabus_text, indice_syllabus
     
     print(f'✅ Bot {bot.user} conectado!')
     print(f'📊 En {len(bot.guilds)} servidores')
     
-    # Cargar syllabus
-    syllabus_text = extract_text_from_pdf("syllabus.pdf")
+    # Cargar syllabus desde su índice precompilado
+    if indice_syllabus is None or not indice_syllabus.vigente("syllabus.pdf"):
+        indice_syllabus = obtener_artefacto("syllabus.pdf")
+    syllabus_text = indice_syllabus.texto if indice_syllabus else extract_text_from_pdf("syllabus.pdf")
     if syllabus_text:
         print("📄 Syllabus legal cargado correctamente")
     else:
@@ -593,7 +597,7 @@ async def consultoria(ctx, *, pregunta: str):
 @bot.command()
 async def preguntar(ctx, *, pregunta):
     """Responde preguntas sobre el syllabus de derecho"""
-    global syllabus_text
+    global syllabus_text, indice_syllabus
     
     if not syllabus_text:
         await ctx.send("❌ El syllabus no está disponible.")
@@ -615,20 +619,15 @@ async def preguntar(ctx, *, pregunta):
         return
     
     try:
-        # Búsqueda simple en el texto del syllabus
-        pregunta_lower = pregunta.lower()
-        
-        # Buscar coincidencias relevantes
-        lineas_relevantes = []
-        for linea in syllabus_text.split('\n'):
-            if any(palabra in linea.lower() for palabra in pregunta_lower.split()):
-                if len(linea.strip()) > 20:  # Solo líneas con contenido
-                    lineas_relevantes.append(linea.strip())
-        
-        if lineas_relevantes:
-            respuesta = "\n".join(lineas_relevantes[:3])  # Máximo 3 líneas
-            if len(respuesta) > 1000:
-                respuesta = respuesta[:1000]
+        # Búsqueda BM25 en el índice del syllabus (sin palabras vacías y con stemming ligero)
+        resultados = indice_syllabus.buscar(pregunta, k=3) if indice_syllabus else []
+        
+        if resultados:
+            # Cada pasaje con su identificador y su puntuación de relevancia
+            respuesta = "\n\n".join(
+                f"**[§{indice} · {puntuacion:.2f}]** {' '.join(texto.split())[:320]}"
+                for indice, puntuacion, texto in resultados
+            )
         else:
             respuesta = "No encontré información específica sobre eso en el syllabus."
         
@@ -0,0 +1,184 @@
+"""Proveedor de IA simulado, compatible con la API de chat de OpenAI que usan Groq y OpenRouter.
+
+Permite medir el rendimiento del bot y ejecutar pruebas de carga sin conexión:
+
+    python mock_proveedor_ia.py --puerto 8081 --latencia lognormal --media 1.5 --error 0.02 --tasa-429 0.05
+
+    GROQ_BASE_URL=http://127.0.0.1:8081 OPENROUTER_BASE_URL=http://127.0.0.1:8081 python main.py
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rutas que usa AIAssistant (Groq y OpenRouter respectivamente)
+RUTAS_CHAT = ["/openai/v1/chat/completions", "/api/v1/chat/completions"]
+
+RESPUESTA_BASE = (
+    "👨‍⚖️ **Análisis preliminar (respuesta simulada)**\n\n"
+    "📋 **Tipo identificado:** Consulta jurídica general\n"
+    "⚖️ **Área jurídica:** Derecho civil\n\n"
+    "🔍 **Puntos relevantes:**\n"
+    "• Revisar los requisitos de validez del contrato (Art. 1261 Código Civil).\n"
+    "• Comprobar los plazos aplicables, normalmente 30 días desde la notificación.\n\n"
+    "⚖️ **Aviso Legal:** Este es un análisis preliminar realizado por un abogado junior."
+)
+
+class ProveedorSimulado:
+    """Estado y comportamiento configurable del servidor simulado"""
+    def __init__(self, args):
+        self.args = args
+        self.aleatorio = random.Random(args.semilla)
+        self.peticiones = deque()
+        self.total = 0
+        self.errores = 0
+        self.limitadas = 0
+
+    def latencia(self) -> float:
+        """Tiempo hasta el primer token según la distribución configurada (segundos)"""
+        media = self.args.media
+        if self.args.latencia == 'fija':
+            return media
+        if self.args.latencia == 'uniforme':
+            return self.aleatorio.uniform(max(0.0, media - self.args.dispersion), media + self.args.dispersion)
+        if self.args.latencia == 'exponencial':
+            return self.aleatorio.expovariate(1 / media) if media > 0 else 0.0
+        # lognormal: cola larga, parecida a la de un proveedor real bajo carga
+        sigma = self.args.dispersion
+        mu = math.log(media) - sigma ** 2 / 2 if media > 0 else 0.0
+        return self.aleatorio.lognormvariate(mu, sigma) if media > 0 else 0.0
+
+    def _cabeceras_limite(self) -> dict:
+        ahora = time.monotonic()
+        while self.peticiones and ahora - self.peticiones[0] > 60:
+            self.peticiones.popleft()
+        restantes = max(0, self.args.limite_rpm - len(self.peticiones)) if self.args.limite_rpm else 1000
+        reinicio = 60 - (ahora - self.peticiones[0]) if self.peticiones else 0
+        return {
+            "x-ratelimit-limit-requests": str(self.args.limite_rpm or 1000),
+            "x-ratelimit-remaining-requests": str(restantes),
+            "x-ratelimit-reset-requests": f"{max(0.0, reinicio):.2f}s"
+        }
+
+    def _limitada(self) -> bool:
+        """Decide si la petición recibe un 429 (límite por minuto real o aleatorio)"""
+        if self.args.limite_rpm and len(self.peticiones) >= self.args.limite_rpm:
+            return True
+        return self.aleatorio.random() < self.args.tasa_429
+
+    def _texto(self, payload: dict) -> str:
+        pregunta = ""
+        for mensaje in payload.get("messages", []):
+            if mensaje.get("role") == "user":
+                pregunta = mensaje.get("content", "")
+        resumen = " ".join(pregunta.split()[:20])
+        texto = f"Consulta recibida: {resumen}\n\n{RESPUESTA_BASE}"
+        palabras = texto.split(" ")
+        max_tokens = payload.get("max_tokens") or len(palabras)
+        return " ".join(palabras[:max_tokens])
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.total += 1
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"error": {"message": "Falta la API key"}}, status=401)
+
+        try:
+            payload = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": {"message": "JSON no válido"}}, status=400)
+
+        cabeceras = self._cabeceras_limite()
+        if self._limitada():
+            self.limitadas += 1
+            cabeceras["retry-after"] = str(self.args.retry_after)
+            cabeceras["x-ratelimit-remaining-requests"] = "0"
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                                     status=429, headers=cabeceras)
+        self.peticiones.append(time.monotonic())
+
+        await asyncio.sleep(self.latencia())
+        if self.aleatorio.random() < self.args.error:
+            self.errores += 1
+            return web.json_response({"error": {"message": "Error interno simulado"}}, status=500, headers=cabeceras)
+
+        texto = self._texto(payload)
+        identificador = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        modelo = payload.get("model", "simulado")
+
+        if not payload.get("stream"):
+            return web.json_response({
+                "id": identificador,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": modelo,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(texto.split()), "total_tokens": len(texto.split())}
+            }, headers=cabeceras)
+
+        cabeceras["Content-Type"] = "text/event-stream"
+        cabeceras["Cache-Control"] = "no-cache"
+        respuesta = web.StreamResponse(status=200, headers=cabeceras)
+        await respuesta.prepare(request)
+        pausa = 1 / self.args.tokens_por_segundo if self.args.tokens_por_segundo > 0 else 0
+        palabras = texto.split(" ")
+        for indice, palabra in enumerate(palabras):
+            fragmento = palabra if indice == len(palabras) - 1 else palabra + " "
+            evento = {
+                "id": identificador,
+                "object": "chat.completion.chunk",
+                "model": modelo,
+                "choices": [{"index": 0, "delta": {"content": fragmento}, "finish_reason": None}]
+            }
+            await respuesta.write(f"data: {json.dumps(evento, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if pausa:
+                await asyncio.sleep(pausa)
+        await respuesta.write(b"data: [DONE]\n\n")
+        await respuesta.write_eof()
+        return respuesta
+
+    async def estado(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "peticiones": self.total,
+            "errores_simulados": self.errores,
+            "respuestas_429": self.limitadas
+        })
+
+def crear_app(args) -> web.Application:
+    proveedor = ProveedorSimulado(args)
+    app = web.Application()
+    for ruta in RUTAS_CHAT:
+        app.router.add_post(ruta, proveedor.chat)
+    app.router.add_get("/estado", proveedor.estado)
+    return app
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Proveedor de IA simulado compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8081)
+    parser.add_argument("--latencia", choices=["fija", "uniforme", "exponencial", "lognormal"], default="lognormal",
+                        help="Distribución del tiempo hasta el primer token")
+    parser.add_argument("--media", type=float, default=1.0, help="Latencia media en segundos")
+    parser.add_argument("--dispersion", type=float, default=0.5,
+                        help="Semiancho (uniforme) o sigma (lognormal) de la latencia")
+    parser.add_argument("--error", type=float, default=0.0, help="Probabilidad de responder 500")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Probabilidad de responder 429")
+    parser.add_argument("--limite-rpm", type=int, default=0, help="Peticiones por minuto antes de responder 429 (0 = sin límite)")
+    parser.add_argument("--retry-after", type=int, default=5, help="Valor de la cabecera Retry-After en los 429")
+    parser.add_argument("--tokens-por-segundo", type=float, default=50.0, help="Velocidad del streaming SSE")
+    parser.add_argument("--semilla", type=int, default=None, help="Semilla para resultados reproducibles")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    argumentos = parse_args()
+    logger.info(f"Proveedor simulado escuchando en http://{argumentos.host}:{argumentos.puerto}")
+    web.run_app(crear_app(argumentos), host=argumentos.host, port=argumentos.puerto, print=None)
@@ -0,0 +1,87 @@
+"""Expresiones regulares jurídicas compiladas una sola vez, con perfilado opcional.
+
+Módulo sin dependencias del bot, para que benchmark_regex.py pueda medir los patrones
+sin abrir las bases de datos ni cargar el clasificador.
+"""
+import re
+import time
+from typing import Optional
+
+class RegistroPatrones:
+    """Registro de expresiones regulares compiladas una sola vez al cargar el módulo.
+    
+    Con PERFILAR_REGEX=1 (o `perfilar = True`) anota por patrón las llamadas, las
+    coincidencias y el tiempo acumulado, para localizar patrones lentos.
+    """
+    def __init__(self, perfilar: bool = False):
+        self.patrones = {}
+        self.perfilar = perfilar
+        self.perfiles = {}
+    
+    def registrar(self, nombre: str, patron: str, flags: int = 0) -> re.Pattern:
+        compilado = re.compile(patron, flags)
+        self.patrones[nombre] = compilado
+        self.perfiles[nombre] = {'llamadas': 0, 'coincidencias': 0, 'tiempo': 0.0}
+        return compilado
+    
+    def _anotar(self, nombre: str, inicio: float, coincidencias: int):
+        perfil = self.perfiles[nombre]
+        perfil['llamadas'] += 1
+        perfil['coincidencias'] += coincidencias
+        perfil['tiempo'] += time.perf_counter() - inicio
+    
+    def search(self, nombre: str, texto: str) -> Optional[re.Match]:
+        if not self.perfilar:
+            return self.patrones[nombre].search(texto)
+        inicio = time.perf_counter()
+        resultado = self.patrones[nombre].search(texto)
+        self._anotar(nombre, inicio, resultado is not None)
+        return resultado
+    
+    def findall(self, nombre: str, texto: str) -> list:
+        if not self.perfilar:
+            return self.patrones[nombre].findall(texto)
+        inicio = time.perf_counter()
+        resultado = self.patrones[nombre].findall(texto)
+        self._anotar(nombre, inicio, len(resultado))
+        return resultado
+    
+    def finditer(self, nombre: str, texto: str) -> list:
+        if not self.perfilar:
+            return list(self.patrones[nombre].finditer(texto))
+        inicio = time.perf_counter()
+        resultado = list(self.patrones[nombre].finditer(texto))
+        self._anotar(nombre, inicio, len(resultado))
+        return resultado
+    
+    def alguno(self, nombres, texto: str) -> bool:
+        """True si alguno de los patrones indicados aparece en el texto"""
+        return any(self.search(nombre, texto) for nombre in nombres)
+    
+    def estadisticas(self) -> list:
+        """Perfiles ordenados por tiempo acumulado (el más costoso primero)"""
+        return sorted(({'nombre': nombre, **perfil} for nombre, perfil in self.perfiles.items()),
+                      key=lambda perfil: perfil['tiempo'], reverse=True)
+
+# El perfilado lo activa main.py con PERFILAR_REGEX=1
+REGISTRO_REGEX = RegistroPatrones()
+
+# Preguntas típicas de consulta jurídica, sobre el texto ya plegado (sin acentos). Los huecos
+# entre palabras clave están acotados a una misma frase ([^.?!\n]{0,N}) en lugar de `.*`, así
+# que cada intento de coincidencia tiene coste constante y la búsqueda sigue siendo lineal.
+PATRONES_CONSULTA_JURIDICA = {
+    'consulta_demandar': r'\bcomo\s+(?:demandar|demanda|reclamar)\b',
+    'consulta_que_hacer': r'\bque\s+(?:debo|deberia)\b[^.?!\n]{0,80}?\b(?:hacer|hacerlo|proceder)\b'
+                          r'[^.?!\n]{0,80}?\b(?:legal|ley|derecho)',
+    'consulta_redactar': r'\b(?:necesito|quiero)\s+(?:hacer|redactar)\b[^.?!\n]{0,80}?\b(?:contrato|testamento|poder)',
+    'consulta_duracion': r'\bcuanto\s+(?:tiempo|dura|tarda)\b[^.?!\n]{0,80}?\b(?:proceso|juicio|demanda)',
+    'consulta_derechos': r'\bque\s+(?:derechos|obligaciones)\b[^.?!\n]{0,80}?\b(?:tengo|tiene)\b',
+    'consulta_legalidad': r'\b(?:es|son)\s+(?:legal|legales|ilegal|ilegales)\b',
+}
+for _nombre, _patron in PATRONES_CONSULTA_JURIDICA.items():
+    REGISTRO_REGEX.registrar(_nombre, _patron)
+
+# Plazos ("30 días", "2 años") y referencias normativas ("Ley 1/2000", "art. 1261").
+# Los lookbehind impiden reintentar desde el interior de un número largo.
+REGISTRO_REGEX.registrar('plazos', r'(?<!\d)(\d{1,4})\s*(días|día|meses|mes|años|año)\b', re.IGNORECASE)
+REGISTRO_REGEX.registrar('referencias', r'(?<!\w)(ley|artículo|art|Ley|Artículo|Art)\.?\s*(\d+(?:[/\-]\d+)?)')
@@ -0,0 +1,41 @@
+import pytest
+
+from artefacto_syllabus import ArtefactoSyllabus, construir_artefacto, raiz_ligera
+
+# Singular y plural deben llegar a la misma raíz
+PARES_SINGULAR_PLURAL = [
+    ('base', 'bases'),
+    ('lune', 'lunes'),
+    ('mes', 'meses'),
+    ('ley', 'leyes'),
+    ('juez', 'jueces'),
+    ('voz', 'voces'),
+    ('eje', 'ejes'),
+    ('pena', 'penas'),
+    ('parte', 'partes'),
+    ('contrato', 'contratos'),
+    ('arrendador', 'arrendadores'),
+    ('pais', 'paises'),
+]
+
+@pytest.mark.parametrize('singular, plural', PARES_SINGULAR_PLURAL)
+def test_raiz_ligera_singular_y_plural(singular, plural):
+    assert raiz_ligera(singular) == raiz_ligera(plural)
+
+@pytest.mark.parametrize('token', ['art1261', 'ab', 'a'])
+def test_raiz_ligera_deja_tokens_cortos_o_no_alfabeticos(token):
+    assert raiz_ligera(token) == token
+
+def test_buscar_encuentra_plural_con_consulta_en_singular(tmp_path):
+    pdf = tmp_path / 'syllabus.pdf'
+    pdf.write_bytes(b'%PDF-1.4 de prueba')
+    texto = ("Las bases del contrato se fijan por escrito.\n\n"
+             "El pago vence los lunes de cada semana.\n\n"
+             "Texto sin relación con lo buscado.")
+    ruta = construir_artefacto(str(pdf), str(tmp_path / 'syllabus.idx'), texto=texto)
+    artefacto = ArtefactoSyllabus(ruta)
+    try:
+        assert artefacto.buscar('base', k=1)[0][0] == 0
+        assert artefacto.buscar('lunes', k=1)[0][0] == 1
+    finally:
+        artefacto.cerrar()
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from corpus_juridico import CorpusJuridico, consulta_fts
+
+FRAGMENTOS = [
+    "Las leyes procesales fijan los plazos de cada instancia.",
+    "Los jueces resolverán en el plazo de tres meses.",
+    "Las bases de la convocatoria se publicarán en el boletín.",
+    "El contrato de arrendamiento se renueva cada año.",
+]
+
+@pytest.fixture
+def corpus(tmp_path):
+    corpus = CorpusJuridico(str(tmp_path / 'corpus.db'))
+    conn = corpus._conectar()
+    conn.execute("INSERT INTO documentos (huella, ruta, tamano, mtime_ns, paginas, fragmentos, indexado) "
+                 "VALUES ('h', 'codigo.pdf', 0, 0, 1, ?, ?)", (len(FRAGMENTOS), time.time()))
+    conn.executemany("INSERT INTO fragmentos (huella, pagina, seccion, texto) VALUES ('h', 1, NULL, ?)",
+                     [(texto,) for texto in FRAGMENTOS])
+    conn.commit()
+    conn.close()
+    return corpus
+
+@pytest.mark.parametrize('consulta, esperado', [
+    ('leyes', FRAGMENTOS[0]),
+    ('jueces', FRAGMENTOS[1]),
+    ('meses', FRAGMENTOS[1]),
+    ('bases', FRAGMENTOS[2]),
+    ('contratos', FRAGMENTOS[3]),
+])
+def test_buscar_encuentra_la_palabra_tal_cual(corpus, consulta, esperado):
+    resultados = corpus.buscar(consulta, k=1)
+    assert resultados and resultados[0]['texto'] == esperado
+
+def test_consulta_fts_sin_terminos_utiles():
+    assert consulta_fts('de la y el') is None